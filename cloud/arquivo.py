@@ -0,0 +1,149 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+# Mensagens mais velhas que isso saem da tabela quente (0 = arquivamento desligado)
+ARQUIVO_IDADE_DIAS = float(os.environ.get("ARQUIVO_IDADE_DIAS", "0"))
+ARQUIVO_DIR = os.environ.get("ARQUIVO_DIR", "arquivo")
+ARQUIVO_INTERVALO_SEG = float(os.environ.get("ARQUIVO_INTERVALO_SEG", "3600"))
+LOTE_ARQUIVO = 1000
+# Cada mês é dividido em baldes por telefone: ler o histórico de uma conversa
+# abre 1/BALDES do mês, não o mês inteiro.
+BALDES = 64
+
+
+class ArquivoMensagens:
+    """
+    Arquivo frio das mensagens: JSON Lines comprimido com gzip, particionado
+    por mês e por balde de telefone (ARQUIVO_DIR/2025-03/1f.jsonl.gz).
+
+    Cada gravação anexa um novo membro gzip ao arquivo (o formato permite),
+    então não é preciso reescrever nada. Se o job cair no meio, a próxima
+    rodada pode gravar a mesma mensagem de novo: a leitura descarta ids repetidos.
+    """
+
+    def __init__(self, raiz: str = ARQUIVO_DIR):
+        self.raiz = os.path.abspath(raiz)
+
+    @staticmethod
+    def _balde(telefone: str) -> str:
+        return f"{int(hashlib.sha1(telefone.encode()).hexdigest()[:4], 16) % BALDES:02x}"
+
+    def _caminho(self, mes: str, telefone: str) -> str:
+        return os.path.join(self.raiz, mes, f"{self._balde(telefone)}.jsonl.gz")
+
+    def gravar(self, msgs: List[dict]):
+        grupos: Dict[str, List[dict]] = defaultdict(list)
+        for m in msgs:
+            mes = str(m.get("created_at") or "")[:7] or "sem-data"
+            grupos[self._caminho(mes, m["telefone"])].append(m)
+
+        for caminho, itens in grupos.items():
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+            with open(caminho, "ab") as bruto:
+                with gzip.GzipFile(fileobj=bruto, mode="ab") as gz:
+                    for m in itens:
+                        gz.write((json.dumps(m, default=str, ensure_ascii=False) + "\n").encode("utf-8"))
+                bruto.flush()
+                os.fsync(bruto.fileno())
+
+    def meses(self) -> List[str]:
+        if not os.path.isdir(self.raiz):
+            return []
+        return sorted((d for d in os.listdir(self.raiz) if os.path.isdir(os.path.join(self.raiz, d))), reverse=True)
+
+    def _ler_mes(self, mes: str, telefone: str) -> List[dict]:
+        caminho = self._caminho(mes, telefone)
+        if not os.path.exists(caminho):
+            return []
+        with gzip.open(caminho, "rt", encoding="utf-8") as f:
+            return [m for m in map(json.loads, f) if m.get("telefone") == telefone]
+
+    def historico(self, telefone: str, before_id: Optional[int], limite: int) -> List[dict]:
+        """As `limite` mensagens arquivadas anteriores a before_id, em ordem crescente de id."""
+        achadas: Dict[int, dict] = {}
+        cheio = False
+        # Do mês mais novo para o mais velho. created_at vem do PC local e pode
+        # cruzar a virada do mês fora de ordem de id: lê um mês a mais depois
+        # de completar a página.
+        for mes in self.meses():
+            for m in self._ler_mes(mes, telefone):
+                if before_id is None or m["id"] < before_id:
+                    achadas[m["id"]] = m
+            if cheio:
+                break
+            cheio = len(achadas) >= limite
+        return [achadas[i] for i in sorted(achadas)[-limite:]]
+
+
+async def arquivar(banco, arquivo: ArquivoMensagens, salvar_base64: Callable[[str, Optional[str]], dict],
+                   idade_dias: float = ARQUIVO_IDADE_DIAS, lote: int = LOTE_ARQUIVO) -> int:
+    """
+    Move as mensagens mais velhas que `idade_dias` para o arquivo, em lotes.
+
+    Ordem segura: grava o arquivo (com fsync) -> apaga da tabela e atualiza o
+    resumo da conversa numa só operação do banco. Base64 antigo vira blob antes
+    de ir para o arquivo.
+    """
+    antes_de = (datetime.now() - timedelta(days=idade_dias)).isoformat()
+    total = 0
+    while True:
+        msgs = await banco.mensagens_para_arquivar(antes_de, lote)
+        if not msgs:
+            return total
+
+        for m in msgs:
+            b64 = m.pop("arquivo_base64", None)
+            if b64 and not m.get("arquivo_ref"):
+                info = await asyncio.to_thread(salvar_base64, b64, m.get("arquivo_mime"))
+                m.update({"arquivo_ref": info["ref"], "arquivo_tamanho": info["tamanho"],
+                          "arquivo_mime": info["mimetype"]})
+            m.pop("lease_ate", None)
+
+        await asyncio.to_thread(arquivo.gravar, msgs)
+        total += await banco.concluir_arquivamento([m["id"] for m in msgs])
+        print(f"🗄️ Arquivadas {total} mensagens até agora (anteriores a {antes_de[:10]})")
+        if len(msgs) < lote:
+            return total
+
+
+async def loop_arquivamento(banco, arquivo: ArquivoMensagens, salvar_base64: Callable):
+    while True:
+        try:
+            total = await arquivar(banco, arquivo, salvar_base64)
+            if total:
+                print(f"🗄️ Arquivamento concluído: {total} mensagens")
+        except Exception as e:
+            print(f"[WARN] Falha no arquivamento: {e}")
+        await asyncio.sleep(ARQUIVO_INTERVALO_SEG)
+
+
+def main():
+    """Rodada manual: python arquivo.py --dias 90"""
+    import argparse
+    ap = argparse.ArgumentParser(description="Arquiva as mensagens antigas da tabela quente.")
+    ap.add_argument("--dias", type=float, default=ARQUIVO_IDADE_DIAS or 90)
+    args = ap.parse_args()
+
+    import main as bridge
+    if bridge.banco is None:
+        raise SystemExit("Banco não configurado (SUPABASE_URL/SUPABASE_KEY ou BANCO_BACKEND=sqlite).")
+
+    async def rodar():
+        await bridge.banco.conectar()
+        try:
+            total = await arquivar(bridge.banco, bridge.arquivo, bridge._salvar_base64, idade_dias=args.dias)
+            print(f"✅ {total} mensagens arquivadas")
+        finally:
+            await bridge.banco.fechar()
+
+    asyncio.run(rodar())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,421 @@
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+# "supabase" (padrão) ou "sqlite" (arquivo local, ver banco_sqlite.py)
+BANCO_BACKEND = os.environ.get("BANCO_BACKEND", "supabase")
+
+
+def cursor_conversas_valido(cursor) -> bool:
+    """
+    [ultima_interacao, telefone] da paginação de conversas: data ISO (ou None)
+    e um id de conversa qualquer (@c.us, @g.us, @lid...). O id não é filtrado
+    por formato; quem monta o filtro or= do PostgREST o põe entre aspas.
+    """
+    if not isinstance(cursor, list) or len(cursor) != 2:
+        return False
+    ultima, telefone = cursor
+    if not isinstance(telefone, str) or not telefone:
+        return False
+    if ultima is None:
+        return True
+    if not isinstance(ultima, str):
+        return False
+    try:
+        datetime.fromisoformat(ultima.replace("Z", "+00:00"))
+    except ValueError:
+        return False
+    return True
+
+
+def _aspas(valor: str) -> str:
+    """Valor entre aspas duplas para filtros do PostgREST (vírgula, parênteses e ponto ficam literais)."""
+    return '"' + valor.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def filtro_cursor_conversas(cursor: list) -> str:
+    """Filtro or= que continua a ordem (ultima_interacao desc, telefone desc) depois do cursor."""
+    ultima, tel = cursor
+    if ultima is None:
+        # Em ordem decrescente o Postgres põe os NULL primeiro
+        return f"ultima_interacao.not.is.null,and(ultima_interacao.is.null,telefone.lt.{_aspas(tel)})"
+    return (f"ultima_interacao.lt.{_aspas(ultima)},"
+            f"and(ultima_interacao.eq.{_aspas(ultima)},telefone.lt.{_aspas(tel)})")
+
+
+class Banco(ABC):
+    """
+    Interface de dados da bridge: conversas, mensagens e listas de transmissão.
+    As rotas só falam com ela; cada backend implementa todos os métodos (async).
+    """
+
+    @abstractmethod
+    async def conectar(self): ...
+    @abstractmethod
+    async def fechar(self): ...
+
+    # conversas
+    @abstractmethod
+    async def upsert_conversas(self, linhas: List[dict]): ...
+    @abstractmethod
+    async def atualizar_conversa(self, telefone: str, campos: dict): ...
+    @abstractmethod
+    async def status_conversa(self, telefone: str) -> Optional[dict]: ...
+    @abstractmethod
+    async def garantir_conversa(self, telefone: str) -> bool: ...
+    @abstractmethod
+    async def conversas_em_fila_ou_atendimento(self) -> List[dict]: ...
+    @abstractmethod
+    async def listar_conversas(self, campos: List[str], limite: Optional[int], setor: Optional[str] = None,
+                               status: Optional[List[str]] = None, desde: Optional[str] = None,
+                               ate: Optional[str] = None, since: Optional[str] = None,
+                               cursor: Optional[list] = None) -> List[dict]: ...
+
+    # mensagens
+    @abstractmethod
+    async def inserir_mensagens(self, linhas: List[dict]) -> List[dict]: ...
+    @abstractmethod
+    async def historico(self, telefone: str, campos: str, limite: int, since_id: Optional[int] = None,
+                        before_id: Optional[int] = None) -> List[dict]: ...
+    @abstractmethod
+    async def midia_mensagem(self, id_msg: int) -> Optional[dict]: ...
+    @abstractmethod
+    async def mensagens_pendentes(self, campos: str) -> List[dict]: ...
+    @abstractmethod
+    async def marcar_enviada(self, id_msg: int): ...
+    @abstractmethod
+    async def reivindicar_mensagens(self, limite: int, lease_segundos: int,
+                                    instancia: Optional[str] = None) -> List[dict]: ...
+    @abstractmethod
+    async def confirmar_mensagens(self, enviados: List[int], falhas: List[int], max_tentativas: int,
+                                  devolvidas: List[int] = ()):
+        ...
+    @abstractmethod
+    async def enviar_mensagem_atendente(self, telefone: str, texto: str, resumo: str) -> Optional[int]:
+        ...
+    @abstractmethod
+    async def encerrar_atendimento(self, telefone: str) -> Optional[int]: ...
+
+    # arquivamento (ver arquivo.py)
+    @abstractmethod
+    async def mensagens_para_arquivar(self, antes_de: str, limite: int) -> List[dict]: ...
+    @abstractmethod
+    async def concluir_arquivamento(self, ids: List[int]) -> int: ...
+    @abstractmethod
+    async def resumo_arquivo(self, telefone: str) -> Optional[dict]: ...
+
+    # transmissões em massa (ver broadcasts.py)
+    @abstractmethod
+    async def criar_broadcast(self, job: dict, destinos: List[str]) -> int: ...
+    @abstractmethod
+    async def broadcast(self, id_job: int) -> Optional[dict]: ...
+    @abstractmethod
+    async def listar_broadcasts(self, status: Optional[List[str]] = None, limite: int = 50) -> List[dict]:
+        ...
+    @abstractmethod
+    async def atualizar_broadcast(self, id_job: int, campos: dict): ...
+    @abstractmethod
+    async def concluir_broadcast(self, id_job: int) -> bool:
+        """Marca 'concluido' só se o job ainda está 'ativo' (não atropela pausar/cancelar)."""
+        ...
+    @abstractmethod
+    async def liberar_broadcast(self, id_job: int, quantidade: int) -> int: ...
+    @abstractmethod
+    async def cancelar_broadcast(self, id_job: int) -> int: ...
+    @abstractmethod
+    async def estatisticas_broadcast(self, id_job: int) -> Dict[str, int]: ...
+
+    # instâncias (ver instancias.py)
+    @abstractmethod
+    async def telefones_sem_instancia(self, limite: int, ativas: Optional[List[str]] = None) -> List[str]:
+        ...
+    @abstractmethod
+    async def atribuir_instancias(self, mapa: Dict[str, str], ativas: Optional[List[str]] = None) -> int:
+        ...
+    @abstractmethod
+    async def mover_fila_instancia(self, mapa: Dict[str, str]) -> int: ...
+
+    # listas de transmissão
+    @abstractmethod
+    async def upsert_listas(self, linhas: List[dict]): ...
+    @abstractmethod
+    async def listar_listas(self) -> List[dict]: ...
+
+
+class BancoSupabase(Banco):
+    """
+    Backend Supabase, sobre o AsyncClient do supabase-py.
+
+    Nenhuma chamada bloqueia o event loop: um Supabase lento atrasa a rota
+    que depende dele e não o /health ou o painel inteiro.
+    """
+
+    def __init__(self, url: str, chave: str):
+        self.url = url
+        self.chave = chave
+        self.cliente = None
+
+    async def conectar(self):
+        from supabase import acreate_client
+        if self.cliente is None:
+            self.cliente = await acreate_client(self.url, self.chave)
+
+    async def fechar(self):
+        """Fecha as sessões httpx do PostgREST, do storage e das functions."""
+        cliente, self.cliente = self.cliente, None
+        if cliente is None:
+            return
+        sessoes = [
+            getattr(getattr(cliente, "_postgrest", None), "session", None),
+            getattr(getattr(cliente, "_storage", None), "session", None),
+            getattr(getattr(cliente, "_functions", None), "_client", None),
+        ]
+        for sessao in sessoes:
+            if sessao is None:
+                continue
+            try:
+                await sessao.aclose()
+            except Exception as e:
+                print(f"[WARN] Falha ao fechar sessão do Supabase: {e}")
+
+    def _t(self, tabela: str):
+        return self.cliente.table(tabela)
+
+    async def _rpc(self, funcao: str, params: Dict[str, Any]):
+        return (await self.cliente.rpc(funcao, params).execute()).data
+
+    # ----------------------------
+    # CONVERSAS
+    # ----------------------------
+    async def upsert_conversas(self, linhas: List[dict]):
+        if linhas:
+            await self._t("conversas").upsert(linhas).execute()
+
+    async def atualizar_conversa(self, telefone: str, campos: dict):
+        await self._t("conversas").update(campos).eq("telefone", telefone).execute()
+
+    async def status_conversa(self, telefone: str) -> Optional[dict]:
+        res = await self._t("conversas").select("status, setor_responsavel, instancia").eq("telefone", telefone).execute()
+        return res.data[0] if res.data else None
+
+    async def garantir_conversa(self, telefone: str) -> bool:
+        """True se a conversa foi criada agora (RPC da migrations/0003)."""
+        return await self._rpc("garantir_conversa", {"p_telefone": telefone}) is True
+
+    async def conversas_em_fila_ou_atendimento(self) -> List[dict]:
+        res = await self._t("conversas")\
+            .select("telefone, status, setor_responsavel, atendente_atual, entrou_fila_em, assumido_em")\
+            .in_("status", ["fila", "atendimento"])\
+            .execute()
+        return res.data or []
+
+    async def listar_conversas(self, campos: List[str], limite: Optional[int], setor: Optional[str] = None,
+                               status: Optional[List[str]] = None, desde: Optional[str] = None,
+                               ate: Optional[str] = None, since: Optional[str] = None,
+                               cursor: Optional[list] = None) -> List[dict]:
+        """
+        Página em ordem (ultima_interacao desc, telefone desc); cursor = [ultima_interacao, telefone].
+        limite None = todas.
+        """
+        query = self._t("conversas").select(", ".join(campos))\
+            .order("ultima_interacao", desc=True)\
+            .order("telefone", desc=True)
+        if limite is not None:
+            query = query.limit(limite)
+        if setor:
+            query = query.eq("setor_responsavel", setor)
+        if status:
+            query = query.in_("status", status)
+        if desde:
+            query = query.gte("ultima_interacao", desde)
+        if since:
+            query = query.gt("ultima_interacao", since)
+        if ate:
+            query = query.lt("ultima_interacao", ate)
+        if cursor:
+            if not cursor_conversas_valido(cursor):
+                raise ValueError(f"cursor inválido: {cursor!r}")
+            query = query.or_(filtro_cursor_conversas(cursor))
+        return (await query.execute()).data or []
+
+    # ----------------------------
+    # MENSAGENS
+    # ----------------------------
+    async def inserir_mensagens(self, linhas: List[dict]) -> List[dict]:
+        """Retorna só as gravadas: linha com chave_sync já vista é ignorada (migrations/0011)."""
+        if not linhas:
+            return []
+        if any(l.get("chave_sync") for l in linhas):
+            query = self._t("mensagens").upsert(linhas, on_conflict="chave_sync", ignore_duplicates=True)
+        else:
+            query = self._t("mensagens").insert(linhas)
+        return (await query.execute()).data or []
+
+    async def historico(self, telefone: str, campos: str, limite: int,
+                        since_id: Optional[int] = None, before_id: Optional[int] = None) -> List[dict]:
+        """Mensagens da conversa em ordem crescente de id."""
+        query = self._t("mensagens").select(campos).eq("telefone", telefone)
+        if since_id is not None:
+            return (await query.gt("id", since_id).order("id").limit(limite).execute()).data or []
+        if before_id is not None:
+            query = query.lt("id", before_id)
+        res = await query.order("id", desc=True).limit(limite).execute()
+        return (res.data or [])[::-1]
+
+    async def midia_mensagem(self, id_msg: int) -> Optional[dict]:
+        res = await self._t("mensagens")\
+            .select("arquivo_ref, arquivo_base64, arquivo_nome, arquivo_mime")\
+            .eq("id", id_msg).limit(1).execute()
+        return res.data[0] if res.data else None
+
+    async def mensagens_pendentes(self, campos: str) -> List[dict]:
+        return (await self._t("mensagens").select(campos).eq("status_envio", "pendente").execute()).data or []
+
+    async def marcar_enviada(self, id_msg: int):
+        await self._t("mensagens").update({"status_envio": "enviado"}).eq("id", id_msg).execute()
+
+    async def reivindicar_mensagens(self, limite: int, lease_segundos: int,
+                                    instancia: Optional[str] = None) -> List[dict]:
+        """Pendentes -> 'em_envio' com lease (migrations/0001, 0002 e 0008)."""
+        params = {"p_limite": limite, "p_lease_segundos": lease_segundos}
+        if instancia:
+            params["p_instancia"] = instancia
+        dados = await self._rpc("reivindicar_mensagens", params)
+        return sorted(dados or [], key=lambda m: m["id"])
+
+    async def confirmar_mensagens(self, enviados: List[int], falhas: List[int], max_tentativas: int,
+                                  devolvidas: List[int] = ()):
+        params = {
+            "p_enviados": enviados,
+            "p_falhas": falhas,
+            "p_max_tentativas": max_tentativas,
+        }
+        if devolvidas:
+            params["p_devolvidas"] = list(devolvidas)  # migrations/0009
+        await self._rpc("confirmar_mensagens", params)
+
+    async def enviar_mensagem_atendente(self, telefone: str, texto: str, resumo: str) -> Optional[int]:
+        return await self._rpc("enviar_mensagem_atendente", {
+            "p_telefone": telefone, "p_texto": texto, "p_resumo": resumo,
+        })
+
+    async def encerrar_atendimento(self, telefone: str) -> Optional[int]:
+        return await self._rpc("encerrar_atendimento", {"p_telefone": telefone})
+
+    # ----------------------------
+    # ARQUIVAMENTO
+    # ----------------------------
+    async def mensagens_para_arquivar(self, antes_de: str, limite: int) -> List[dict]:
+        """Mensagens já resolvidas (nada pendente, em envio ou agendado) criadas antes de `antes_de`."""
+        res = await self._t("mensagens").select("*")\
+            .lt("created_at", antes_de)\
+            .not_.in_("status_envio", ["pendente", "em_envio", "agendado"])\
+            .order("id")\
+            .limit(limite)\
+            .execute()
+        return res.data or []
+
+    async def concluir_arquivamento(self, ids: List[int]) -> int:
+        """Apaga as mensagens e atualiza o resumo das conversas numa transação (migrations/0006)."""
+        if not ids:
+            return 0
+        return await self._rpc("concluir_arquivamento", {"p_ids": ids}) or 0
+
+    async def resumo_arquivo(self, telefone: str) -> Optional[dict]:
+        res = await self._t("conversas")\
+            .select("mensagens_arquivadas, arquivadas_ate_id, arquivadas_ate")\
+            .eq("telefone", telefone).limit(1).execute()
+        return res.data[0] if res.data else None
+
+    # ----------------------------
+    # TRANSMISSÕES EM MASSA
+    # ----------------------------
+    async def criar_broadcast(self, job: dict, destinos: List[str]) -> int:
+        """Job + conversas que faltam + uma mensagem 'agendado' por destino (migrations/0007)."""
+        return await self._rpc("criar_broadcast", {"p_job": job, "p_destinos": destinos})
+
+    async def broadcast(self, id_job: int) -> Optional[dict]:
+        res = await self._t("broadcasts").select("*").eq("id", id_job).limit(1).execute()
+        return res.data[0] if res.data else None
+
+    async def listar_broadcasts(self, status: Optional[List[str]] = None, limite: int = 50) -> List[dict]:
+        query = self._t("broadcasts").select("*").order("id", desc=True).limit(limite)
+        if status:
+            query = query.in_("status", status)
+        return (await query.execute()).data or []
+
+    async def atualizar_broadcast(self, id_job: int, campos: dict):
+        await self._t("broadcasts").update(campos).eq("id", id_job).execute()
+
+    async def concluir_broadcast(self, id_job: int) -> bool:
+        res = await self._t("broadcasts").update(
+            {"status": "concluido", "concluido_em": datetime.now().isoformat()}
+        ).eq("id", id_job).eq("status", "ativo").execute()
+        return bool(res.data)
+
+    async def liberar_broadcast(self, id_job: int, quantidade: int) -> int:
+        return await self._rpc("liberar_broadcast", {"p_id": id_job, "p_quantidade": quantidade}) or 0
+
+    async def cancelar_broadcast(self, id_job: int) -> int:
+        return await self._rpc("cancelar_broadcast", {"p_id": id_job}) or 0
+
+    async def estatisticas_broadcast(self, id_job: int) -> Dict[str, int]:
+        linhas = await self._rpc("estatisticas_broadcast", {"p_id": id_job})
+        return {l["status_envio"]: l["qtd"] for l in linhas or []}
+
+    # ----------------------------
+    # INSTÂNCIAS
+    # ----------------------------
+    async def telefones_sem_instancia(self, limite: int, ativas: Optional[List[str]] = None) -> List[str]:
+        """
+        Conversas com mensagens a enviar mas sem instância dona; com `ativas`,
+        também as de donas que não estão entre elas (migrations/0010).
+        """
+        if ativas is not None:
+            dados = await self._rpc("telefones_sem_dona", {"p_limite": limite, "p_ativas": ativas})
+            return [l if isinstance(l, str) else l["telefones_sem_dona"] for l in dados or []]
+        res = await self._t("mensagens").select("telefone")\
+            .is_("instancia", "null")\
+            .in_("status_envio", ["pendente", "em_envio", "agendado"])\
+            .limit(limite)\
+            .execute()
+        return list(dict.fromkeys(l["telefone"] for l in res.data or []))
+
+    async def atribuir_instancias(self, mapa: Dict[str, str], ativas: Optional[List[str]] = None) -> int:
+        if not mapa:
+            return 0
+        params = {"p_telefones": list(mapa), "p_instancias": list(mapa.values())}
+        if ativas is not None:
+            params["p_ativas"] = ativas
+        return await self._rpc("atribuir_instancias", params) or 0
+
+    async def mover_fila_instancia(self, mapa: Dict[str, str]) -> int:
+        if not mapa:
+            return 0
+        return await self._rpc("mover_fila_instancia", {
+            "p_telefones": list(mapa), "p_instancias": list(mapa.values()),
+        }) or 0
+
+    # ----------------------------
+    # LISTAS DE TRANSMISSÃO
+    # ----------------------------
+    async def upsert_listas(self, linhas: List[dict]):
+        if linhas:
+            await self._t("listas_transmissao").upsert(linhas).execute()
+
+    async def listar_listas(self) -> List[dict]:
+        return (await self._t("listas_transmissao").select("*").execute()).data or []
+
+
+def criar_banco() -> Optional[Banco]:
+    if BANCO_BACKEND == "sqlite":
+        from banco_sqlite import BancoSQLite
+        return BancoSQLite()
+
+    url = os.environ.get("SUPABASE_URL")
+    chave = os.environ.get("SUPABASE_KEY")
+    if not url or not chave:
+        print("⚠️ AVISO: SUPABASE_URL ou SUPABASE_KEY não configurados.")
+        return None
+    return BancoSupabase(url, chave)
@@ -0,0 +1,553 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from banco import Banco
+
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "nubia.db")
+
+COLUNAS = {
+    "conversas": ("telefone", "nome_usuario", "status", "ultima_mensagem_texto", "ultima_interacao",
+                  "atendente_atual", "setor_responsavel", "entrou_fila_em", "assumido_em",
+                  "mensagens_arquivadas", "arquivadas_ate_id", "arquivadas_ate", "instancia"),
+    "mensagens": ("id", "telefone", "remetente", "texto", "status_envio", "created_at",
+                  "arquivo_base64", "arquivo_nome", "arquivo_tipo", "arquivo_ref", "arquivo_tamanho",
+                  "arquivo_mime", "lease_ate", "tentativas", "broadcast_id", "instancia", "chave_sync"),
+    "listas_transmissao": ("id", "nome", "qtd", "updated_at"),
+    "broadcasts": ("id", "criado_em", "atendente", "texto", "arquivo_nome", "arquivo_tipo", "arquivo_ref",
+                   "arquivo_tamanho", "arquivo_mime", "total", "taxa_por_minuto", "status", "concluido_em"),
+}
+
+SCHEMA = """
+create table if not exists conversas (
+    telefone text primary key,
+    nome_usuario text,
+    status text default 'robo',
+    ultima_mensagem_texto text,
+    ultima_interacao text,
+    atendente_atual text,
+    setor_responsavel text,
+    entrou_fila_em text,
+    assumido_em text,
+    mensagens_arquivadas integer not null default 0,
+    arquivadas_ate_id integer,
+    arquivadas_ate text,
+    instancia text
+);
+create table if not exists mensagens (
+    id integer primary key autoincrement,
+    telefone text not null,
+    remetente text,
+    texto text,
+    status_envio text,
+    created_at text,
+    arquivo_base64 text,
+    arquivo_nome text,
+    arquivo_tipo text,
+    arquivo_ref text,
+    arquivo_tamanho integer,
+    arquivo_mime text,
+    lease_ate real,
+    tentativas integer not null default 0,
+    broadcast_id integer,
+    instancia text,
+    chave_sync text
+);
+create table if not exists listas_transmissao (
+    id text primary key,
+    nome text,
+    qtd integer,
+    updated_at text
+);
+create table if not exists broadcasts (
+    id integer primary key autoincrement,
+    criado_em text,
+    atendente text,
+    texto text,
+    arquivo_nome text,
+    arquivo_tipo text,
+    arquivo_ref text,
+    arquivo_tamanho integer,
+    arquivo_mime text,
+    total integer not null default 0,
+    taxa_por_minuto integer not null default 20,
+    status text not null default 'ativo',
+    concluido_em text
+);
+
+-- Fila de saída: só as linhas ainda não entregues entram no índice
+create index if not exists mensagens_fila_idx on mensagens (id) where status_envio in ('pendente', 'em_envio');
+create index if not exists mensagens_telefone_id_idx on mensagens (telefone, id);
+create unique index if not exists mensagens_chave_sync_idx on mensagens (chave_sync);
+create index if not exists conversas_ultima_idx on conversas (ultima_interacao desc, telefone desc);
+create index if not exists conversas_status_setor_idx on conversas (status, setor_responsavel);
+create index if not exists mensagens_created_at_idx on mensagens (created_at);
+create index if not exists mensagens_broadcast_idx on mensagens (broadcast_id, status_envio) where broadcast_id is not null;
+create index if not exists broadcasts_status_idx on broadcasts (status);
+create index if not exists mensagens_fila_instancia_idx on mensagens (instancia, id)
+    where status_envio in ('pendente', 'em_envio');
+
+-- Mensagem sem dona herda a instância da conversa (igual ao trigger da migrations/0008)
+create trigger if not exists mensagens_instancia after insert on mensagens
+when new.instancia is null
+begin
+    update mensagens set instancia = (select instancia from conversas where telefone = new.telefone)
+     where id = new.id;
+end;
+"""
+
+# Colunas que entraram depois do schema inicial: arquivos .db antigos ganham
+# as colunas na abertura (equivalente às migrations/ do Postgres)
+COLUNAS_NOVAS = {
+    "conversas": {
+        "mensagens_arquivadas": "integer not null default 0",
+        "arquivadas_ate_id": "integer",
+        "arquivadas_ate": "text",
+        "instancia": "text",
+    },
+    "mensagens": {
+        "broadcast_id": "integer",
+        "instancia": "text",
+        "chave_sync": "text",
+    },
+}
+
+# Colunas de entrega (igual ao RPC reivindicar_mensagens da migrations/0002)
+CAMPOS_REIVINDICADOS = ("id, telefone, texto, case when arquivo_ref is null then arquivo_base64 end as arquivo_base64, "
+                        "arquivo_nome, arquivo_tipo, arquivo_ref, arquivo_tamanho, arquivo_mime, created_at, tentativas")
+
+
+def _agora() -> str:
+    return datetime.now().isoformat()
+
+
+def _campos(tabela: str, campos) -> List[str]:
+    """Valida uma projeção ("a, b" ou lista) contra as colunas conhecidas."""
+    if isinstance(campos, str):
+        campos = [c.strip() for c in campos.split(",")]
+    invalidos = [c for c in campos if c not in COLUNAS[tabela]]
+    if invalidos:
+        raise ValueError(f"Colunas desconhecidas em {tabela}: {invalidos}")
+    return list(campos)
+
+
+class BancoSQLite(Banco):
+    """
+    Backend embutido em um arquivo SQLite (WAL), para rodar a bridge sem
+    Supabase: instalação pequena em um servidor só, desenvolvimento e testes de carga.
+
+    Uma conexão de escrita (serializada por lock) e uma de leitura por thread;
+    com WAL as leituras não esperam as escritas. As chamadas rodam fora do
+    event loop (asyncio.to_thread).
+    """
+
+    def __init__(self, caminho: str = SQLITE_PATH):
+        self.caminho = caminho
+        self._escrita: Optional[sqlite3.Connection] = None
+        self._lock_escrita = threading.Lock()
+        self._leitura = threading.local()
+        self._conexoes_leitura: List[sqlite3.Connection] = []
+        self._lock_leitura = threading.Lock()
+
+    def _abrir(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.caminho, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("pragma journal_mode=wal")
+        conn.execute("pragma synchronous=normal")
+        conn.execute("pragma busy_timeout=5000")
+        return conn
+
+    async def conectar(self):
+        if self._escrita is None:
+            self._escrita = self._abrir()
+            for tabela, colunas in COLUNAS_NOVAS.items():
+                existentes = {r["name"] for r in self._escrita.execute(f"pragma table_info({tabela})")}
+                for coluna, tipo in colunas.items():
+                    if existentes and coluna not in existentes:
+                        self._escrita.execute(f"alter table {tabela} add column {coluna} {tipo}")
+            self._escrita.executescript(SCHEMA)
+
+    async def fechar(self):
+        if self._escrita is not None:
+            self._escrita.close()
+            self._escrita = None
+        # As de leitura também (uma por thread do to_thread); a próxima leitura reabre
+        with self._lock_leitura:
+            conexoes, self._conexoes_leitura = self._conexoes_leitura, []
+            self._leitura = threading.local()
+        for conn in conexoes:
+            conn.close()
+
+    # --- execução ---
+    def _ler(self, sql: str, params=()) -> List[dict]:
+        conn = getattr(self._leitura, "conn", None)
+        if conn is None:
+            conn = self._leitura.conn = self._abrir()
+            with self._lock_leitura:
+                self._conexoes_leitura.append(conn)
+        return [dict(r) for r in conn.execute(sql, params).fetchall()]
+
+    def _transacao(self, fn):
+        with self._lock_escrita:
+            conn = self._escrita
+            conn.execute("begin immediate")
+            try:
+                resultado = fn(conn)
+            except BaseException:
+                conn.execute("rollback")
+                raise
+            conn.execute("commit")
+            return resultado
+
+    async def _em_thread(self, fn, *args):
+        return await asyncio.to_thread(fn, *args)
+
+    # ----------------------------
+    # CONVERSAS
+    # ----------------------------
+    def _upsert(self, conn, tabela: str, chave: str, linhas: List[dict]):
+        # Agrupa por conjunto de colunas: um executemany por formato de linha
+        grupos: Dict[tuple, List[dict]] = {}
+        for linha in linhas:
+            grupos.setdefault(tuple(_campos(tabela, linha.keys())), []).append(linha)
+        for cols, grupo in grupos.items():
+            atualizar = [c for c in cols if c != chave]
+            sql = (f"insert into {tabela} ({', '.join(cols)}) values ({', '.join('?' * len(cols))}) "
+                   f"on conflict ({chave}) do ")
+            sql += ("update set " + ", ".join(f"{c} = excluded.{c}" for c in atualizar)) if atualizar else "nothing"
+            conn.executemany(sql, [tuple(l[c] for c in cols) for l in grupo])
+
+    async def upsert_conversas(self, linhas: List[dict]):
+        if linhas:
+            await self._em_thread(self._transacao, lambda conn: self._upsert(conn, "conversas", "telefone", linhas))
+
+    async def atualizar_conversa(self, telefone: str, campos: dict):
+        cols = _campos("conversas", campos.keys())
+        sql = f"update conversas set {', '.join(f'{c} = ?' for c in cols)} where telefone = ?"
+        params = [campos[c] for c in cols] + [telefone]
+        await self._em_thread(self._transacao, lambda conn: conn.execute(sql, params))
+
+    async def status_conversa(self, telefone: str) -> Optional[dict]:
+        linhas = await self._em_thread(self._ler, "select status, setor_responsavel, instancia from conversas where telefone = ?",
+                                       (telefone,))
+        return linhas[0] if linhas else None
+
+    async def garantir_conversa(self, telefone: str) -> bool:
+        def fn(conn):
+            cur = conn.execute("insert into conversas (telefone, nome_usuario, status, ultima_interacao) "
+                               "values (?, 'Cliente (via Anexo)', 'atendimento', ?) on conflict (telefone) do nothing",
+                               (telefone, _agora()))
+            if cur.rowcount:
+                return True
+            conn.execute("update conversas set ultima_interacao = ? where telefone = ?", (_agora(), telefone))
+            return False
+        return await self._em_thread(self._transacao, fn)
+
+    async def conversas_em_fila_ou_atendimento(self) -> List[dict]:
+        return await self._em_thread(self._ler,
+            "select telefone, status, setor_responsavel, atendente_atual, entrou_fila_em, assumido_em "
+            "from conversas where status in ('fila', 'atendimento')")
+
+    async def listar_conversas(self, campos: List[str], limite: Optional[int], setor: Optional[str] = None,
+                               status: Optional[List[str]] = None, desde: Optional[str] = None,
+                               ate: Optional[str] = None, since: Optional[str] = None,
+                               cursor: Optional[list] = None) -> List[dict]:
+        where, params = [], []
+        if setor:
+            where.append("setor_responsavel = ?"); params.append(setor)
+        if status:
+            where.append(f"status in ({', '.join('?' * len(status))})"); params.extend(status)
+        if desde:
+            where.append("ultima_interacao >= ?"); params.append(desde)
+        if since:
+            where.append("ultima_interacao > ?"); params.append(since)
+        if ate:
+            where.append("ultima_interacao < ?"); params.append(ate)
+        if cursor:
+            ultima, tel = cursor
+            # Mesma ordem do Postgres: NULL primeiro em ordem decrescente
+            if ultima is None:
+                where.append("(ultima_interacao is not null or telefone < ?)"); params.append(tel)
+            else:
+                where.append("(ultima_interacao < ? or (ultima_interacao = ? and telefone < ?))")
+                params.extend([ultima, ultima, tel])
+        sql = f"select {', '.join(_campos('conversas', campos))} from conversas"
+        if where:
+            sql += " where " + " and ".join(where)
+        sql += " order by ultima_interacao is null desc, ultima_interacao desc, telefone desc"
+        if limite is not None:
+            sql += " limit ?"
+            params.append(limite)
+        return await self._em_thread(self._ler, sql, params)
+
+    # ----------------------------
+    # MENSAGENS
+    # ----------------------------
+    def _inserir(self, conn, linhas: List[dict]) -> List[dict]:
+        # Um executemany por formato de linha (mesmas colunas, com ou sem chave_sync)
+        grupos: Dict[tuple, List[int]] = {}
+        for i, linha in enumerate(linhas):
+            formato = (tuple(_campos("mensagens", linha.keys())), bool(linha.get("chave_sync")))
+            grupos.setdefault(formato, []).append(i)
+
+        salvas = []
+        for (cols, com_chave), indices in grupos.items():
+            sql = f"insert into mensagens ({', '.join(cols)}) values ({', '.join('?' * len(cols))})"
+            if com_chave:
+                sql += " on conflict (chave_sync) do nothing"  # reenvio do outbox local
+            # executemany não devolve lastrowid: dentro da transação (autoincrement) os
+            # ids novos são os acima do maior id de antes, na ordem de inserção
+            antes = conn.execute("select coalesce(max(id), 0) from mensagens").fetchone()[0]
+            conn.executemany(sql, [[linhas[i][c] for c in cols] for i in indices])
+            novas = conn.execute("select id, chave_sync from mensagens where id > ? order by id", (antes,)).fetchall()
+            if com_chave:
+                # As repetidas (já gravadas ou duplicadas no lote) não entram
+                ids = {r["chave_sync"]: r["id"] for r in novas}
+                for i in indices:
+                    id_msg = ids.pop(linhas[i]["chave_sync"], None)
+                    if id_msg is not None:
+                        salvas.append((i, {**linhas[i], "id": id_msg}))
+            else:
+                salvas.extend((i, {**linhas[i], "id": r["id"]}) for i, r in zip(indices, novas))
+        return [linha for _, linha in sorted(salvas, key=lambda s: s[0])]
+
+    async def inserir_mensagens(self, linhas: List[dict]) -> List[dict]:
+        if not linhas:
+            return []
+        return await self._em_thread(self._transacao, lambda conn: self._inserir(conn, linhas))
+
+    async def historico(self, telefone: str, campos: str, limite: int,
+                        since_id: Optional[int] = None, before_id: Optional[int] = None) -> List[dict]:
+        sel = ", ".join(_campos("mensagens", campos))
+        if since_id is not None:
+            return await self._em_thread(self._ler,
+                f"select {sel} from mensagens where telefone = ? and id > ? order by id limit ?",
+                (telefone, since_id, limite))
+        filtro, params = "telefone = ?", [telefone]
+        if before_id is not None:
+            filtro += " and id < ?"; params.append(before_id)
+        linhas = await self._em_thread(self._ler,
+            f"select {sel} from mensagens where {filtro} order by id desc limit ?", params + [limite])
+        return linhas[::-1]
+
+    async def midia_mensagem(self, id_msg: int) -> Optional[dict]:
+        linhas = await self._em_thread(self._ler,
+            "select arquivo_ref, arquivo_base64, arquivo_nome, arquivo_mime from mensagens where id = ?", (id_msg,))
+        return linhas[0] if linhas else None
+
+    async def mensagens_pendentes(self, campos: str) -> List[dict]:
+        return await self._em_thread(self._ler,
+            f"select {', '.join(_campos('mensagens', campos))} from mensagens "
+            "where status_envio = 'pendente' order by id")
+
+    async def marcar_enviada(self, id_msg: int):
+        await self._em_thread(self._transacao, lambda conn: conn.execute(
+            "update mensagens set status_envio = 'enviado' where id = ?", (id_msg,)))
+
+    async def reivindicar_mensagens(self, limite: int, lease_segundos: int,
+                                    instancia: Optional[str] = None) -> List[dict]:
+        def fn(conn):
+            agora = time.time()
+            filtro, params = "", [agora]
+            if instancia:
+                filtro = " and instancia = ?"; params.append(instancia)
+            ids = [r[0] for r in conn.execute(
+                "select id from mensagens where (status_envio = 'pendente' "
+                f"or (status_envio = 'em_envio' and lease_ate < ?)){filtro} order by id limit ?", params + [limite])]
+            if not ids:
+                return []
+            marcas = ", ".join("?" * len(ids))
+            conn.execute(f"update mensagens set status_envio = 'em_envio', lease_ate = ?, tentativas = tentativas + 1 "
+                         f"where id in ({marcas})", [agora + lease_segundos] + ids)
+            return [dict(r) for r in conn.execute(
+                f"select {CAMPOS_REIVINDICADOS} from mensagens where id in ({marcas}) order by id", ids)]
+        return await self._em_thread(self._transacao, fn)
+
+    async def confirmar_mensagens(self, enviados: List[int], falhas: List[int], max_tentativas: int,
+                                  devolvidas: List[int] = ()):
+        def fn(conn):
+            if enviados:
+                conn.execute(f"update mensagens set status_envio = 'enviado', lease_ate = null "
+                             f"where id in ({', '.join('?' * len(enviados))})", enviados)
+            if falhas:
+                conn.execute(f"update mensagens set status_envio = case when tentativas >= ? then 'falhou' "
+                             f"else 'pendente' end, lease_ate = null "
+                             f"where status_envio = 'em_envio' and id in ({', '.join('?' * len(falhas))})",
+                             [max_tentativas] + falhas)
+            if devolvidas:
+                # Devolvidas sem terem sido tentadas: não gastam tentativa
+                conn.execute(f"update mensagens set status_envio = 'pendente', lease_ate = null, "
+                             f"tentativas = max(tentativas - 1, 0) "
+                             f"where status_envio = 'em_envio' and id in ({', '.join('?' * len(devolvidas))})",
+                             list(devolvidas))
+        await self._em_thread(self._transacao, fn)
+
+    async def enviar_mensagem_atendente(self, telefone: str, texto: str, resumo: str) -> Optional[int]:
+        def fn(conn):
+            agora = _agora()
+            cur = conn.execute("insert into mensagens (telefone, remetente, texto, status_envio, created_at) "
+                               "values (?, 'atendente', ?, 'pendente', ?)", (telefone, texto, agora))
+            conn.execute("update conversas set ultima_mensagem_texto = ?, ultima_interacao = ? where telefone = ?",
+                         (resumo, agora, telefone))
+            return cur.lastrowid
+        return await self._em_thread(self._transacao, fn)
+
+    async def encerrar_atendimento(self, telefone: str) -> Optional[int]:
+        def fn(conn):
+            conn.execute("update conversas set status = 'robo', atendente_atual = null, setor_responsavel = 'geral' "
+                         "where telefone = ?", (telefone,))
+            cur = conn.execute("insert into mensagens (telefone, remetente, texto, status_envio, created_at) "
+                               "values (?, 'sistema', 'Atendimento encerrado. NUBIA retornou.', 'pendente', ?)",
+                               (telefone, _agora()))
+            return cur.lastrowid
+        return await self._em_thread(self._transacao, fn)
+
+    # ----------------------------
+    # ARQUIVAMENTO
+    # ----------------------------
+    async def mensagens_para_arquivar(self, antes_de: str, limite: int) -> List[dict]:
+        return await self._em_thread(self._ler,
+            "select * from mensagens where created_at < ? and status_envio not in ('pendente', 'em_envio', 'agendado') "
+            "order by id limit ?", (antes_de, limite))
+
+    async def concluir_arquivamento(self, ids: List[int]) -> int:
+        if not ids:
+            return 0
+
+        def fn(conn):
+            marcas = ", ".join("?" * len(ids))
+            resumos = conn.execute(
+                f"select telefone, count(*), max(id), max(created_at) from mensagens "
+                f"where id in ({marcas}) group by telefone", ids).fetchall()
+            conn.executemany(
+                "update conversas set mensagens_arquivadas = mensagens_arquivadas + ?, "
+                "arquivadas_ate_id = max(coalesce(arquivadas_ate_id, 0), ?), "
+                "arquivadas_ate = max(coalesce(arquivadas_ate, ''), ?) where telefone = ?",
+                [(qtd, ate_id, ate, tel) for tel, qtd, ate_id, ate in resumos])
+            return conn.execute(f"delete from mensagens where id in ({marcas})", ids).rowcount
+        return await self._em_thread(self._transacao, fn)
+
+    async def resumo_arquivo(self, telefone: str) -> Optional[dict]:
+        linhas = await self._em_thread(self._ler,
+            "select mensagens_arquivadas, arquivadas_ate_id, arquivadas_ate from conversas where telefone = ?",
+            (telefone,))
+        return linhas[0] if linhas else None
+
+    # ----------------------------
+    # TRANSMISSÕES EM MASSA
+    # ----------------------------
+    async def criar_broadcast(self, job: dict, destinos: List[str]) -> int:
+        def fn(conn):
+            agora = _agora()
+            cols = _campos("broadcasts", job.keys())
+            cur = conn.execute(
+                f"insert into broadcasts ({', '.join(cols)}, criado_em, total) "
+                f"values ({', '.join('?' * len(cols))}, ?, ?)", [job[c] for c in cols] + [agora, len(destinos)])
+            id_job = cur.lastrowid
+            nomes = {r[0]: r[1] for r in conn.execute("select id, nome from listas_transmissao")}
+            conn.executemany(
+                "insert into conversas (telefone, nome_usuario, status, ultima_interacao) values (?, ?, 'robo', ?) "
+                "on conflict (telefone) do nothing",
+                [(d, nomes.get(d) or "Contato (via Transmissão)", agora) for d in destinos])
+            conn.executemany(
+                "insert into mensagens (telefone, remetente, texto, status_envio, created_at, arquivo_nome, "
+                "arquivo_tipo, arquivo_ref, arquivo_tamanho, arquivo_mime, broadcast_id) "
+                "values (?, 'atendente', ?, 'agendado', ?, ?, ?, ?, ?, ?, ?)",
+                [(d, job.get("texto"), agora, job.get("arquivo_nome"), job.get("arquivo_tipo"), job.get("arquivo_ref"),
+                  job.get("arquivo_tamanho"), job.get("arquivo_mime"), id_job) for d in destinos])
+            return id_job
+        return await self._em_thread(self._transacao, fn)
+
+    async def broadcast(self, id_job: int) -> Optional[dict]:
+        linhas = await self._em_thread(self._ler, "select * from broadcasts where id = ?", (id_job,))
+        return linhas[0] if linhas else None
+
+    async def listar_broadcasts(self, status: Optional[List[str]] = None, limite: int = 50) -> List[dict]:
+        sql, params = "select * from broadcasts", []
+        if status:
+            sql += f" where status in ({', '.join('?' * len(status))})"; params.extend(status)
+        return await self._em_thread(self._ler, sql + " order by id desc limit ?", params + [limite])
+
+    async def atualizar_broadcast(self, id_job: int, campos: dict):
+        cols = _campos("broadcasts", campos.keys())
+        sql = f"update broadcasts set {', '.join(f'{c} = ?' for c in cols)} where id = ?"
+        params = [campos[c] for c in cols] + [id_job]
+        await self._em_thread(self._transacao, lambda conn: conn.execute(sql, params))
+
+    async def concluir_broadcast(self, id_job: int) -> bool:
+        return await self._em_thread(self._transacao, lambda conn: conn.execute(
+            "update broadcasts set status = 'concluido', concluido_em = ? where id = ? and status = 'ativo'",
+            (_agora(), id_job)).rowcount > 0)
+
+    async def liberar_broadcast(self, id_job: int, quantidade: int) -> int:
+        return await self._em_thread(self._transacao, lambda conn: conn.execute(
+            "update mensagens set status_envio = 'pendente' where id in (select id from mensagens "
+            "where broadcast_id = ? and status_envio = 'agendado' order by id limit ?)",
+            (id_job, quantidade)).rowcount)
+
+    async def cancelar_broadcast(self, id_job: int) -> int:
+        def fn(conn):
+            conn.execute("update broadcasts set status = 'cancelado', concluido_em = ? where id = ?", (_agora(), id_job))
+            return conn.execute("update mensagens set status_envio = 'cancelado' "
+                                "where broadcast_id = ? and status_envio = 'agendado'", (id_job,)).rowcount
+        return await self._em_thread(self._transacao, fn)
+
+    async def estatisticas_broadcast(self, id_job: int) -> Dict[str, int]:
+        linhas = await self._em_thread(self._ler,
+            "select status_envio, count(*) as qtd from mensagens where broadcast_id = ? group by status_envio",
+            (id_job,))
+        return {l["status_envio"]: l["qtd"] for l in linhas}
+
+    # ----------------------------
+    # INSTÂNCIAS
+    # ----------------------------
+    @staticmethod
+    def _sem_dona(ativas: Optional[List[str]]) -> Tuple[str, list]:
+        """Filtro 'instancia sem dona viva': null, ou fora de `ativas` quando informado."""
+        if ativas is None:
+            return "instancia is null", []
+        return f"(instancia is null or instancia not in ({', '.join('?' * len(ativas))}))", list(ativas)
+
+    async def telefones_sem_instancia(self, limite: int, ativas: Optional[List[str]] = None) -> List[str]:
+        filtro, params = self._sem_dona(ativas)
+        linhas = await self._em_thread(self._ler,
+            f"select distinct telefone from mensagens where {filtro} "
+            "and status_envio in ('pendente', 'em_envio', 'agendado') limit ?", (*params, limite))
+        return [l["telefone"] for l in linhas]
+
+    async def atribuir_instancias(self, mapa: Dict[str, str], ativas: Optional[List[str]] = None) -> int:
+        if not mapa:
+            return 0
+        filtro, params = self._sem_dona(ativas)
+
+        def fn(conn):
+            pares = [(inst, tel, *params) for tel, inst in mapa.items()]
+            conn.executemany(f"update conversas set instancia = ? where telefone = ? and {filtro}", pares)
+            return sum(conn.execute(
+                f"update mensagens set instancia = ? where telefone = ? and {filtro} "
+                "and status_envio in ('pendente', 'em_envio', 'agendado')", par).rowcount for par in pares)
+        return await self._em_thread(self._transacao, fn)
+
+    async def mover_fila_instancia(self, mapa: Dict[str, str]) -> int:
+        if not mapa:
+            return 0
+
+        def fn(conn):
+            return sum(conn.execute(
+                "update mensagens set instancia = ? where telefone = ? and status_envio in ('pendente', 'agendado') "
+                "and instancia is not ?", (inst, tel, inst)).rowcount for tel, inst in mapa.items())
+        return await self._em_thread(self._transacao, fn)
+
+    # ----------------------------
+    # LISTAS DE TRANSMISSÃO
+    # ----------------------------
+    async def upsert_listas(self, linhas: List[dict]):
+        if linhas:
+            await self._em_thread(self._transacao, lambda conn: self._upsert(conn, "listas_transmissao", "id", linhas))
+
+    async def listar_listas(self) -> List[dict]:
+        return await self._em_thread(self._ler, "select * from listas_transmissao order by nome")
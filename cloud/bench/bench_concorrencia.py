@@ -0,0 +1,93 @@
+"""
+Vazão da bridge com muitos clientes simultâneos (requisições/s e latência).
+
+Suba a bridge e rode, por exemplo:
+
+    python bench/bench_concorrencia.py --url http://127.0.0.1:8000 --clientes 50,200,1000
+
+Para o "antes x depois", rode o mesmo comando com a bridge no commit anterior
+(rotas síncronas no threadpool) e no atual (rotas async). --rota escolhe o
+endpoint; a mistura padrão imita o painel + bot local. A coluna /health mostra
+se uma rota lenta no banco está travando as outras.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import httpx
+
+MISTURA_PADRAO = [
+    "/sync/status_conversa/5500000000000@c.us",
+    "/admin/conversas?limite=50",
+    "/admin/chat/5500000000000@c.us",
+    "/admin/fila_setor/SEC",
+]
+
+
+async def _cliente(http: httpx.AsyncClient, rotas, fim: float, lat: list, lat_health: list, erros: list):
+    while time.perf_counter() < fim:
+        rota = random.choice(rotas)
+        t0 = time.perf_counter()
+        try:
+            res = await http.get(rota)
+            if res.status_code >= 500:
+                erros.append(res.status_code)
+        except httpx.HTTPError:
+            erros.append("conexao")
+        dur = time.perf_counter() - t0
+        (lat_health if rota == "/health" else lat).append(dur)
+
+
+def _p(valores, q):
+    if not valores:
+        return 0.0
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * q))] * 1000
+
+
+async def _conexao(url: str, rotas, fim: float, lat: list, lat_health: list, erros: list):
+    # Um AsyncClient (uma conexão) por cliente: o pool compartilhado do httpx
+    # degrada com centenas de conexões e vira o gargalo do próprio benchmark
+    limites = httpx.Limits(max_connections=1, max_keepalive_connections=1)
+    async with httpx.AsyncClient(base_url=url, limits=limites, timeout=60) as http:
+        await _cliente(http, rotas, fim, lat, lat_health, erros)
+
+
+async def rodada(url: str, clientes: int, duracao: float, rotas) -> dict:
+    lat, lat_health, erros = [], [], []
+    fim = time.perf_counter() + duracao
+    await asyncio.gather(*[
+        _conexao(url, rotas + ["/health"], fim, lat, lat_health, erros) for _ in range(clientes)
+    ])
+    total = len(lat) + len(lat_health)
+    return {
+        "clientes": clientes,
+        "req_s": total / duracao,
+        "p50_ms": _p(lat, 0.50),
+        "p95_ms": _p(lat, 0.95),
+        "health_p95_ms": _p(lat_health, 0.95),
+        "erros": len(erros),
+        "media_ms": statistics.mean(lat) * 1000 if lat else 0.0,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--url", default="http://127.0.0.1:8000")
+    ap.add_argument("--clientes", default="50,200,1000")
+    ap.add_argument("--duracao", type=float, default=15.0, help="segundos por rodada")
+    ap.add_argument("--rota", action="append", help="repetível; padrão: mistura painel + bot")
+    args = ap.parse_args()
+
+    rotas = args.rota or MISTURA_PADRAO
+    print(f"{'clientes':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'/health p95':>13}{'erros':>8}")
+    for n in [int(x) for x in args.clientes.split(",")]:
+        r = asyncio.run(rodada(args.url, n, args.duracao, rotas))
+        print(f"{r['clientes']:>8}{r['req_s']:>10.1f}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}"
+              f"{r['health_p95_ms']:>13.1f}{r['erros']:>8}")
+
+
+if __name__ == "__main__":
+    main()
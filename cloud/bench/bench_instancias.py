@@ -0,0 +1,134 @@
+"""
+Vazão da fila de saída com várias instâncias locais (um número de WhatsApp
+cada) na mesma bridge, e checagem de roteamento (nenhuma instância pode
+levar mensagem de conversa de outra).
+
+Suba a bridge (SQLite serve) e rode:
+
+    BANCO_BACKEND=sqlite INSTANCIA_TTL_SEG=5 uvicorn main:app
+    python bench/bench_instancias.py --url http://127.0.0.1:8000 --instancias 1,2,4,8
+
+Cada instância simulada reivindica lotes e "envia" uma mensagem por vez
+(--envio-ms, o ritmo de um número de WhatsApp). Como cada número tem o seu
+ritmo, a vazão deve crescer quase linear com o número de instâncias.
+
+Por padrão cada conversa já nasce com dona (sync com instancia, como um
+cliente falando com um número). --pool cria as conversas sem dona pelo
+painel e deixa o hash consistente da bridge distribuir; nesse modo a bridge
+precisa de INSTANCIA_TTL_SEG curto: antes de cada rodada o script espera as
+instâncias da rodada anterior saírem do anel.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from collections import Counter
+
+import httpx
+
+
+async def _instancia(http: httpx.AsyncClient, nome: str, envio_seg: float, lote: int, estado: dict):
+    """Reivindica, 'envia' em série e confirma, até a rodada acabar."""
+    while not estado["fim"].is_set():
+        res = await http.post("/sync/fila/reivindicar", params={"limite": lote, "instancia": nome})
+        res.raise_for_status()
+        msgs = res.json()
+        if not msgs:
+            await asyncio.sleep(0.05)
+            continue
+        for msg in msgs:
+            dono = estado["donos"].setdefault(msg["telefone"], nome)
+            if dono != nome:
+                estado["invasoes"] += 1
+            await asyncio.sleep(envio_seg)
+        await http.post("/sync/fila/confirmar", json={"enviados": [m["id"] for m in msgs], "falhas": []})
+        estado["por_instancia"][nome] += len(msgs)
+        estado["entregues"] += len(msgs)
+        if estado["entregues"] >= estado["total"]:
+            estado["fim"].set()
+
+
+async def rodada(url: str, n: int, conversas: int, mensagens: int, envio_ms: float, pool: bool) -> dict:
+    rodada_id = uuid.uuid4().hex[:6]
+    nomes = [f"bench-{rodada_id}-{i}" for i in range(n)]
+    telefones = [f"55{rodada_id}{i:06d}@c.us" for i in range(conversas)]
+    limites = httpx.Limits(max_connections=100, max_keepalive_connections=100)
+
+    async with httpx.AsyncClient(base_url=url, limits=limites, timeout=60) as http:
+        # 1. Instâncias se apresentam (a reivindicação é o heartbeat). No modo
+        #    pool, espera as de rodadas anteriores saírem do anel.
+        limite_espera = time.perf_counter() + 60
+        while True:
+            for nome in nomes:
+                (await http.post("/sync/fila/reivindicar", params={"limite": 1, "instancia": nome})).raise_for_status()
+            vivas = {i["instancia"] for i in (await http.get("/admin/instancias")).json()}
+            if not pool or vivas == set(nomes) or time.perf_counter() > limite_espera:
+                break
+            await asyncio.sleep(1)
+
+        # 2. Conversas e mensagens a enviar
+        donos = {}
+        if pool:
+            for tel in telefones:
+                await http.post("/admin/criar_conversa", json={"telefone": tel, "nome": "Bench"})
+        else:
+            donos = {tel: nomes[i % n] for i, tel in enumerate(telefones)}
+            lote = [{"telefone": tel, "nome": "Bench", "texto": "oi", "remetente": "cliente", "instancia": dono}
+                    for tel, dono in donos.items()]
+            for i in range(0, len(lote), 200):
+                (await http.post("/sync/mensagens_lote", json=lote[i:i + 200])).raise_for_status()
+
+        sem = asyncio.Semaphore(50)
+
+        async def enfileirar(i: int):
+            async with sem:
+                await http.post("/admin/enviar", json={"telefone": telefones[i % conversas], "nome": "Bench",
+                                                       "texto": f"msg {i}", "remetente": "atendente"})
+
+        await asyncio.gather(*[enfileirar(i) for i in range(mensagens)])
+
+        # 3. Drenagem
+        estado = {"fim": asyncio.Event(), "donos": dict(donos), "invasoes": 0, "entregues": 0,
+                  "total": mensagens, "por_instancia": Counter()}
+        t0 = time.perf_counter()
+        tarefas = [asyncio.create_task(_instancia(http, nome, envio_ms / 1000, 50, estado)) for nome in nomes]
+        try:
+            await asyncio.wait_for(estado["fim"].wait(), timeout=max(60.0, mensagens * envio_ms / 1000 * 2))
+        except asyncio.TimeoutError:
+            print(f"⚠️ Rodada com {n} instâncias não drenou: {estado['entregues']}/{mensagens}")
+        duracao = time.perf_counter() - t0
+        estado["fim"].set()
+        await asyncio.gather(*tarefas, return_exceptions=True)
+
+    por_instancia = [estado["por_instancia"][nome] for nome in nomes]
+    return {
+        "instancias": n,
+        "msg_s": estado["entregues"] / duracao,
+        "duracao": duracao,
+        "invasoes": estado["invasoes"],
+        "min": min(por_instancia),
+        "max": max(por_instancia),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--url", default="http://127.0.0.1:8000")
+    ap.add_argument("--instancias", default="1,2,4,8")
+    ap.add_argument("--conversas", type=int, default=400)
+    ap.add_argument("--mensagens", type=int, default=2000)
+    ap.add_argument("--envio-ms", type=float, default=20.0, help="tempo de envio de uma mensagem no WhatsApp")
+    ap.add_argument("--pool", action="store_true", help="conversas sem dona, distribuídas pelo hash consistente")
+    args = ap.parse_args()
+
+    print(f"{'instâncias':>10}{'msg/s':>10}{'x 1 inst':>10}{'seg':>8}{'min/inst':>10}{'max/inst':>10}{'invasões':>10}")
+    base = None
+    for n in [int(x) for x in args.instancias.split(",")]:
+        r = asyncio.run(rodada(args.url, n, args.conversas, args.mensagens, args.envio_ms, args.pool))
+        base = base or r["msg_s"] / r["instancias"]
+        print(f"{r['instancias']:>10}{r['msg_s']:>10.1f}{r['msg_s'] / base:>10.2f}{r['duracao']:>8.1f}"
+              f"{r['min']:>10}{r['max']:>10}{r['invasoes']:>10}")
+
+
+if __name__ == "__main__":
+    main()
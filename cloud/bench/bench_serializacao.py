@@ -0,0 +1,124 @@
+"""
+Custo de serializar e bytes no fio das respostas típicas do painel.
+
+    python bench/bench_serializacao.py
+    python bench/bench_serializacao.py --conversas 1000 --mensagens 200
+
+Para cada payload (lista de conversas, página do chat, fila de saída, listas
+de transmissão) mede o caminho padrão do FastAPI (jsonable_encoder +
+json.dumps) contra respostas.dumps (orjson quando instalado), e o tamanho
+cru, com gzip e com brotli (se instalado), mais o tempo de comprimir.
+Não precisa da bridge no ar nem de banco.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from respostas import NIVEL_BROTLI, NIVEL_GZIP, brotli, comprimir, dumps, orjson  # noqa: E402
+
+FRASES = ["Bom dia, gostaria de saber sobre a matrícula", "Qual o horário da secretaria?",
+          "Obrigado!", "Preciso da segunda via do boleto", "Ok, vou aguardar o atendente",
+          "📢 *Comunicado (Secretaria):*\n\nAs aulas voltam na segunda-feira."]
+
+
+def _telefone(i: int) -> str:
+    return f"55{i:011d}@c.us"
+
+
+def payloads(n_conversas: int, n_mensagens: int, n_fila: int, n_listas: int) -> dict:
+    random.seed(42)
+    agora = datetime.now()
+    conversas = [{
+        "telefone": _telefone(i),
+        "nome_usuario": f"Cliente {i}",
+        "status": random.choice(["robo", "fila", "atendimento", "humano"]),
+        "ultima_mensagem_texto": random.choice(FRASES),
+        "ultima_interacao": (agora - timedelta(minutes=i)).isoformat(),
+        "atendente_atual": random.choice([None, "Ana", "Bruno"]),
+        "setor_responsavel": random.choice(["geral", "SEC", "FIN", "TI"]),
+    } for i in range(n_conversas)]
+    chat = [{
+        "id": 100000 + i,
+        "telefone": _telefone(1),
+        "remetente": random.choice(["cliente", "nubia", "atendente"]),
+        "texto": random.choice(FRASES),
+        "status_envio": "enviado",
+        "created_at": (agora - timedelta(seconds=30 * (n_mensagens - i))).isoformat(),
+        "arquivo_nome": None, "arquivo_tipo": None, "arquivo_ref": None,
+        "arquivo_tamanho": None, "arquivo_mime": None, "arquivo_url": None,
+    } for i in range(n_mensagens)]
+    fila = [{
+        "id": 200000 + i,
+        "telefone": _telefone(i),
+        "texto": random.choice(FRASES),
+        "arquivo_base64": None, "arquivo_nome": None, "arquivo_tipo": None,
+        "arquivo_ref": "ab" * 32 if i % 10 == 0 else None,
+        "arquivo_tamanho": 48213 if i % 10 == 0 else None,
+        "arquivo_mime": "application/pdf" if i % 10 == 0 else None,
+        "created_at": agora.isoformat(),
+    } for i in range(n_fila)]
+    listas = [{"id": f"1203630{i:08d}@g.us", "nome": f"Turma {i}", "qtd": random.randint(5, 256),
+               "updated_at": agora.isoformat()} for i in range(n_listas)]
+    return {
+        f"/admin/conversas ({n_conversas})": conversas,
+        f"/admin/chat ({n_mensagens})": chat,
+        f"/sync/fila_pendente ({n_fila})": fila,
+        f"/admin/listas_disponiveis ({n_listas})": listas,
+    }
+
+
+def _medir(fn, repeticoes: int) -> float:
+    """Melhor tempo em ms (menos ruído que a média)."""
+    melhor = float("inf")
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        fn()
+        melhor = min(melhor, time.perf_counter() - t0)
+    return melhor * 1000
+
+
+def _padrao_fastapi(dados) -> bytes:
+    return json.dumps(jsonable_encoder(dados), ensure_ascii=False, allow_nan=False,
+                      indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--conversas", type=int, default=200)
+    ap.add_argument("--mensagens", type=int, default=50)
+    ap.add_argument("--fila", type=int, default=50)
+    ap.add_argument("--listas", type=int, default=300)
+    ap.add_argument("--repeticoes", type=int, default=30)
+    args = ap.parse_args()
+
+    print(f"JSON: {'orjson ' + orjson.__version__ if orjson else 'stdlib (pip install orjson)'}"
+          f" | brotli: {'sim' if brotli else 'não (pip install brotli)'}"
+          f" | gzip nível {NIVEL_GZIP}, brotli nível {NIVEL_BROTLI}\n")
+    print(f"{'payload':<34}{'fastapi ms':>11}{'rápido ms':>11}{'cru KB':>9}"
+          f"{'gzip KB':>9}{'gzip ms':>9}{'br KB':>8}{'br ms':>8}")
+
+    for nome, dados in payloads(args.conversas, args.mensagens, args.fila, args.listas).items():
+        t_padrao = _medir(lambda: _padrao_fastapi(dados), args.repeticoes)
+        t_rapido = _medir(lambda: dumps(dados), args.repeticoes)
+        corpo = dumps(dados)
+        gz = comprimir(corpo, "gzip")
+        t_gz = _medir(lambda: comprimir(corpo, "gzip"), args.repeticoes)
+        if brotli is not None:
+            br = comprimir(corpo, "br")
+            t_br = _medir(lambda: comprimir(corpo, "br"), args.repeticoes)
+            col_br = f"{len(br) / 1024:>8.1f}{t_br:>8.2f}"
+        else:
+            col_br = f"{'-':>8}{'-':>8}"
+        print(f"{nome:<34}{t_padrao:>11.2f}{t_rapido:>11.2f}{len(corpo) / 1024:>9.1f}"
+              f"{len(gz) / 1024:>9.1f}{t_gz:>9.2f}{col_br}")
+
+
+if __name__ == "__main__":
+    main()
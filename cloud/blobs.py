@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+from typing import BinaryIO, Dict, Iterator, Optional
+
+# "local": sistema de arquivos (padrão, também serve de dublê em dev/testes).
+# "supabase": Supabase Storage (bucket BLOB_BUCKET).
+BLOB_BACKEND = os.environ.get("BLOB_BACKEND", "local")
+BLOB_DIR = os.environ.get("BLOB_DIR", "blobs")
+BLOB_BUCKET = os.environ.get("BLOB_BUCKET", "midia")
+
+TAMANHO_BLOCO = 256 * 1024
+# Validade da URL assinada usada para baixar do Supabase Storage em blocos
+URL_ASSINADA_SEG = 60
+MIME_PADRAO = "application/octet-stream"
+
+_REF_VALIDA = re.compile(r"^[0-9a-f]{64}$")
+
+
+def ref_valida(ref: str) -> bool:
+    return bool(_REF_VALIDA.match(ref or ""))
+
+
+def _hash_em_arquivo(origem: BinaryIO, destino: BinaryIO) -> tuple:
+    """Copia em blocos calculando o sha256. Retorna (hex, tamanho)."""
+    h = hashlib.sha256()
+    tamanho = 0
+    while True:
+        bloco = origem.read(TAMANHO_BLOCO)
+        if not bloco:
+            break
+        h.update(bloco)
+        destino.write(bloco)
+        tamanho += len(bloco)
+    return h.hexdigest(), tamanho
+
+
+class ArmazemLocal:
+    """
+    Blobs endereçados por conteúdo em disco: BLOB_DIR/ab/cd/<sha256>.
+    Arquivos idênticos viram um só; o mimetype fica num .json ao lado.
+    """
+
+    def __init__(self, raiz: str = BLOB_DIR):
+        self.raiz = os.path.abspath(raiz)
+        os.makedirs(self.raiz, exist_ok=True)
+
+    def _caminho(self, ref: str) -> str:
+        return os.path.join(self.raiz, ref[:2], ref[2:4], ref)
+
+    def salvar(self, origem: BinaryIO, mimetype: Optional[str] = None) -> Dict:
+        with tempfile.NamedTemporaryFile(dir=self.raiz, delete=False) as tmp:
+            ref, tamanho = _hash_em_arquivo(origem, tmp)
+
+        destino = self._caminho(ref)
+        if os.path.exists(destino):
+            os.remove(tmp.name)
+            return {"ref": ref, "tamanho": tamanho, "mimetype": self.mimetype(ref), "novo": False}
+
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        os.replace(tmp.name, destino)
+        with open(destino + ".json", "w") as f:
+            json.dump({"mimetype": mimetype or MIME_PADRAO, "tamanho": tamanho}, f)
+        return {"ref": ref, "tamanho": tamanho, "mimetype": mimetype or MIME_PADRAO, "novo": True}
+
+    def info(self, ref: str) -> Optional[Dict]:
+        """{"tamanho", "mimetype"} do blob, ou None se não existe."""
+        if not ref_valida(ref):
+            return None
+        try:
+            tamanho = os.path.getsize(self._caminho(ref))
+        except OSError:
+            return None
+        return {"tamanho": tamanho, "mimetype": self.mimetype(ref)}
+
+    def existe(self, ref: str) -> bool:
+        return ref_valida(ref) and os.path.exists(self._caminho(ref))
+
+    def mimetype(self, ref: str) -> str:
+        try:
+            with open(self._caminho(ref) + ".json") as f:
+                return json.load(f).get("mimetype") or MIME_PADRAO
+        except (OSError, ValueError):
+            return MIME_PADRAO
+
+    def tamanho(self, ref: str) -> int:
+        return os.path.getsize(self._caminho(ref))
+
+    def ler(self, ref: str) -> Iterator[bytes]:
+        with open(self._caminho(ref), "rb") as f:
+            while True:
+                bloco = f.read(TAMANHO_BLOCO)
+                if not bloco:
+                    break
+                yield bloco
+
+
+class ArmazemSupabase:
+    """
+    Mesmo contrato, sobre o Supabase Storage. O objeto se chama <sha256>.
+
+    Upload e download passam em blocos: o arquivo vai do disco para o Storage
+    e volta por uma URL assinada, sem nunca estar inteiro na memória.
+    """
+
+    def __init__(self, cliente, bucket: str = BLOB_BUCKET):
+        self.bucket = cliente.storage.from_(bucket)
+        self._http = None
+
+    def salvar(self, origem: BinaryIO, mimetype: Optional[str] = None) -> Dict:
+        with tempfile.NamedTemporaryFile(delete=False) as tmp:
+            ref, tamanho = _hash_em_arquivo(origem, tmp)
+        try:
+            if self.info(ref) is not None:
+                return {"ref": ref, "tamanho": tamanho, "mimetype": mimetype or MIME_PADRAO, "novo": False}
+            # Arquivo aberto (não bytes): o httpx manda o multipart em blocos
+            # e o supabase-py fecha o arquivo no fim
+            self.bucket.upload(ref, open(tmp.name, "rb"),
+                               {"content-type": mimetype or MIME_PADRAO, "upsert": "true"})
+        finally:
+            os.remove(tmp.name)
+        return {"ref": ref, "tamanho": tamanho, "mimetype": mimetype or MIME_PADRAO, "novo": True}
+
+    def info(self, ref: str) -> Optional[Dict]:
+        """Tamanho e mimetype numa chamada só ao Storage; None se não existe."""
+        if not ref_valida(ref):
+            return None
+        for o in self.bucket.list("", {"search": ref, "limit": 1}):
+            if o.get("name") == ref:
+                meta = o.get("metadata") or {}
+                return {"tamanho": meta.get("size"), "mimetype": meta.get("mimetype") or MIME_PADRAO}
+        return None
+
+    def existe(self, ref: str) -> bool:
+        return self.info(ref) is not None
+
+    def mimetype(self, ref: str) -> str:
+        return (self.info(ref) or {}).get("mimetype") or MIME_PADRAO
+
+    def tamanho(self, ref: str) -> Optional[int]:
+        return (self.info(ref) or {}).get("tamanho")
+
+    def ler(self, ref: str) -> Iterator[bytes]:
+        import httpx
+
+        assinada = self.bucket.create_signed_url(ref, URL_ASSINADA_SEG)
+        url = assinada.get("signedURL") or assinada.get("signedUrl")
+        if self._http is None:
+            self._http = httpx.Client(timeout=httpx.Timeout(30.0, read=120.0))
+        with self._http.stream("GET", url) as res:
+            res.raise_for_status()
+            yield from res.iter_bytes(TAMANHO_BLOCO)
+
+
+def criar_armazem(cliente_supabase=None):
+    if BLOB_BACKEND == "supabase":
+        if cliente_supabase is None:
+            print("⚠️ BLOB_BACKEND=supabase sem cliente Supabase. Usando disco local.")
+        else:
+            return ArmazemSupabase(cliente_supabase)
+    return ArmazemLocal()
@@ -0,0 +1,100 @@
+import asyncio
+import os
+import time
+from typing import Callable, Dict, List
+
+# Ritmo padrão de um job (mensagens por minuto) e o teto aceito pela API
+BROADCAST_TAXA_POR_MINUTO = int(os.environ.get("BROADCAST_TAXA_POR_MINUTO", "20"))
+BROADCAST_TAXA_MAX = int(os.environ.get("BROADCAST_TAXA_MAX", "120"))
+TICK_BROADCAST_SEG = 2.0
+
+
+def normalizar_destinos(listas: List[str], telefones: List[str]) -> List[str]:
+    """Listas (ids de grupo, já no formato do WhatsApp) + contatos avulsos, sem repetição e na ordem pedida."""
+    destinos = list(listas)
+    for tel in telefones:
+        if "@" in tel:
+            destinos.append(tel)
+        else:
+            digitos = "".join(filter(str.isdigit, tel))
+            if digitos:
+                destinos.append(f"{digitos}@c.us")
+    return list(dict.fromkeys(d for d in destinos if d))
+
+
+def progresso(job: dict, estatisticas: Dict[str, int]) -> dict:
+    total = job.get("total") or sum(estatisticas.values())
+    enviados = estatisticas.get("enviado", 0)
+    falhas = estatisticas.get("falhou", 0)
+    return {
+        "total": total,
+        "agendados": estatisticas.get("agendado", 0),
+        "na_fila": estatisticas.get("pendente", 0) + estatisticas.get("em_envio", 0),
+        "enviados": enviados,
+        "falhas": falhas,
+        "cancelados": estatisticas.get("cancelado", 0),
+        "percentual": round(100 * (enviados + falhas) / total, 1) if total else 100.0,
+    }
+
+
+class LiberadorBroadcasts:
+    """
+    Solta as mensagens 'agendado' dos jobs ativos para a fila de saída, cada
+    job no seu ritmo (balde de fichas: taxa_por_minuto, com rajada de um tick).
+
+    O Carteiro não sabe nada de transmissão: só vê a fila andar devagar. Pausar
+    é só parar de liberar; cancelar marca o que sobrou como 'cancelado'.
+    """
+
+    def __init__(self, banco, ao_liberar: Callable[[int, int], None]):
+        self.banco = banco
+        self.ao_liberar = ao_liberar
+        self._fichas: Dict[int, float] = {}
+        self._visto: Dict[int, float] = {}
+        self.liberadas = 0
+        self.concluidos = 0
+
+    async def rodar(self):
+        while True:
+            try:
+                await self.passo()
+            except Exception as e:
+                print(f"[WARN] Falha no liberador de transmissões: {e}")
+            await asyncio.sleep(TICK_BROADCAST_SEG)
+
+    async def passo(self):
+        ativos = await self.banco.listar_broadcasts(status=["ativo"], limite=1000)
+        agora = time.monotonic()
+        vivos = set()
+        for job in ativos:
+            id_job = job["id"]
+            vivos.add(id_job)
+            taxa = (job.get("taxa_por_minuto") or BROADCAST_TAXA_POR_MINUTO) / 60.0
+            # Job novo (ou retomado) já começa com uma ficha: a 1ª mensagem sai no ato
+            fichas = self._fichas.get(id_job, 1.0) + taxa * (agora - self._visto.get(id_job, agora))
+            fichas = min(fichas, max(1.0, taxa * TICK_BROADCAST_SEG))
+            self._visto[id_job] = agora
+
+            quantidade = int(fichas)
+            if quantidade:
+                liberadas = await self.banco.liberar_broadcast(id_job, quantidade)
+                fichas -= liberadas
+                self.liberadas += liberadas
+                if liberadas:
+                    self.ao_liberar(id_job, liberadas)
+                if liberadas < quantidade:
+                    # Nada mais agendado: o resto é com o Carteiro. Condicional a
+                    # 'ativo' para não desfazer um pausar/cancelar que chegou no meio
+                    if await self.banco.concluir_broadcast(id_job):
+                        self.concluidos += 1
+                    vivos.discard(id_job)
+            self._fichas[id_job] = fichas
+
+        # Pausados/cancelados/concluídos saem da memória (retomar recomeça o balde)
+        for id_job in list(self._fichas):
+            if id_job not in vivos:
+                self._fichas.pop(id_job, None)
+                self._visto.pop(id_job, None)
+
+    def metricas(self) -> dict:
+        return {"jobs_ativos": len(self._fichas), "liberadas": self.liberadas, "concluidos": self.concluidos}
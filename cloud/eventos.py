@@ -0,0 +1,108 @@
+import asyncio
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+class BarramentoEventos:
+    """
+    Log de eventos em memória com cursor (seq) para long-poll/streams.
+
+    - publicar() pode ser chamado de qualquer thread (rotas sync rodam no threadpool).
+    - aguardar() é assíncrono: acorda assim que sai um evento novo.
+    - 'epoca' muda a cada restart do processo; um cliente com época diferente
+      (ou cursor que já saiu da janela) recebe reset=True e deve recarregar.
+
+    É por processo: com vários workers da bridge, cada um tem o seu log e os
+    clientes dependem do timeout do long-poll para ver eventos dos outros.
+    """
+
+    def __init__(self, capacidade: int = 5000):
+        self.epoca = uuid.uuid4().hex[:12]
+        self._lock = threading.Lock()
+        self._eventos: deque = deque(maxlen=capacidade)
+        self._seq = 0
+        self._esperando: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+
+    @property
+    def seq(self) -> int:
+        with self._lock:
+            return self._seq
+
+    def publicar(self, tipo: str, dados: Dict[str, Any], setor: Optional[str] = None) -> int:
+        with self._lock:
+            self._seq += 1
+            self._eventos.append({
+                "seq": self._seq,
+                "tipo": tipo,
+                "setor": setor,
+                "dados": dados,
+                "ts": time.time(),
+            })
+            seq = self._seq
+            esperando, self._esperando = self._esperando, []
+
+        for loop, evento in esperando:
+            try:
+                loop.call_soon_threadsafe(evento.set)
+            except RuntimeError:
+                pass  # loop já encerrado
+        return seq
+
+    def _desde(self, cursor: int, tipos: Optional[Iterable[str]], setor: Optional[str]) -> Tuple[List[dict], bool]:
+        """Chamar com o lock. Retorna (eventos filtrados, reset)."""
+        if cursor > self._seq:
+            return [], True
+        if self._eventos and cursor < self._eventos[0]["seq"] - 1:
+            return [], True
+
+        tipos = set(tipos) if tipos else None
+        saida = []
+        for ev in self._eventos:
+            if ev["seq"] <= cursor:
+                continue
+            if tipos and ev["tipo"] not in tipos:
+                continue
+            if setor and ev["setor"] and ev["setor"] != setor:
+                continue
+            saida.append(ev)
+        return saida, False
+
+    def ler(self, cursor: int, epoca: Optional[str] = None, tipos: Optional[Iterable[str]] = None,
+            setor: Optional[str] = None) -> Dict[str, Any]:
+        with self._lock:
+            if epoca and epoca != self.epoca:
+                return {"epoca": self.epoca, "cursor": self._seq, "reset": True, "eventos": []}
+            eventos, reset = self._desde(cursor, tipos, setor)
+            return {"epoca": self.epoca, "cursor": self._seq, "reset": reset, "eventos": eventos}
+
+    async def aguardar(self, cursor: int, timeout: float, epoca: Optional[str] = None,
+                       tipos: Optional[Iterable[str]] = None, setor: Optional[str] = None) -> Dict[str, Any]:
+        """Long-poll: devolve na hora se já há eventos após o cursor, senão espera até o timeout."""
+        limite = time.monotonic() + timeout
+        loop = asyncio.get_running_loop()
+
+        while True:
+            with self._lock:
+                if epoca and epoca != self.epoca:
+                    return {"epoca": self.epoca, "cursor": self._seq, "reset": True, "eventos": []}
+                eventos, reset = self._desde(cursor, tipos, setor)
+                if eventos or reset:
+                    return {"epoca": self.epoca, "cursor": self._seq, "reset": reset, "eventos": eventos}
+                # Nada relevante até aqui: avança o cursor para não reler
+                cursor = self._seq
+                sinal = asyncio.Event()
+                self._esperando.append((loop, sinal))
+
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                return {"epoca": self.epoca, "cursor": cursor, "reset": False, "eventos": []}
+            try:
+                await asyncio.wait_for(sinal.wait(), restante)
+            except asyncio.TimeoutError:
+                return {"epoca": self.epoca, "cursor": cursor, "reset": False, "eventos": []}
+
+
+barramento = BarramentoEventos()
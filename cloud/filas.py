@@ -0,0 +1,193 @@
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+# Quantos atendimentos recentes entram na média de cada setor
+AMOSTRAS_POR_SETOR = 100
+# Ressincroniza com o banco (corrige deriva, outro worker, restart)
+RESSINCRONIZAR_SEG = 60.0
+
+
+def sigla_setor(setor: Optional[str]) -> str:
+    """'Secretaria Acadêmica (SEC)' -> 'SEC'. Transferência e consulta podem vir em formatos diferentes."""
+    setor = (setor or "").strip()
+    if "(" in setor and ")" in setor:
+        return setor.split("(")[-1].replace(")", "").strip()
+    return setor
+
+
+class _Media:
+    """Média móvel das últimas N amostras, atualizada em O(1)."""
+
+    def __init__(self, n: int = AMOSTRAS_POR_SETOR):
+        self.amostras: deque = deque(maxlen=n)
+        self.soma = 0.0
+
+    def adicionar(self, valor: float):
+        if len(self.amostras) == self.amostras.maxlen:
+            self.soma -= self.amostras[0]
+        self.amostras.append(valor)
+        self.soma += valor
+
+    @property
+    def media(self) -> Optional[float]:
+        return self.soma / len(self.amostras) if self.amostras else None
+
+
+class PainelFilas:
+    """
+    Filas de atendimento humano por setor, mantidas em memória pelas próprias
+    rotas (transferir, assumir, encerrar) em vez de um count no banco a cada consulta.
+
+    Também mede, por setor, a espera (transferência -> assumir) e a duração
+    (assumir -> encerrar) dos atendimentos recentes para estimar a espera de quem entra.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._fila: Dict[str, Dict[str, float]] = defaultdict(dict)       # setor -> {telefone: entrou_em}
+        self._atendimento: Dict[str, tuple] = {}                          # telefone -> (setor, atendente, assumido_em)
+        self._atendentes: Dict[str, Dict[str, int]] = defaultdict(dict)   # setor -> {atendente: conversas}
+        self._espera: Dict[str, _Media] = defaultdict(_Media)
+        self._duracao: Dict[str, _Media] = defaultdict(_Media)
+        self.sincronizado_em = 0.0
+
+    # --- eventos das rotas ---
+    def _tirar_da_fila(self, telefone: str) -> Optional[tuple]:
+        for setor, fila in self._fila.items():
+            if telefone in fila:
+                return setor, fila.pop(telefone)
+        return None
+
+    def _tirar_do_atendimento(self, telefone: str) -> Optional[tuple]:
+        atual = self._atendimento.pop(telefone, None)
+        if atual:
+            setor, atendente, _ = atual
+            contagem = self._atendentes[setor]
+            contagem[atendente] = contagem.get(atendente, 1) - 1
+            if contagem[atendente] <= 0:
+                del contagem[atendente]
+        return atual
+
+    def entrou_na_fila(self, telefone: str, setor: str, quando: Optional[float] = None):
+        with self._lock:
+            self._tirar_da_fila(telefone)
+            self._tirar_do_atendimento(telefone)
+            self._fila[sigla_setor(setor)][telefone] = time.time() if quando is None else quando
+
+    def assumida(self, telefone: str, atendente: Optional[str], quando: Optional[float] = None):
+        quando = time.time() if quando is None else quando
+        with self._lock:
+            na_fila = self._tirar_da_fila(telefone)
+            anterior = self._tirar_do_atendimento(telefone)
+            if na_fila:
+                setor, entrou_em = na_fila
+                self._espera[setor].adicionar(quando - entrou_em)
+            elif anterior:
+                setor = anterior[0]
+            else:
+                return  # conversa aberta direto pelo painel: não é fila de setor
+            self._atendimento[telefone] = (setor, atendente or "", quando)
+            contagem = self._atendentes[setor]
+            contagem[atendente or ""] = contagem.get(atendente or "", 0) + 1
+
+    def encerrada(self, telefone: str, quando: Optional[float] = None):
+        quando = time.time() if quando is None else quando
+        with self._lock:
+            self._tirar_da_fila(telefone)
+            atual = self._tirar_do_atendimento(telefone)
+            if atual:
+                setor, _, assumido_em = atual
+                self._duracao[setor].adicionar(quando - assumido_em)
+
+    # --- leitura ---
+    def estimativa(self, setor: str) -> Dict[str, Any]:
+        """O(1): tamanho da fila e espera estimada (None = sem histórico ainda)."""
+        setor = sigla_setor(setor)
+        with self._lock:
+            em_fila = len(self._fila.get(setor, ()))
+            atendentes = max(1, len(self._atendentes.get(setor, ())))
+            duracao = self._duracao[setor].media if setor in self._duracao else None
+            espera = self._espera[setor].media if setor in self._espera else None
+            amostras = len(self._duracao[setor].amostras) if setor in self._duracao else 0
+
+        estimada = None
+        if duracao is not None:
+            # Quem acabou de entrar espera a fila à frente andar, dividida entre os atendentes
+            rodadas = -(-max(em_fila, 1) // atendentes)
+            estimada = rodadas * duracao
+            if espera is not None:
+                estimada = (estimada + espera) / 2
+        elif espera is not None:
+            estimada = espera
+
+        return {
+            "em_fila": em_fila,
+            "atendentes_ativos": atendentes,
+            "espera_estimada_seg": round(estimada) if estimada is not None else None,
+            "espera_media_seg": round(espera) if espera is not None else None,
+            "duracao_media_seg": round(duracao) if duracao is not None else None,
+            "amostras": amostras,
+        }
+
+    def precisa_sincronizar(self) -> bool:
+        return time.time() - self.sincronizado_em > RESSINCRONIZAR_SEG
+
+    def sincronizar(self, linhas: list):
+        """
+        Recarrega quem está em fila/atendimento a partir do banco
+        (linhas de conversas com status, setor, atendente e os timestamps da migrations/0004).
+
+        As médias de tempo continuam as da memória; um setor ainda sem amostras
+        (bridge recém-reiniciada) começa com as dos atendimentos abertos: a espera
+        de cada um (assumido_em - entrou_fila_em) e há quanto tempo está aberto,
+        que em média acompanha a duração de um atendimento.
+        """
+        agora = time.time()
+        fila: Dict[str, Dict[str, float]] = defaultdict(dict)
+        atendimento: Dict[str, tuple] = {}
+        atendentes: Dict[str, Dict[str, int]] = defaultdict(dict)
+        esperas: Dict[str, list] = defaultdict(list)
+        abertos: Dict[str, list] = defaultdict(list)
+
+        for c in linhas:
+            setor = sigla_setor(c.get("setor_responsavel"))
+            if c.get("status") == "fila":
+                fila[setor][c["telefone"]] = _epoch(c.get("entrou_fila_em")) or agora
+            elif c.get("status") == "atendimento" and setor and setor != "geral":
+                atendente = c.get("atendente_atual") or ""
+                entrou_em, assumido_em = _epoch(c.get("entrou_fila_em")), _epoch(c.get("assumido_em"))
+                atendimento[c["telefone"]] = (setor, atendente, assumido_em or agora)
+                atendentes[setor][atendente] = atendentes[setor].get(atendente, 0) + 1
+                if assumido_em is not None:
+                    abertos[setor].append(max(0.0, agora - assumido_em))
+                    if entrou_em is not None and entrou_em <= assumido_em:
+                        esperas[setor].append(assumido_em - entrou_em)
+
+        with self._lock:
+            self._fila, self._atendimento, self._atendentes = fila, atendimento, atendentes
+            for medias, amostras in ((self._espera, esperas), (self._duracao, abertos)):
+                for setor, valores in amostras.items():
+                    if setor not in medias or not medias[setor].amostras:
+                        for valor in valores:
+                            medias[setor].adicionar(valor)
+            self.sincronizado_em = agora
+
+    def metricas(self) -> Dict[str, Any]:
+        with self._lock:
+            setores = set(self._fila) | set(self._atendentes) | set(self._duracao)
+        return {s: self.estimativa(s) for s in sorted(setores) if s}
+
+
+def _epoch(valor: Optional[str]) -> Optional[float]:
+    if not valor:
+        return None
+    try:
+        return datetime.fromisoformat(valor.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+painel_filas = PainelFilas()
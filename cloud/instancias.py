@@ -0,0 +1,91 @@
+import bisect
+import hashlib
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+# Uma instância (número de WhatsApp + Node + cérebro local) é considerada viva
+# enquanto reivindica a fila / manda heartbeat dentro desse intervalo.
+INSTANCIA_TTL_SEG = float(os.environ.get("INSTANCIA_TTL_SEG", "90"))
+# Conversas (e a fila) de uma instância que saiu do ar passam para as vivas
+# pelo anel. "0" = cada conversa fica presa ao seu número até ele voltar.
+REATRIBUIR_ORFAS = os.environ.get("INSTANCIAS_REATRIBUIR", "1") != "0"
+# Pontos de cada instância no anel: mais pontos = divisão mais uniforme
+PONTOS_POR_INSTANCIA = 64
+
+
+def _hash(chave: str) -> int:
+    return int(hashlib.sha1(chave.encode("utf-8")).hexdigest()[:12], 16)
+
+
+class AnelConsistente:
+    """
+    Hash consistente telefone -> instância. Quando uma instância entra ou sai,
+    só ~1/N das conversas mudam de dona (as outras continuam onde estavam).
+    """
+
+    def __init__(self, instancias: List[str] = ()):
+        self.instancias = sorted(instancias)
+        pontos = sorted((_hash(f"{inst}#{i}"), inst) for inst in self.instancias
+                        for i in range(PONTOS_POR_INSTANCIA))
+        self._chaves = [p for p, _ in pontos]
+        self._donos = [inst for _, inst in pontos]
+
+    def escolher(self, chave: str) -> Optional[str]:
+        if not self._chaves:
+            return None
+        i = bisect.bisect(self._chaves, _hash(chave)) % len(self._chaves)
+        return self._donos[i]
+
+
+class RegistroInstancias:
+    """
+    Instâncias locais vistas recentemente (heartbeat implícito: cada
+    reivindicação/stream da fila e cada sync conta). O anel é refeito só
+    quando o conjunto de instâncias vivas muda.
+    """
+
+    def __init__(self, ttl: float = INSTANCIA_TTL_SEG):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._vistas: Dict[str, float] = {}
+        self._anel = AnelConsistente()
+
+    def visto(self, instancia: Optional[str]):
+        if not instancia:
+            return
+        with self._lock:
+            nova = instancia not in self._vistas
+            self._vistas[instancia] = time.time()
+            if nova:
+                print(f"🛰️ Instância '{instancia}' conectada")
+                self._refazer()
+
+    def _refazer(self):
+        """Chamar com o lock: tira as instâncias vencidas e refaz o anel se algo mudou."""
+        limite = time.time() - self.ttl
+        for inst in [i for i, t in self._vistas.items() if t < limite]:
+            del self._vistas[inst]
+            print(f"🛰️ Instância '{inst}' sem sinal há {self.ttl:.0f}s")
+        if sorted(self._vistas) != self._anel.instancias:
+            self._anel = AnelConsistente(list(self._vistas))
+
+    def ativas(self) -> List[str]:
+        with self._lock:
+            self._refazer()
+            return list(self._anel.instancias)
+
+    def escolher(self, telefone: str) -> Optional[str]:
+        with self._lock:
+            self._refazer()
+            return self._anel.escolher(telefone)
+
+    def listar(self) -> List[dict]:
+        agora = time.time()
+        with self._lock:
+            self._refazer()
+            return [{"instancia": inst, "visto_ha_seg": round(agora - t, 1)} for inst, t in sorted(self._vistas.items())]
+
+
+registro_instancias = RegistroInstancias()
@@ -1,23 +1,64 @@
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import mimetypes
 import os
+import threading
+import time
+from collections import OrderedDict
 from typing import List, Optional
 from datetime import datetime
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, File, Form, UploadFile, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
-from supabase import create_client, Client
 
-app = FastAPI(title="NUBIA Cloud Bridge")
+from arquivo import ARQUIVO_IDADE_DIAS, ArquivoMensagens, loop_arquivamento
+from banco import BancoSupabase, criar_banco, cursor_conversas_valido
+from blobs import BLOB_BACKEND, criar_armazem
+from broadcasts import (BROADCAST_TAXA_MAX, BROADCAST_TAXA_POR_MINUTO, LiberadorBroadcasts,
+                        normalizar_destinos, progresso)
+from eventos import barramento
+from filas import painel_filas
+from instancias import REATRIBUIR_ORFAS, registro_instancias
+from respostas import CompressaoMiddleware, RespostaJSON, dumps
 
 # ----------------------------
 # CONFIGURAÇÃO SUPABASE
 # ----------------------------
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
+# Acesso assíncrono às tabelas (ver banco.py): Supabase ou SQLite (BANCO_BACKEND)
+banco = criar_banco()
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    print("⚠️ AVISO: SUPABASE_URL ou SUPABASE_KEY não configurados.")
-    supabase: Optional[Client] = None
-else:
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Mídia fica fora da tabela: mensagens guardam só a referência (sha256).
+# O Storage do supabase-py usa o cliente síncrono; as rotas o chamam no threadpool.
+cliente_storage = None
+if BLOB_BACKEND == "supabase" and isinstance(banco, BancoSupabase):
+    from supabase import create_client
+    cliente_storage = create_client(banco.url, banco.chave)
+armazem = criar_armazem(cliente_storage)
+arquivo = ArquivoMensagens()
+# Acorda o Carteiro (/sync/fila_stream) quando um job solta mensagens na fila
+liberador = LiberadorBroadcasts(banco, lambda id_job, qtd: barramento.publicar("fila", {"broadcast": id_job}))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    tarefas = []
+    if banco is not None:
+        await banco.conectar()
+        tarefas.append(asyncio.create_task(liberador.rodar()))
+        if ARQUIVO_IDADE_DIAS > 0:
+            tarefas.append(asyncio.create_task(loop_arquivamento(banco, arquivo, _salvar_base64)))
+    yield
+    for tarefa in tarefas:
+        tarefa.cancel()
+    if banco is not None:
+        await banco.fechar()
+
+app = FastAPI(title="NUBIA Cloud Bridge", lifespan=lifespan, default_response_class=RespostaJSON)
+app.add_middleware(CompressaoMiddleware)
 
 
 # ----------------------------
@@ -32,6 +73,16 @@ class MsgSync(BaseModel):
     arquivo_base64: Optional[str] = None
     arquivo_nome: Optional[str] = None
     arquivo_tipo: Optional[str] = None
+    arquivo_ref: Optional[str] = None
+    arquivo_tamanho: Optional[int] = None
+    arquivo_mime: Optional[str] = None
+    # Hora do evento no PC local (o lote pode chegar segundos depois)
+    created_at: Optional[str] = None
+    # Instância local (número de WhatsApp) que recebeu/enviou
+    instancia: Optional[str] = None
+    # Chave de idempotência do evento (origem + sequência do bot local): um
+    # lote reenviado depois de uma resposta perdida não duplica o log
+    chave: Optional[str] = None
 
 class ListaZap(BaseModel):
     id: str
@@ -50,6 +101,21 @@ class EnvioLista(BaseModel):
     nome_arquivo: Optional[str] = None
     tipo_midia: Optional[str] = None
     
+class NovoBroadcast(BaseModel):
+    mensagem: str
+    atendente_nome: str
+    listas: List[str] = []
+    telefones: List[str] = []
+    base64: Optional[str] = None
+    nome_arquivo: Optional[str] = None
+    tipo_midia: Optional[str] = None
+    taxa_por_minuto: Optional[int] = None
+
+class ConfirmacaoLote(BaseModel):
+    enviados: List[int] = []
+    falhas: List[int] = []
+    devolvidas: List[int] = []  # voltam à fila sem gastar tentativa (chat bloqueado no carteiro)
+
 class TransferenciaSync(BaseModel):
     telefone: str
     setor: str
@@ -82,56 +148,183 @@ class EnviarArquivo(BaseModel):
 # HELPERS
 # ----------------------------
 def require_supabase():
-    if supabase is None:
-        raise HTTPException(status_code=500, detail="Supabase não configurado.")
+    if banco is None:
+        raise HTTPException(status_code=500, detail="Banco não configurado (SUPABASE_URL/SUPABASE_KEY ou BANCO_BACKEND=sqlite).")
 
 def now_iso():
     return datetime.now().isoformat()
 
-def store_message(payload: dict):
+# Colunas que o Carteiro precisa para entregar (nada de select("*"))
+CAMPOS_ENTREGA = ("id, telefone, texto, arquivo_base64, arquivo_nome, arquivo_tipo, "
+                  "arquivo_ref, arquivo_tamanho, arquivo_mime, created_at")
+LOTE_FILA = 50
+LEASE_FILA_SEG = 60
+MAX_TENTATIVAS_ENVIO = 5
+
+def colunas_midia(info: dict) -> dict:
+    return {"arquivo_ref": info["ref"], "arquivo_tamanho": info["tamanho"], "arquivo_mime": info["mimetype"]}
+
+def _salvar_base64(b64: str, mimetype: Optional[str]) -> dict:
+    if b64.startswith("data:") and "," in b64:
+        cabecalho, b64 = b64.split(",", 1)
+        mimetype = cabecalho[5:].split(";")[0] or mimetype
+    return armazem.salvar(io.BytesIO(base64.b64decode(b64)), mimetype)
+
+async def guardar_midia_base64(b64: Optional[str], mimetype: Optional[str] = None) -> dict:
+    """
+    Compatibilidade com as rotas em base64: decodifica, grava no armazém
+    (deduplicado por conteúdo) e devolve as colunas de referência.
+    """
+    if not b64:
+        return {}
+    info = await run_in_threadpool(_salvar_base64, b64, mimetype)
+    return colunas_midia(info)
+
+def _inseridas(salvas: List[dict], linhas: List[dict]) -> List[dict]:
+    """Linhas realmente gravadas; com chave_sync, as repetidas não voltam do banco."""
+    if salvas or any(l.get("chave_sync") for l in linhas):
+        return salvas
+    return linhas
+
+async def store_message(payload: dict):
     require_supabase()
-    supabase.table("mensagens").insert(payload).execute()
+    salvas = _inseridas(await banco.inserir_mensagens([payload]), [payload])
+    if not salvas:
+        return  # reenvio de um evento já gravado
+    publicar_mensagem(salvas[0])
+    if payload.get("status_envio") == "pendente":
+        # Acorda o Carteiro que está em /sync/fila_stream
+        avisar_fila(payload.get("telefone"))
 
-def upsert_conversa(payload: dict):
+async def upsert_conversa(payload: dict):
     require_supabase()
-    supabase.table("conversas").upsert(payload).execute()
+    await banco.upsert_conversas([payload])
+
+def resposta_condicional(request: Request, dados, headers: Optional[dict] = None):
+    """JSON com ETag; se o cliente já tem essa versão (If-None-Match), 304 sem corpo."""
+    corpo = dumps(dados, ordenar=True)
+    etag = '"' + hashlib.sha1(corpo).hexdigest() + '"'
+    headers = {**(headers or {}), "ETag": etag}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(content=corpo, media_type="application/json", headers=headers)
+
+# Setor de cada conversa, aprendido nas transferências e listagens. Só serve
+# para filtrar eventos por setor; telefone desconhecido = evento para todos.
+_setor_por_telefone: "OrderedDict[str, str]" = OrderedDict()
+_lock_setores = threading.Lock()
+MAX_SETORES_MEMORIA = 50000
+
+def lembrar_setor(telefone: str, setor: Optional[str]):
+    if not setor:
+        return
+    with _lock_setores:
+        _setor_por_telefone[telefone] = setor
+        _setor_por_telefone.move_to_end(telefone)
+        while len(_setor_por_telefone) > MAX_SETORES_MEMORIA:
+            _setor_por_telefone.popitem(last=False)
+
+def setor_da_conversa(telefone: str) -> Optional[str]:
+    with _lock_setores:
+        return _setor_por_telefone.get(telefone)
+
+# Mesma ideia para a instância dona da conversa: o aviso de fila acorda só o
+# stream dela. Desconhecida = acorda todas (cada uma reivindica só o que é seu).
+_instancia_por_telefone: "OrderedDict[str, str]" = OrderedDict()
+
+def lembrar_instancia(telefone: str, instancia: Optional[str]):
+    if not instancia:
+        return
+    with _lock_setores:
+        _instancia_por_telefone[telefone] = instancia
+        _instancia_por_telefone.move_to_end(telefone)
+        while len(_instancia_por_telefone) > MAX_SETORES_MEMORIA:
+            _instancia_por_telefone.popitem(last=False)
+
+def _trocou_de_instancia(telefone: str, instancia: Optional[str]) -> bool:
+    """O sync veio por outra instância (ou não sabemos a anterior): a fila pendente vai junto."""
+    if not instancia:
+        return False
+    with _lock_setores:
+        return _instancia_por_telefone.get(telefone) != instancia
+
+INTERVALO_ADOCAO_SEG = 10
+_ultima_adocao = 0.0
+
+def avisar_fila(telefone: Optional[str]):
+    """Acorda o Carteiro (/sync/fila_stream) da instância dona da conversa."""
+    global _ultima_adocao
+    with _lock_setores:
+        instancia = _instancia_por_telefone.get(telefone)
+    if instancia is not None and REATRIBUIR_ORFAS and instancia not in registro_instancias.ativas():
+        instancia = None  # dona fora do ar: a conversa volta ao anel
+    if instancia is None:
+        # Talvez conversa sem dona: a próxima reivindicação já distribui
+        _ultima_adocao = 0.0
+    barramento.publicar("fila", {"telefone": telefone}, setor=instancia)
+
+def publicar_status(telefone: str, status: str, setor: Optional[str] = None):
+    """Avisa quem acompanha /sync/status_mudancas (cache do bot local) e /admin/eventos (painel)."""
+    lembrar_setor(telefone, setor)
+    barramento.publicar("status", {
+        "telefone": telefone, "status": status, "setor_responsavel": setor
+    }, setor=setor or setor_da_conversa(telefone))
+
+def publicar_mensagem(msg: dict):
+    """Evento 'mensagem' para o painel: só o resumo, o conteúdo vem de /admin/chat?since_id."""
+    barramento.publicar("mensagem", {
+        "id": msg.get("id"),
+        "telefone": msg.get("telefone"),
+        "remetente": msg.get("remetente"),
+        "texto": (msg.get("texto") or "")[:200],
+        "status_envio": msg.get("status_envio"),
+        "arquivo_tipo": msg.get("arquivo_tipo"),
+        "created_at": msg.get("created_at"),
+    }, setor=setor_da_conversa(msg.get("telefone") or ""))
 
 
 # ----------------------------
 # 1) ROTAS QUE O BOT LOCAL USA
 # ----------------------------
-def garantir_conversa_existente(telefone: str):
+# Conversas que já sabemos existir (e cuja ultima_interacao foi tocada há pouco).
+# Evita o RPC em rajadas de mídia/broadcast para o mesmo telefone.
+CACHE_CONVERSAS_SEG = float(os.environ.get("CACHE_CONVERSAS_SEG", "10"))
+_conversas_conhecidas = {}
+_lock_conversas = threading.Lock()
+
+async def garantir_conversa_existente(telefone: str):
+    """Uma ida ao banco (RPC garantir_conversa, migrations/0003), ou nenhuma se estiver no cache."""
     require_supabase()
-    res = supabase.table("conversas").select("telefone").eq("telefone", telefone).execute()
-    
-    if res.data:
-        supabase.table("conversas").update({
-            "ultima_interacao": now_iso()
-        }).eq("telefone", telefone).execute()
-    else:
+    agora = time.monotonic()
+    with _lock_conversas:
+        if _conversas_conhecidas.get(telefone, 0) > agora:
+            return
+        if len(_conversas_conhecidas) > 10000:
+            for tel in [t for t, exp in _conversas_conhecidas.items() if exp <= agora]:
+                del _conversas_conhecidas[tel]
 
-        supabase.table("conversas").insert({
-            "telefone": telefone,
-            "nome_usuario": "Cliente (via Anexo)",
-            "status": "atendimento",
-            "ultima_interacao": now_iso()
-        }).execute()
+    criada = await banco.garantir_conversa(telefone)
+    with _lock_conversas:
+        _conversas_conhecidas[telefone] = agora + CACHE_CONVERSAS_SEG
+    if criada:
+        publicar_status(telefone, "atendimento")
 
 @app.post("/webhook/local")
-def receber_do_zap_local(dados: WebhookLocal):
+async def receber_do_zap_local(dados: WebhookLocal):
     require_supabase()
     tel = dados.telefone
     
     try:
-        upsert_conversa({
+        await upsert_conversa({
             "telefone": tel,
             "nome_usuario": dados.nome,
             "ultima_mensagem_texto": dados.mensagem,
             "ultima_interacao": now_iso(),
             "status": "robo"
         })
+        publicar_status(tel, "robo")
 
-        store_message({
+        await store_message({
             "telefone": tel,
             "remetente": "usuario",
             "texto": dados.mensagem,
@@ -144,7 +337,7 @@ def receber_do_zap_local(dados: WebhookLocal):
         return {"ok": False, "error": str(e)}
 
 @app.post("/sync/listas_local")
-def salvar_grupos_local(grupos: List[ListaZap]):
+async def salvar_grupos_local(grupos: List[ListaZap]):
     require_supabase()
     if not grupos: return {"ok": True}
     
@@ -152,86 +345,129 @@ def salvar_grupos_local(grupos: List[ListaZap]):
         dados = [{
             "id": g.id, "nome": g.nome, "qtd": g.qtd, "updated_at": now_iso()
         } for g in grupos]
-        supabase.table("listas_transmissao").upsert(dados).execute()
+        await banco.upsert_listas(dados)
         return {"ok": True}
     except Exception as e:
         print(f"ERRO SYNC LISTAS: {e}")
         return {"ok": False, "error": str(e)}
 
 @app.post("/sync/transferir")
-def transferir_pelo_robo(dados: TransferenciaSync):
+async def transferir_pelo_robo(dados: TransferenciaSync):
     require_supabase()
     try:
-        supabase.table("conversas").update({
+        agora = now_iso()
+        await banco.atualizar_conversa(dados.telefone, {
             "status": "fila",
             "setor_responsavel": dados.setor,
             "atendente_atual": None,
-            "ultima_interacao": now_iso()
-        }).eq("telefone", dados.telefone).execute()
+            "ultima_interacao": agora,
+            "entrou_fila_em": agora
+        })
+        painel_filas.entrou_na_fila(dados.telefone, dados.setor)
+        publicar_status(dados.telefone, "fila", dados.setor)
         return {"ok": True}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/admin/fila_setor/{setor}")
-def fila_setor(setor: str):
+_lock_sync_filas = threading.Lock()
+
+async def _sincronizar_filas():
+    """Recarrega as filas do banco no máximo a cada RESSINCRONIZAR_SEG (uma query, índice da 0004)."""
+    if not painel_filas.precisa_sincronizar() or not _lock_sync_filas.acquire(blocking=False):
+        return
     try:
-        res = supabase.table("conversas")\
-            .select("telefone", count="exact")\
-            .eq("status", "fila")\
-            .eq("setor_responsavel", setor)\
-            .execute()
-        return {"em_fila": res.count or 0}
-    except:
-        return {"em_fila": 0}
+        painel_filas.sincronizar(await banco.conversas_em_fila_ou_atendimento())
+    except Exception as e:
+        print(f"[WARN] Falha ao sincronizar filas: {e}")
+    finally:
+        _lock_sync_filas.release()
+
+@app.get("/admin/fila_setor/{setor}")
+async def fila_setor(setor: str):
+    """Tamanho da fila e espera estimada do setor, da memória (ver cloud/filas.py)."""
+    if banco is not None:
+        await _sincronizar_filas()
+    return painel_filas.estimativa(setor)
 
 # ----------------------------
 # 2) ROTAS DE MÍDIA
 # ----------------------------
+async def _registrar_midia_pendente(telefone: str, tipo: str, nome_arquivo: str, caption: str, midia: dict):
+    await garantir_conversa_existente(telefone)
+
+    if tipo == "imagem":
+        texto = f"[imagem:{nome_arquivo}] {caption or ''}"
+    elif tipo == "audio":
+        texto = "[audio]"
+    else:
+        texto = f"[arquivo:{nome_arquivo}] {caption or ''}"
+
+    await store_message({
+        "telefone": telefone,
+        "remetente": "atendente",
+        "texto": texto,
+        "arquivo_nome": nome_arquivo,
+        "arquivo_tipo": tipo,
+        **midia,
+        "status_envio": "pendente",
+        "created_at": now_iso()
+    })
+
+@app.post("/blobs")
+async def enviar_blob(arquivo: UploadFile = File(...)):
+    """Upload multipart (em streaming) para o armazém; devolve a referência."""
+    try:
+        info = await run_in_threadpool(armazem.salvar, arquivo.file, arquivo.content_type)
+        return {"ok": True, **info}
+    except Exception as e:
+        print(f"❌ ERRO UPLOAD BLOB: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/blobs/{ref}")
+def baixar_blob(ref: str):
+    """Download em streaming (Node e painel). Conteúdo imutável: cache longo."""
+    info = armazem.info(ref)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Mídia não encontrada")
+    headers = {"ETag": f'"{ref}"', "Cache-Control": "public, max-age=31536000, immutable"}
+    if info["tamanho"]:
+        headers["Content-Length"] = str(info["tamanho"])
+    return StreamingResponse(armazem.ler(ref), media_type=info["mimetype"], headers=headers)
+
+@app.post("/enviar_midia")
+async def enviar_midia(number: str = Form(...), tipo: str = Form("documento"), caption: str = Form(""),
+                       arquivo: UploadFile = File(...)):
+    """Mesmo papel de /enviar_imagem|audio|arquivo, mas multipart: sem base64 no corpo."""
+    require_supabase()
+    try:
+        mime = arquivo.content_type or mimetypes.guess_type(arquivo.filename or "")[0]
+        info = await run_in_threadpool(armazem.salvar, arquivo.file, mime)
+        nome = arquivo.filename or ("audio.mp3" if tipo == "audio" else "arquivo")
+        await _registrar_midia_pendente(number, tipo, nome, caption, colunas_midia(info))
+        return {"ok": True, "ref": info["ref"]}
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ ERRO MÍDIA: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/enviar_imagem")
-def enviar_imagem(dados: EnviarImagem):
+async def enviar_imagem(dados: EnviarImagem):
     require_supabase()
     try:
-        clean = dados.base64
-        if "," in clean and clean.startswith("data:"):
-            clean = clean.split(",", 1)[1]
-
-        garantir_conversa_existente(dados.number)
-
-        store_message({
-            "telefone": dados.number,
-            "remetente": "atendente",
-            "texto": f"[imagem:{dados.filename}] {dados.caption or ''}",
-            "arquivo_nome": dados.filename,
-            "arquivo_tipo": "imagem",
-            "arquivo_base64": clean,
-            "status_envio": "pendente",
-            "created_at": now_iso()
-        })
+        midia = await guardar_midia_base64(dados.base64, "image/jpeg")
+        await _registrar_midia_pendente(dados.number, "imagem", dados.filename, dados.caption, midia)
         return {"ok": True}
     except Exception as e:
         print(f"❌ ERRO IMAGEM: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/enviar_audio")
-def enviar_audio(dados: EnviarAudio):
+async def enviar_audio(dados: EnviarAudio):
     require_supabase()
     try:
-        clean = dados.base64
-        if "," in clean and clean.startswith("data:"):
-            clean = clean.split(",", 1)[1]
-
-        garantir_conversa_existente(dados.number)
-
-        store_message({
-            "telefone": dados.number,
-            "remetente": "atendente",
-            "texto": "[audio]",
-            "arquivo_nome": "audio.mp3",
-            "arquivo_tipo": "audio", 
-            "arquivo_base64": clean,
-            "status_envio": "pendente",
-            "created_at": now_iso()
-        })
+        midia = await guardar_midia_base64(dados.base64, "audio/mpeg")
+        await _registrar_midia_pendente(dados.number, "audio", "audio.mp3", "", midia)
         return {"ok": True}
     except Exception as e:
         print(f"❌ ERRO AO SALVAR AUDIO: {e}")
@@ -239,25 +475,11 @@ def enviar_audio(dados: EnviarAudio):
 
 
 @app.post("/enviar_arquivo")
-def enviar_arquivo(dados: EnviarArquivo):
+async def enviar_arquivo(dados: EnviarArquivo):
     require_supabase()
     try:
-        clean = dados.base64
-        if "," in clean and clean.startswith("data:"):
-            clean = clean.split(",", 1)[1]
-
-        garantir_conversa_existente(dados.number)
-
-        store_message({
-            "telefone": dados.number,
-            "remetente": "atendente",
-            "texto": f"[arquivo:{dados.filename}] {dados.caption or ''}",
-            "arquivo_nome": dados.filename,
-            "arquivo_tipo": "documento",
-            "arquivo_base64": clean,
-            "status_envio": "pendente",
-            "created_at": now_iso()
-        })
+        midia = await guardar_midia_base64(dados.base64, mimetypes.guess_type(dados.filename)[0])
+        await _registrar_midia_pendente(dados.number, "documento", dados.filename, dados.caption, midia)
         return {"ok": True}
     except Exception as e:
         print(f"❌ ERRO AO SALVAR ARQUIVO: {e}")
@@ -266,229 +488,604 @@ def enviar_arquivo(dados: EnviarArquivo):
 # ----------------------------
 # 3) ROTAS DE SINCRONIZAÇÃO (PC LOCAL -> NUVEM)
 # ----------------------------
+async def montar_mensagem(dados: MsgSync) -> dict:
+    payload_msg = {
+        "telefone": dados.telefone,
+        "remetente": dados.remetente,
+        "texto": dados.texto,
+        "status_envio": dados.status_envio,
+        "created_at": dados.created_at or now_iso(),
+        "arquivo_nome": dados.arquivo_nome,
+        "arquivo_tipo": dados.arquivo_tipo,
+        "arquivo_ref": None,
+        "arquivo_tamanho": None,
+        "arquivo_mime": None,
+        "instancia": dados.instancia,
+        "chave_sync": dados.chave,
+    }
+    if dados.arquivo_ref:
+        payload_msg.update({
+            "arquivo_ref": dados.arquivo_ref,
+            "arquivo_tamanho": dados.arquivo_tamanho,
+            "arquivo_mime": dados.arquivo_mime,
+        })
+    elif dados.arquivo_base64:
+        payload_msg.update(await guardar_midia_base64(dados.arquivo_base64, dados.arquivo_mime))
+    return payload_msg
+
+def _conversa_do_sync(dados: MsgSync) -> dict:
+    conversa = {
+        "telefone": dados.telefone,
+        "nome_usuario": dados.nome,
+        "ultima_mensagem_texto": dados.texto,
+        "ultima_interacao": dados.created_at or now_iso()
+    }
+    if dados.instancia:
+        # A conversa passa a ser do número pelo qual o cliente falou por último
+        conversa["instancia"] = dados.instancia
+    return conversa
+
 @app.post("/sync/mensagem")
-def salvar_mensagem_do_local(dados: MsgSync):
+async def salvar_mensagem_do_local(dados: MsgSync):
     require_supabase()
+    registro_instancias.visto(dados.instancia)
+    trocou = _trocou_de_instancia(dados.telefone, dados.instancia)
+    lembrar_instancia(dados.telefone, dados.instancia)
     try:
-        upsert_conversa({
-            "telefone": dados.telefone,
-            "nome_usuario": dados.nome,
-            "ultima_mensagem_texto": dados.texto,
-            "ultima_interacao": now_iso()
-        })
-
-        payload_msg = {
-            "telefone": dados.telefone,
-            "remetente": dados.remetente,
-            "texto": dados.texto,
-            "status_envio": dados.status_envio,
-            "created_at": now_iso(),
-            "arquivo_base64": dados.arquivo_base64,
-            "arquivo_nome": dados.arquivo_nome,
-            "arquivo_tipo": dados.arquivo_tipo
-        }
-
-        store_message(payload_msg)
+        await upsert_conversa(_conversa_do_sync(dados))
+        if trocou:
+            await banco.mover_fila_instancia({dados.telefone: dados.instancia})
+        await store_message(await montar_mensagem(dados))
         return {"ok": True}
     except Exception as e:
         print(f"ERRO SYNC MSG: {e}")
         return {"ok": False, "error": str(e)}
 
+@app.post("/sync/mensagens_lote")
+async def salvar_mensagens_lote(lote: List[MsgSync]):
+    """
+    Versão em lote de /sync/mensagem: um insert para todas as mensagens e um
+    upsert de conversas com uma linha por telefone (a última do lote vence).
+    Falha com 500 para o bot local reenviar o lote inteiro; mensagens com
+    `chave` já gravada num envio anterior são ignoradas (não duplicam).
+    """
+    require_supabase()
+    if not lote:
+        return {"ok": True, "mensagens": 0, "conversas": 0}
+    try:
+        conversas, trocas = {}, {}
+        for dados in lote:
+            conversas[dados.telefone] = _conversa_do_sync(dados)
+            registro_instancias.visto(dados.instancia)
+            if _trocou_de_instancia(dados.telefone, dados.instancia):
+                trocas[dados.telefone] = dados.instancia
+            lembrar_instancia(dados.telefone, dados.instancia)
+        await banco.upsert_conversas(list(conversas.values()))
+        await banco.mover_fila_instancia(trocas)
+
+        linhas = [await montar_mensagem(dados) for dados in lote]
+        salvas = _inseridas(await banco.inserir_mensagens(linhas), linhas)
+        for msg in salvas:
+            publicar_mensagem(msg)
+
+        pendentes = {l["telefone"] for l in salvas if l["status_envio"] == "pendente"}
+        for tel in pendentes:
+            avisar_fila(tel)
+        return {"ok": True, "mensagens": len(salvas), "duplicadas": len(linhas) - len(salvas),
+                "conversas": len(conversas)}
+    except Exception as e:
+        print(f"ERRO SYNC LOTE: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/sync/listas")
-def salvar_listas_do_zap(listas: List[ListaZap]):
+async def salvar_listas_do_zap(listas: List[ListaZap]):
     require_supabase()
     if not listas: return {"ok": True}
     try:
         dados = [{"id": l.id, "nome": l.nome, "qtd": l.qtd, "updated_at": now_iso()} for l in listas]
-        supabase.table("listas_transmissao").upsert(dados).execute()
+        await banco.upsert_listas(dados)
         return {"ok": True}
     except Exception as e:
         return {"ok": False, "error": str(e)}
 
 @app.get("/sync/fila_pendente")
-def pegar_fila_para_local():
+async def pegar_fila_para_local():
     require_supabase()
     try:
-        res = supabase.table("mensagens").select("*").eq("status_envio", "pendente").execute()
-        return res.data
+        return await banco.mensagens_pendentes(CAMPOS_ENTREGA)
     except Exception as e:
         print(f"ERRO AO PEGAR FILA: {e}")
         return []
 
+async def _distribuir_conversas_sem_dona():
+    """
+    Conversas com mensagens a enviar mas sem instância (criadas pelo painel,
+    por transmissão ou antes da 0008) ganham uma dona pelo hash consistente.
+    Com REATRIBUIR_ORFAS, as de instâncias que saíram do anel (sem heartbeat)
+    também: a fila delas não fica presa esperando um número que sumiu.
+    """
+    global _ultima_adocao
+    if time.monotonic() - _ultima_adocao < INTERVALO_ADOCAO_SEG:
+        return
+    _ultima_adocao = time.monotonic()
+    ativas = registro_instancias.ativas()
+    if not ativas:
+        return
+    filtro = ativas if REATRIBUIR_ORFAS else None
+    telefones = await banco.telefones_sem_instancia(500, filtro)
+    mapa = {tel: registro_instancias.escolher(tel) for tel in telefones}
+    mapa = {tel: inst for tel, inst in mapa.items() if inst}
+    if mapa:
+        await banco.atribuir_instancias(mapa, filtro)
+        for tel, inst in mapa.items():
+            lembrar_instancia(tel, inst)
+        print(f"🛰️ {len(mapa)} conversas sem dona distribuídas entre {len(ativas)} instâncias")
+
+async def reivindicar_fila(limite: int = LOTE_FILA, lease: int = LEASE_FILA_SEG,
+                           instancia: Optional[str] = None) -> list:
+    """
+    Move até `limite` pendentes para 'em_envio' com lease (RPC atômica, ver
+    migrations/0001). Com `instancia`, só as mensagens dela (migrations/0008).
+    """
+    require_supabase()
+    if not instancia:
+        return await banco.reivindicar_mensagens(max(1, min(limite, 500)), max(5, lease))
+
+    registro_instancias.visto(instancia)
+    await _distribuir_conversas_sem_dona()
+    msgs = await banco.reivindicar_mensagens(max(1, min(limite, 500)), max(5, lease), instancia)
+    for msg in msgs:
+        lembrar_instancia(msg["telefone"], instancia)
+    return msgs
+
+@app.post("/sync/fila/reivindicar")
+async def reivindicar_fila_para_local(limite: int = LOTE_FILA, lease: int = LEASE_FILA_SEG,
+                                      instancia: Optional[str] = None):
+    try:
+        return await reivindicar_fila(limite, lease, instancia)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"ERRO AO REIVINDICAR FILA: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/sync/fila/confirmar")
+async def confirmar_lote(dados: ConfirmacaoLote):
+    """Confirma (enviados) ou devolve à fila (falhas, devolvidas) várias mensagens numa chamada."""
+    require_supabase()
+    if not dados.enviados and not dados.falhas and not dados.devolvidas:
+        return {"ok": True}
+    try:
+        await banco.confirmar_mensagens(dados.enviados, dados.falhas, MAX_TENTATIVAS_ENVIO, dados.devolvidas)
+        if dados.falhas or dados.devolvidas:
+            barramento.publicar("fila", {"reprocessar": len(dados.falhas) + len(dados.devolvidas)})
+        return {"ok": True}
+    except Exception as e:
+        print(f"ERRO AO CONFIRMAR LOTE: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/sync/fila_stream")
+async def fila_stream(cursor: int = 0, epoca: Optional[str] = None, timeout: float = 25,
+                      limite: int = LOTE_FILA, lease: int = LEASE_FILA_SEG, instancia: Optional[str] = None):
+    """
+    Long-poll da fila de saída. Reivindica (lease) as pendentes assim que houver
+    alguma; sem novidade desde o cursor, espera o próximo insert pendente (ou o
+    timeout) sem tocar no banco. cursor=0 força uma leitura completa.
+    Com `instancia`, só acorda com avisos dela (ou sem dona) e só leva as dela.
+    """
+    require_supabase()
+    registro_instancias.visto(instancia)
+    leitura = barramento.ler(cursor, epoca=epoca, tipos=["fila"], setor=instancia)
+    cursor_atual = leitura["cursor"]
+
+    if cursor == 0 or leitura["reset"] or leitura["eventos"]:
+        msgs = await reivindicar_fila(limite, lease, instancia)
+        if msgs:
+            return {"epoca": barramento.epoca, "cursor": cursor_atual, "mensagens": msgs}
+
+    res = await barramento.aguardar(cursor_atual, min(max(timeout, 0), 55), tipos=["fila"], setor=instancia)
+    msgs = []
+    if res["eventos"] or res["reset"]:
+        msgs = await reivindicar_fila(limite, lease, instancia)
+    return {"epoca": barramento.epoca, "cursor": res["cursor"], "mensagens": msgs}
+
 @app.post("/sync/confirmar/{id_msg}")
-def confirmar_envio_local(id_msg: int):
+async def confirmar_envio_local(id_msg: int):
     require_supabase()
     try:
-        supabase.table("mensagens").update({"status_envio": "enviado"}).eq("id", id_msg).execute()
+        await banco.marcar_enviada(id_msg)
         return {"ok": True}
     except Exception as e:
         return {"ok": False, "error": str(e)}
 
 @app.get("/sync/status_conversa/{telefone}")
-def verificar_status(telefone: str):
+async def verificar_status(telefone: str):
     require_supabase()
     try:
-        res = supabase.table("conversas").select("status, setor_responsavel").eq("telefone", telefone).execute()
-        if res.data:
-            return res.data[0]
+        conversa = await banco.status_conversa(telefone)
+        if conversa:
+            return conversa
         return {"status": "robo", "setor_responsavel": "geral"}
     except:
         return {"status": "robo", "setor_responsavel": "geral"}
 
+@app.get("/sync/status_mudancas")
+async def status_mudancas(cursor: int = 0, epoca: Optional[str] = None, timeout: float = 25):
+    """
+    Long-poll das mudanças de status (transferir, assumir, encerrar...).
+    O bot local mantém um cache de /sync/status_conversa e usa isto para
+    invalidá-lo. reset=True: cursor inválido, descarte o cache inteiro.
+    """
+    res = await barramento.aguardar(cursor, min(max(timeout, 0), 55), epoca=epoca, tipos=["status"])
+    return {
+        "epoca": res["epoca"],
+        "cursor": res["cursor"],
+        "reset": res["reset"],
+        "mudancas": [ev["dados"] for ev in res["eventos"]],
+    }
+
 # ----------------------------
 # 4) ROTAS DO FLET
 # ----------------------------
+TIPOS_EVENTOS_PAINEL = ("status", "mensagem")
+HEARTBEAT_EVENTOS_SEG = 15
+
+@app.get("/admin/eventos")
+async def eventos_painel(request: Request, setor: Optional[str] = None, cursor: Optional[int] = None,
+                         epoca: Optional[str] = None, tipos: Optional[str] = None):
+    """
+    Server-Sent Events para o painel: 'status' (transferir, assumir, encerrar,
+    nova conversa) e 'mensagem' (resumo; o conteúdo vem de /admin/chat?since_id).
+
+    Cada evento tem id "<epoca>:<seq>". Ao reconectar, o EventSource manda
+    Last-Event-ID e recebe o que perdeu. Se a janela em memória não cobre mais
+    esse ponto (ou a bridge reiniciou) sai um evento 'reset': recarregue as listas.
+    """
+    ultimo = request.headers.get("last-event-id")
+    if ultimo and ":" in ultimo:
+        epoca, _, seq = ultimo.partition(":")
+        cursor = int(seq) if seq.isdigit() else None
+    if cursor is None:
+        cursor, epoca = barramento.seq, barramento.epoca
+    filtro_setor = setor if setor and setor != "GERAL" else None
+    filtro_tipos = [t for t in (tipos or "").split(",") if t in TIPOS_EVENTOS_PAINEL] or list(TIPOS_EVENTOS_PAINEL)
+
+    async def gerar():
+        nonlocal cursor, epoca
+        yield "retry: 3000\n\n"
+        while not await request.is_disconnected():
+            res = await barramento.aguardar(cursor, HEARTBEAT_EVENTOS_SEG, epoca=epoca,
+                                            tipos=filtro_tipos, setor=filtro_setor)
+            epoca = res["epoca"]
+            if res["reset"]:
+                yield f"id: {epoca}:{res['cursor']}\nevent: reset\ndata: {{}}\n\n"
+            for ev in res["eventos"]:
+                yield f"id: {epoca}:{ev['seq']}\nevent: {ev['tipo']}\ndata: {dumps(ev['dados']).decode()}\n\n"
+            if not res["reset"] and not res["eventos"]:
+                yield ": ping\n\n"
+            cursor = res["cursor"]
+
+    return StreamingResponse(gerar(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+CAMPOS_CONVERSA = {"telefone", "nome_usuario", "status", "ultima_mensagem_texto", "ultima_interacao",
+                   "atendente_atual", "setor_responsavel"}
+LIMITE_CONVERSAS = 200
+LIMITE_CONVERSAS_MAX = 1000
+
+def _codificar_cursor(valores: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(valores).encode()).decode().rstrip("=")
+
+def _decodificar_cursor(cursor: str) -> list:
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        valores = None
+    if not cursor_conversas_valido(valores):
+        raise HTTPException(status_code=400, detail="Cursor inválido.")
+    return valores
+
 @app.get("/admin/conversas")
-def listar_conversas(setor: Optional[str] = None):
+async def listar_conversas(request: Request, setor: Optional[str] = None, status: Optional[str] = None,
+                           desde: Optional[str] = None, ate: Optional[str] = None, since: Optional[str] = None,
+                           campos: Optional[str] = None, limite: Optional[int] = None, cursor: Optional[str] = None):
+    """
+    Conversas por ultima_interacao (mais recentes primeiro). Sem limite nem cursor
+    vem a lista inteira, como sempre veio. Com limite (ou cursor) a lista é paginada
+    em (ultima_interacao, telefone): a resposta continua sendo uma lista e a próxima
+    página vem no header X-Proximo-Cursor (ausente na última página).
+
+    - status: um ou vários separados por vírgula (ex.: fila,atendimento)
+    - desde/ate: intervalo de ultima_interacao; since: só o que teve interação depois
+      dessa data (polling incremental; mudança de status sem mensagem nova não aparece)
+    - campos: projeção (telefone e ultima_interacao sempre vêm, o cursor precisa deles)
+    - If-None-Match com o ETag anterior devolve 304 se a página não mudou
+    """
     require_supabase()
+    if campos:
+        pedidos = {c.strip() for c in campos.split(",") if c.strip()}
+        invalidos = pedidos - CAMPOS_CONVERSA
+        if invalidos:
+            raise HTTPException(status_code=400, detail=f"Campos inválidos: {', '.join(sorted(invalidos))}")
+        selecao = sorted(pedidos | {"telefone", "ultima_interacao"})
+    else:
+        selecao = sorted(CAMPOS_CONVERSA)
+    if limite is not None or cursor:
+        limite = max(1, min(limite or LIMITE_CONVERSAS, LIMITE_CONVERSAS_MAX))
+    posicao = _decodificar_cursor(cursor) if cursor else None
+
     try:
-        query = supabase.table("conversas").select("*").order("ultima_interacao", desc=True)
-        if setor and setor != "GERAL":
-            query = query.eq("setor_responsavel", setor)
-        return query.execute().data
+        dados = await banco.listar_conversas(
+            selecao, limite,
+            setor=setor if setor and setor != "GERAL" else None,
+            status=[s.strip() for s in status.split(",") if s.strip()] if status else None,
+            desde=desde, ate=ate, since=since, cursor=posicao,
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    for c in dados:
+        lembrar_setor(c["telefone"], c.get("setor_responsavel"))
+
+    headers = {}
+    if limite is not None and len(dados) == limite:
+        headers["X-Proximo-Cursor"] = _codificar_cursor([dados[-1].get("ultima_interacao"), dados[-1]["telefone"]])
+    return resposta_condicional(request, dados, headers)
+
+# Histórico sem colunas binárias: a mídia vem por arquivo_url, sob demanda
+CAMPOS_HISTORICO = ("id, telefone, remetente, texto, status_envio, created_at, "
+                    "arquivo_nome, arquivo_tipo, arquivo_ref, arquivo_tamanho, arquivo_mime")
+LIMITE_HISTORICO = 50
+LIMITE_HISTORICO_MAX = 200
+
+def _com_url_midia(msg: dict) -> dict:
+    if msg.get("arquivo_ref"):
+        msg["arquivo_url"] = f"/blobs/{msg['arquivo_ref']}"
+    elif msg.get("arquivo_tipo") or msg.get("arquivo_nome"):
+        # Linha antiga com base64 na tabela
+        msg["arquivo_url"] = f"/admin/midia/{msg['id']}"
+    else:
+        msg["arquivo_url"] = None
+    return msg
+
+async def _completar_com_arquivo(telefone: str, dados: list, before_id: Optional[int], limite: int) -> list:
+    resumo = await banco.resumo_arquivo(telefone)
+    if not resumo or not resumo.get("mensagens_arquivadas"):
+        return dados
+    antes = dados[0]["id"] if dados else before_id
+    antigas = await asyncio.to_thread(arquivo.historico, telefone, antes, limite - len(dados))
+    campos = [c.strip() for c in CAMPOS_HISTORICO.split(",")]
+    return [{**{c: m.get(c) for c in campos}, "arquivada": True} for m in antigas] + dados
+
 @app.get("/admin/chat/{telefone}")
-def pegar_historico(telefone: str):
+async def pegar_historico(request: Request, telefone: str, since_id: Optional[int] = None,
+                          before_id: Optional[int] = None, limite: int = LIMITE_HISTORICO):
+    """
+    Mensagens da conversa em ordem de id (crescente), sem base64.
+
+    - sem cursor: as últimas `limite`
+    - since_id: as que chegaram depois dessa (polling incremental)
+    - before_id: as `limite` anteriores a essa (rolar para cima)
+
+    Quando a tabela quente acaba antes de completar a página, o resto vem do
+    arquivo frio (arquivo.py), com "arquivada": true.
+    """
     require_supabase()
+    limite = max(1, min(limite, LIMITE_HISTORICO_MAX))
     try:
-        res = supabase.table("mensagens")\
-            .select("*")\
-            .eq("telefone", telefone)\
-            .order("created_at", desc=True)\
-            .limit(50)\
-            .execute()
-        
-        if not res.data:
-            return []
-
-        return res.data[::-1]
+        dados = await banco.historico(telefone, CAMPOS_HISTORICO, limite, since_id=since_id, before_id=before_id)
+        if since_id is None and len(dados) < limite:
+            dados = await _completar_com_arquivo(telefone, dados, before_id, limite)
     except Exception as e:
         print(f"Erro ao pegar histórico: {e}")
         return []
 
+    return resposta_condicional(request, [_com_url_midia(m) for m in dados])
+
+@app.get("/admin/midia/{id_msg}")
+async def baixar_midia_mensagem(id_msg: int):
+    """Anexo de uma mensagem, lido só quando o atendente abre (blob ou base64 legado)."""
+    require_supabase()
+    msg = await banco.midia_mensagem(id_msg)
+    if not msg:
+        raise HTTPException(status_code=404, detail="Mensagem não encontrada")
+
+    if msg.get("arquivo_ref"):
+        return await run_in_threadpool(baixar_blob, msg["arquivo_ref"])
+    b64 = msg.get("arquivo_base64")
+    if not b64:
+        raise HTTPException(status_code=404, detail="Mensagem sem anexo")
+
+    mime = msg.get("arquivo_mime") or mimetypes.guess_type(msg.get("arquivo_nome") or "")[0]
+    if b64.startswith("data:") and "," in b64:
+        cabecalho, b64 = b64.split(",", 1)
+        mime = cabecalho[5:].split(";")[0] or mime
+    return Response(content=base64.b64decode(b64), media_type=mime or "application/octet-stream",
+                    headers={"Cache-Control": "private, max-age=86400"})
+
 @app.post("/admin/enviar")
-def flet_enviar_mensagem(dados: MsgSync):
+async def flet_enviar_mensagem(dados: MsgSync):
     require_supabase()
     try:
         texto_final = dados.texto
         if dados.remetente == "atendente":
             texto_final = f"*{dados.nome.strip()}:* {dados.texto}"
 
-        store_message({
-            "telefone": dados.telefone,
-            "remetente": "atendente",
-            "texto": texto_final,
-            "status_envio": "pendente",
-            "created_at": now_iso()
-        })
+        id_msg = await banco.enviar_mensagem_atendente(dados.telefone, texto_final, f"Você: {dados.texto}")
+        publicar_mensagem({"id": id_msg, "telefone": dados.telefone, "remetente": "atendente",
+                           "texto": texto_final, "status_envio": "pendente", "created_at": now_iso()})
+        avisar_fila(dados.telefone)
 
-        supabase.table("conversas").update({
-            "ultima_mensagem_texto": f"Você: {dados.texto}",
-            "ultima_interacao": now_iso()
-        }).eq("telefone", dados.telefone).execute()
-        
         return {"ok": True}
     except Exception as e:
         print(f"ERRO AO ENVIAR TEXTO: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/admin/enviar_broadcast_lista")
-def enviar_para_lista(dados: EnvioLista):
+def _texto_broadcast(atendente: str, mensagem: str, tipo_midia: Optional[str], nome_arquivo: Optional[str]) -> str:
+    texto_base = f"📢 *Comunicado ({atendente}):*\n\n{mensagem}"
+    if tipo_midia == 'imagem':
+        return f"[imagem:{nome_arquivo or 'imagem.jpg'}] {texto_base}"
+    if tipo_midia == 'audio':
+        return "[audio]"
+    if tipo_midia == 'documento':
+        return f"[arquivo:{nome_arquivo or 'doc.bin'}] {texto_base}"
+    return texto_base
+
+@app.post("/admin/broadcasts")
+async def criar_broadcast(dados: NovoBroadcast):
+    """
+    Cria um job de transmissão: expande listas + contatos no servidor, grava a
+    mídia uma vez só (todas as linhas apontam para o mesmo blob) e insere uma
+    mensagem 'agendado' por destino. O liberador solta as mensagens para a
+    fila no ritmo taxa_por_minuto.
+    """
     require_supabase()
-    try:
+    destinos = normalizar_destinos(dados.listas, dados.telefones)
+    if not destinos:
+        raise HTTPException(status_code=400, detail="Nenhum destinatário (listas ou telefones).")
+    taxa = max(1, min(dados.taxa_por_minuto or BROADCAST_TAXA_POR_MINUTO, BROADCAST_TAXA_MAX))
 
-        garantir_conversa_existente(dados.lista_id) 
-
-        clean_b64 = None
-        if dados.base64:
-            clean_b64 = dados.base64
-            if "," in clean_b64 and clean_b64.startswith("data:"):
-                clean_b64 = clean_b64.split(",", 1)[1]
-
-        texto_base = f"📢 *Comunicado ({dados.atendente_nome}):*\n\n{dados.mensagem}"
-        texto_final = texto_base
-
-        if dados.tipo_midia == 'imagem':
-            texto_final = f"[imagem:{dados.nome_arquivo or 'imagem.jpg'}] {texto_base}"
-        elif dados.tipo_midia == 'audio':
-            texto_final = "[audio]" 
-        elif dados.tipo_midia == 'documento':
-            texto_final = f"[arquivo:{dados.nome_arquivo or 'doc.bin'}] {texto_base}"
-
-        store_message({
-            "telefone": dados.lista_id,
-            "remetente": "atendente",
-            "texto": texto_final,
-            "status_envio": "pendente",
-            "created_at": now_iso(),
-            "arquivo_base64": clean_b64,
+    try:
+        midia = await guardar_midia_base64(dados.base64, mimetypes.guess_type(dados.nome_arquivo or "")[0])
+        id_job = await banco.criar_broadcast({
+            "atendente": dados.atendente_nome,
+            "texto": _texto_broadcast(dados.atendente_nome, dados.mensagem, dados.tipo_midia, dados.nome_arquivo),
             "arquivo_nome": dados.nome_arquivo,
-            "arquivo_tipo": dados.tipo_midia
-        })
-        
-        return {"ok": True}
+            "arquivo_tipo": dados.tipo_midia,
+            "taxa_por_minuto": taxa,
+            **midia
+        }, destinos)
     except Exception as e:
         print(f"❌ ERRO BROADCAST: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+    print(f"📢 Transmissão #{id_job}: {len(destinos)} destinos a {taxa}/min")
+    return {"ok": True, "id": id_job, "total": len(destinos), "taxa_por_minuto": taxa}
+
+@app.get("/admin/broadcasts")
+async def listar_broadcasts(status: Optional[str] = None, limite: int = 50):
+    require_supabase()
+    filtro = [s.strip() for s in status.split(",") if s.strip()] if status else None
+    return await banco.listar_broadcasts(status=filtro, limite=max(1, min(limite, 200)))
+
+async def _job_ou_404(id_job: int) -> dict:
+    job = await banco.broadcast(id_job)
+    if not job:
+        raise HTTPException(status_code=404, detail="Transmissão não encontrada")
+    return job
+
+@app.get("/admin/broadcasts/{id_job}")
+async def ver_broadcast(id_job: int):
+    """Job + progresso de entrega (agendados, na fila, enviados, falhas, cancelados)."""
+    require_supabase()
+    job = await _job_ou_404(id_job)
+    estatisticas = await banco.estatisticas_broadcast(id_job)
+    return {**job, "progresso": progresso(job, estatisticas), "estatisticas": estatisticas}
+
+@app.post("/admin/broadcasts/{id_job}/pausar")
+async def pausar_broadcast(id_job: int):
+    require_supabase()
+    job = await _job_ou_404(id_job)
+    if job["status"] != "ativo":
+        raise HTTPException(status_code=409, detail=f"Transmissão está '{job['status']}'")
+    await banco.atualizar_broadcast(id_job, {"status": "pausado"})
+    return {"ok": True}
+
+@app.post("/admin/broadcasts/{id_job}/retomar")
+async def retomar_broadcast(id_job: int, taxa_por_minuto: Optional[int] = None):
+    require_supabase()
+    job = await _job_ou_404(id_job)
+    if job["status"] not in ("pausado", "ativo"):
+        raise HTTPException(status_code=409, detail=f"Transmissão está '{job['status']}'")
+    campos = {"status": "ativo"}
+    if taxa_por_minuto:
+        campos["taxa_por_minuto"] = max(1, min(taxa_por_minuto, BROADCAST_TAXA_MAX))
+    await banco.atualizar_broadcast(id_job, campos)
+    return {"ok": True}
+
+@app.post("/admin/broadcasts/{id_job}/cancelar")
+async def cancelar_broadcast(id_job: int):
+    """O que ainda não foi liberado não sai mais; o que já está na fila segue."""
+    require_supabase()
+    job = await _job_ou_404(id_job)
+    if job["status"] in ("cancelado", "concluido"):
+        raise HTTPException(status_code=409, detail=f"Transmissão está '{job['status']}'")
+    canceladas = await banco.cancelar_broadcast(id_job)
+    return {"ok": True, "canceladas": canceladas}
+
+@app.post("/admin/enviar_broadcast_lista")
+async def enviar_para_lista(dados: EnvioLista):
+    """Compatibilidade com o painel: uma lista só, vira um job de transmissão."""
+    return await criar_broadcast(NovoBroadcast(
+        mensagem=dados.mensagem,
+        atendente_nome=dados.atendente_nome,
+        listas=[dados.lista_id],
+        base64=dados.base64,
+        nome_arquivo=dados.nome_arquivo,
+        tipo_midia=dados.tipo_midia,
+    ))
+
 @app.post("/admin/assumir")
-def assumir_conversa(telefone: str, atendente: str):
+async def assumir_conversa(telefone: str, atendente: str):
     require_supabase()
     try:
-        supabase.table("conversas").update({
+        await banco.atualizar_conversa(telefone, {
             "status": "atendimento",
-            "atendente_atual": atendente
-        }).eq("telefone", telefone).execute()
+            "atendente_atual": atendente,
+            "assumido_em": now_iso()
+        })
+        painel_filas.assumida(telefone, atendente)
+        publicar_status(telefone, "atendimento")
         return {"ok": True}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/admin/encerrar")
-def encerrar_conversa(telefone: str):
+async def encerrar_conversa(telefone: str):
     require_supabase()
     try:
-        supabase.table("conversas").update({
-            "status": "robo",
-            "atendente_atual": None,
-            "setor_responsavel": "geral"
-        }).eq("telefone", telefone).execute()
-
-        store_message({
-            "telefone": telefone,
-            "remetente": "sistema",
-            "texto": "Atendimento encerrado. NUBIA retornou.",
-            "status_envio": "pendente",
-            "created_at": now_iso()
-        })
+        id_msg = await banco.encerrar_atendimento(telefone)
+        painel_filas.encerrada(telefone)
+        publicar_status(telefone, "robo", "geral")
+        publicar_mensagem({"id": id_msg, "telefone": telefone, "remetente": "sistema",
+                           "texto": "Atendimento encerrado. NUBIA retornou.", "status_envio": "pendente",
+                           "created_at": now_iso()})
+        avisar_fila(telefone)
         return {"ok": True}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/admin/criar_conversa")
-def criar_conversa_manual(dados: NovaConversa):
+async def criar_conversa_manual(dados: NovaConversa):
     require_supabase()
     try:
         tel = "".join(filter(str.isdigit, dados.telefone))
         tel_formatado = f"{tel}@c.us" if "@" not in dados.telefone else dados.telefone
 
-        upsert_conversa({
+        await upsert_conversa({
             "telefone": tel_formatado,
             "nome_usuario": dados.nome,
             "status": "humano",
             "ultima_mensagem_texto": "Novo atendimento iniciado pelo Flet",
             "ultima_interacao": now_iso()
         })
+        publicar_status(tel_formatado, "humano")
         return {"ok": True}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/admin/listas_disponiveis")
-def get_listas():
+async def get_listas():
     require_supabase()
-    return supabase.table("listas_transmissao").select("*").execute().data
+    return await banco.listar_listas()
+
+@app.get("/admin/instancias")
+async def listar_instancias():
+    """Instâncias locais vivas (as que reivindicaram a fila nos últimos INSTANCIA_TTL_SEG)."""
+    return registro_instancias.listar()
 
 @app.get("/health")
-def health():
-    return {"status": "ok"}
\ No newline at end of file
+async def health():
+    return {"status": "ok", "broadcasts": liberador.metricas()}
\ No newline at end of file
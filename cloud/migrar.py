@@ -0,0 +1,74 @@
+"""
+Aplica as migrações de cloud/migrations/ que ainda não rodaram no banco.
+
+    pip install "psycopg[binary]"
+    python migrar.py --dsn postgresql://postgres:<senha>@db.<projeto>.supabase.co:5432/postgres
+    python migrar.py --listar
+
+Cada arquivo roda em uma transação e fica registrado em schema_migrations;
+rodar de novo só aplica o que faltar. Também dá para colar os arquivos, em
+ordem, no SQL Editor do Supabase (todos são idempotentes).
+"""
+import argparse
+import os
+import sys
+
+import psycopg
+
+PASTA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+def arquivos_migracao():
+    return sorted(f for f in os.listdir(PASTA) if f.endswith(".sql"))
+
+
+def aplicadas(conn) -> set:
+    conn.execute("""
+        create table if not exists schema_migrations (
+            versao text primary key,
+            aplicada_em timestamptz not null default now()
+        )
+    """)
+    return {r[0] for r in conn.execute("select versao from schema_migrations")}
+
+
+def migrar(dsn: str, listar: bool = False, schema: str = None) -> list:
+    novas = []
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        if schema:
+            conn.execute(f"set search_path to {schema}")
+        feitas = aplicadas(conn)
+        for arquivo in arquivos_migracao():
+            versao = arquivo.split("_", 1)[0]
+            if versao in feitas:
+                if listar:
+                    print(f"  ✅ {arquivo}")
+                continue
+            if listar:
+                print(f"  ⏳ {arquivo}")
+                continue
+            with open(os.path.join(PASTA, arquivo)) as f:
+                sql = f.read()
+            print(f"▶️ Aplicando {arquivo}...")
+            with conn.transaction():
+                conn.execute(sql)
+                conn.execute("insert into schema_migrations (versao) values (%s)", (versao,))
+            novas.append(arquivo)
+    return novas
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--dsn", default=os.environ.get("DATABASE_URL"))
+    ap.add_argument("--listar", action="store_true", help="só mostra o que está aplicado/pendente")
+    args = ap.parse_args()
+    if not args.dsn:
+        sys.exit("Informe --dsn ou DATABASE_URL.")
+
+    novas = migrar(args.dsn, listar=args.listar)
+    if not args.listar:
+        print(f"✅ {len(novas)} migração(ões) aplicada(s).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+-- Tabelas que a bridge usa, como já existiam no Supabase antes das migrações
+-- versionadas. Em um banco existente não muda nada (if not exists); em um
+-- banco novo, as migrações seguintes acrescentam as colunas e funções.
+
+create table if not exists conversas (
+    telefone text primary key,
+    nome_usuario text,
+    status text not null default 'robo',
+    ultima_mensagem_texto text,
+    ultima_interacao timestamptz default now(),
+    atendente_atual text,
+    setor_responsavel text
+);
+
+create table if not exists mensagens (
+    id bigint generated by default as identity primary key,
+    telefone text not null,
+    remetente text,
+    texto text,
+    status_envio text,
+    created_at timestamptz not null default now(),
+    arquivo_base64 text,
+    arquivo_nome text,
+    arquivo_tipo text
+);
+
+create table if not exists listas_transmissao (
+    id text primary key,
+    nome text,
+    qtd integer,
+    updated_at timestamptz default now()
+);
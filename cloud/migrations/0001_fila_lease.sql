@@ -0,0 +1,53 @@
+-- Fila de saída com lease: o Carteiro "reivindica" mensagens pendentes em vez
+-- de só lê-las, então uma entrega lenta não faz a próxima leitura devolver as
+-- mesmas linhas. Lease vencida = mensagem volta a ser elegível.
+
+alter table mensagens add column if not exists lease_ate timestamptz;
+alter table mensagens add column if not exists tentativas integer not null default 0;
+
+-- Move até p_limite mensagens para 'em_envio' e devolve só as colunas de entrega.
+create or replace function reivindicar_mensagens(p_limite integer default 50, p_lease_segundos integer default 60)
+returns table (
+    id bigint,
+    telefone text,
+    texto text,
+    arquivo_base64 text,
+    arquivo_nome text,
+    arquivo_tipo text,
+    created_at timestamptz,
+    tentativas integer
+)
+language sql
+as $$
+    update mensagens m
+       set status_envio = 'em_envio',
+           lease_ate = now() + make_interval(secs => p_lease_segundos),
+           tentativas = m.tentativas + 1
+     where m.id in (
+            select c.id
+              from mensagens c
+             where c.status_envio = 'pendente'
+                or (c.status_envio = 'em_envio' and c.lease_ate < now())
+             order by c.id
+             limit p_limite
+               for update skip locked
+           )
+    returning m.id::bigint, m.telefone::text, m.texto::text, m.arquivo_base64::text,
+              m.arquivo_nome::text, m.arquivo_tipo::text, m.created_at::timestamptz, m.tentativas;
+$$;
+
+-- Confirmação em lote. Falhas voltam para 'pendente' até p_max_tentativas.
+create or replace function confirmar_mensagens(p_enviados bigint[], p_falhas bigint[], p_max_tentativas integer default 5)
+returns void
+language sql
+as $$
+    update mensagens
+       set status_envio = 'enviado', lease_ate = null
+     where id = any(p_enviados);
+
+    update mensagens
+       set status_envio = case when tentativas >= p_max_tentativas then 'falhou' else 'pendente' end,
+           lease_ate = null
+     where id = any(p_falhas)
+       and status_envio = 'em_envio';
+$$;
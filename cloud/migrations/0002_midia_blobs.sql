@@ -0,0 +1,47 @@
+-- Mídia fora da tabela: a mensagem guarda só a referência ao blob
+-- (sha256 do conteúdo), o tamanho e o mimetype. arquivo_base64 fica para
+-- as linhas antigas e é lido só quando arquivo_ref é nulo.
+
+alter table mensagens add column if not exists arquivo_ref text;
+alter table mensagens add column if not exists arquivo_tamanho bigint;
+alter table mensagens add column if not exists arquivo_mime text;
+
+-- O tipo de retorno mudou: precisa recriar.
+drop function if exists reivindicar_mensagens(integer, integer);
+
+create function reivindicar_mensagens(p_limite integer default 50, p_lease_segundos integer default 60)
+returns table (
+    id bigint,
+    telefone text,
+    texto text,
+    arquivo_base64 text,
+    arquivo_nome text,
+    arquivo_tipo text,
+    arquivo_ref text,
+    arquivo_tamanho bigint,
+    arquivo_mime text,
+    created_at timestamptz,
+    tentativas integer
+)
+language sql
+as $$
+    update mensagens m
+       set status_envio = 'em_envio',
+           lease_ate = now() + make_interval(secs => p_lease_segundos),
+           tentativas = m.tentativas + 1
+     where m.id in (
+            select c.id
+              from mensagens c
+             where c.status_envio = 'pendente'
+                or (c.status_envio = 'em_envio' and c.lease_ate < now())
+             order by c.id
+             limit p_limite
+               for update skip locked
+           )
+    returning m.id::bigint, m.telefone::text, m.texto::text,
+              -- base64 só para linhas antigas, sem referência
+              case when m.arquivo_ref is null then m.arquivo_base64::text end,
+              m.arquivo_nome::text, m.arquivo_tipo::text,
+              m.arquivo_ref, m.arquivo_tamanho, m.arquivo_mime,
+              m.created_at::timestamptz, m.tentativas;
+$$;
@@ -0,0 +1,54 @@
+-- Escritas de várias etapas viram uma ida ao banco cada.
+-- Antes: SELECT + UPDATE/INSERT em garantir_conversa_existente (com corrida
+-- entre dois envios simultâneos), INSERT + UPDATE em /admin/enviar e
+-- UPDATE + INSERT em /admin/encerrar.
+
+-- Cria a conversa se não existir; se existir, só toca ultima_interacao.
+-- Retorna true quando a linha foi criada agora.
+create or replace function garantir_conversa(p_telefone text, p_nome text default 'Cliente (via Anexo)')
+returns boolean
+language sql
+as $$
+    insert into conversas as c (telefone, nome_usuario, status, ultima_interacao)
+    values (p_telefone, p_nome, 'atendimento', now())
+    on conflict (telefone) do update
+       set ultima_interacao = excluded.ultima_interacao
+    returning (xmax = 0);
+$$;
+
+-- Mensagem do atendente para a fila de saída + resumo na lista de conversas.
+create or replace function enviar_mensagem_atendente(p_telefone text, p_texto text, p_resumo text)
+returns bigint
+language sql
+as $$
+    with nova as (
+        insert into mensagens (telefone, remetente, texto, status_envio, created_at)
+        values (p_telefone, 'atendente', p_texto, 'pendente', now())
+        returning id
+    ), conversa as (
+        update conversas
+           set ultima_mensagem_texto = p_resumo,
+               ultima_interacao = now()
+         where telefone = p_telefone
+    )
+    select id::bigint from nova;
+$$;
+
+-- Devolve a conversa ao robô e enfileira o aviso para o cliente.
+create or replace function encerrar_atendimento(p_telefone text, p_texto text default 'Atendimento encerrado. NUBIA retornou.')
+returns bigint
+language sql
+as $$
+    with conversa as (
+        update conversas
+           set status = 'robo',
+               atendente_atual = null,
+               setor_responsavel = 'geral'
+         where telefone = p_telefone
+    ), nova as (
+        insert into mensagens (telefone, remetente, texto, status_envio, created_at)
+        values (p_telefone, 'sistema', p_texto, 'pendente', now())
+        returning id
+    )
+    select id::bigint from nova;
+$$;
@@ -0,0 +1,10 @@
+-- Marcos de tempo do atendimento humano, para a bridge estimar a espera por
+-- setor (cloud/filas.py) e reconstruir as filas em memória após um restart.
+
+alter table conversas add column if not exists entrou_fila_em timestamptz;
+alter table conversas add column if not exists assumido_em timestamptz;
+
+-- A ressincronização só lê quem está em fila ou em atendimento
+create index if not exists conversas_fila_atendimento_idx
+    on conversas (setor_responsavel)
+    where status in ('fila', 'atendimento');
@@ -0,0 +1,29 @@
+-- Índices das consultas quentes da bridge (ver bench/explain_consultas.py).
+-- Em tabelas grandes em produção, prefira rodar cada um com
+-- "create index concurrently" fora de transação.
+
+-- Fila de saída (reivindicar_mensagens, /sync/fila_pendente): só as linhas
+-- ainda não entregues entram no índice, então ele fica do tamanho da fila,
+-- não do histórico.
+create index if not exists mensagens_fila_idx
+    on mensagens (id)
+    where status_envio in ('pendente', 'em_envio');
+
+-- Histórico do chat (/admin/chat): por telefone, em ordem de id (since_id/before_id)
+create index if not exists mensagens_telefone_id_idx
+    on mensagens (telefone, id);
+
+-- Lista de conversas (/admin/conversas): paginação por (ultima_interacao, telefone)
+create index if not exists conversas_ultima_interacao_idx
+    on conversas (ultima_interacao desc, telefone desc);
+
+-- ... e a mesma lista filtrada por setor
+create index if not exists conversas_setor_ultima_interacao_idx
+    on conversas (setor_responsavel, ultima_interacao desc, telefone desc);
+
+-- Filas por setor (/admin/fila_setor, ressincronização do painel de filas)
+create index if not exists conversas_status_setor_idx
+    on conversas (status, setor_responsavel);
+
+analyze conversas;
+analyze mensagens;
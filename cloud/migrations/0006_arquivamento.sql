@@ -0,0 +1,35 @@
+-- Arquivamento frio das mensagens (ver arquivo.py): as linhas antigas saem
+-- da tabela quente e a conversa guarda um resumo do que foi arquivado.
+
+alter table conversas add column if not exists mensagens_arquivadas integer not null default 0;
+alter table conversas add column if not exists arquivadas_ate_id bigint;
+alter table conversas add column if not exists arquivadas_ate timestamptz;
+
+-- Varredura do job de arquivamento por idade
+create index if not exists mensagens_created_at_idx
+    on mensagens (created_at);
+
+-- Apaga as mensagens já gravadas no arquivo e atualiza o resumo de cada
+-- conversa na mesma transação. Retorna quantas linhas saíram.
+create or replace function concluir_arquivamento(p_ids bigint[])
+returns integer
+language sql
+as $$
+    with apagadas as (
+        delete from mensagens
+         where id = any(p_ids)
+        returning telefone, id, created_at
+    ), resumo as (
+        select telefone, count(*) as qtd, max(id) as ate_id, max(created_at) as ate
+          from apagadas
+         group by telefone
+    ), conversa as (
+        update conversas c
+           set mensagens_arquivadas = c.mensagens_arquivadas + r.qtd,
+               arquivadas_ate_id = greatest(c.arquivadas_ate_id, r.ate_id),
+               arquivadas_ate = greatest(c.arquivadas_ate, r.ate)
+          from resumo r
+         where c.telefone = r.telefone
+    )
+    select count(*)::integer from apagadas;
+$$;
@@ -0,0 +1,119 @@
+-- Transmissões em massa (ver broadcasts.py): um job por comunicado, com os
+-- destinatários expandidos no servidor e uma linha 'agendado' por destino.
+-- O liberador da bridge passa as linhas para 'pendente' no ritmo do job, e
+-- daí o Carteiro entrega pelo caminho normal da fila de saída.
+
+create table if not exists broadcasts (
+    id bigserial primary key,
+    criado_em timestamptz not null default now(),
+    atendente text,
+    texto text,
+    arquivo_nome text,
+    arquivo_tipo text,
+    arquivo_ref text,
+    arquivo_tamanho bigint,
+    arquivo_mime text,
+    total integer not null default 0,
+    taxa_por_minuto integer not null default 20,
+    -- ativo | pausado | cancelado | concluido (tudo liberado para a fila)
+    status text not null default 'ativo',
+    concluido_em timestamptz
+);
+
+alter table mensagens add column if not exists broadcast_id bigint references broadcasts (id);
+
+create index if not exists mensagens_broadcast_idx
+    on mensagens (broadcast_id, status_envio)
+    where broadcast_id is not null;
+
+create index if not exists broadcasts_status_idx
+    on broadcasts (status);
+
+-- Cria o job, as conversas que faltarem e uma mensagem por destino, tudo de
+-- uma vez. A mídia é uma referência só (arquivo_ref), não uma cópia por linha.
+create or replace function criar_broadcast(p_job jsonb, p_destinos text[])
+returns bigint
+language plpgsql
+as $$
+declare
+    v_id bigint;
+begin
+    insert into broadcasts (atendente, texto, arquivo_nome, arquivo_tipo, arquivo_ref,
+                            arquivo_tamanho, arquivo_mime, total, taxa_por_minuto)
+    select j.atendente, j.texto, j.arquivo_nome, j.arquivo_tipo, j.arquivo_ref,
+           j.arquivo_tamanho, j.arquivo_mime, cardinality(p_destinos), coalesce(j.taxa_por_minuto, 20)
+      from jsonb_to_record(p_job) as j(atendente text, texto text, arquivo_nome text, arquivo_tipo text,
+                                       arquivo_ref text, arquivo_tamanho bigint, arquivo_mime text,
+                                       taxa_por_minuto integer)
+    returning id into v_id;
+
+    insert into conversas (telefone, nome_usuario, status, ultima_interacao)
+    select d.telefone, coalesce(l.nome, 'Contato (via Transmissão)'), 'robo', now()
+      from unnest(p_destinos) as d(telefone)
+      left join listas_transmissao l on l.id = d.telefone
+    on conflict (telefone) do nothing;
+
+    insert into mensagens (telefone, remetente, texto, status_envio, created_at, arquivo_nome,
+                           arquivo_tipo, arquivo_ref, arquivo_tamanho, arquivo_mime, broadcast_id)
+    select d.telefone, 'atendente', b.texto, 'agendado', now(), b.arquivo_nome,
+           b.arquivo_tipo, b.arquivo_ref, b.arquivo_tamanho, b.arquivo_mime, b.id
+      from unnest(p_destinos) with ordinality as d(telefone, ordem)
+      join broadcasts b on b.id = v_id
+     order by d.ordem;
+
+    return v_id;
+end;
+$$;
+
+-- Solta até p_quantidade mensagens do job para a fila de saída.
+create or replace function liberar_broadcast(p_id bigint, p_quantidade integer)
+returns integer
+language sql
+as $$
+    with liberadas as (
+        update mensagens
+           set status_envio = 'pendente'
+         where id in (
+                select id
+                  from mensagens
+                 where broadcast_id = p_id
+                   and status_envio = 'agendado'
+                 order by id
+                 limit p_quantidade
+                   for update skip locked
+               )
+        returning 1
+    )
+    select count(*)::integer from liberadas;
+$$;
+
+-- Cancela o job: o que ainda não foi liberado não sai mais.
+create or replace function cancelar_broadcast(p_id bigint)
+returns integer
+language sql
+as $$
+    with job as (
+        update broadcasts
+           set status = 'cancelado', concluido_em = now()
+         where id = p_id
+    ), canceladas as (
+        update mensagens
+           set status_envio = 'cancelado'
+         where broadcast_id = p_id
+           and status_envio = 'agendado'
+        returning 1
+    )
+    select count(*)::integer from canceladas;
+$$;
+
+-- Progresso: quantas mensagens do job em cada status de envio.
+create or replace function estatisticas_broadcast(p_id bigint)
+returns table (status_envio text, qtd integer)
+language sql
+stable
+as $$
+    select status_envio, count(*)::integer
+      from mensagens
+     where broadcast_id = p_id
+     group by status_envio;
+$$;
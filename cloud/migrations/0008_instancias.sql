@@ -0,0 +1,97 @@
+-- Várias instâncias locais (um número de WhatsApp cada) na mesma bridge:
+-- cada conversa e cada mensagem têm dona, e cada instância só reivindica a
+-- própria fila de saída (ver instancias.py).
+
+alter table conversas add column if not exists instancia text;
+alter table mensagens add column if not exists instancia text;
+
+-- Fila de saída por instância
+create index if not exists mensagens_fila_instancia_idx
+    on mensagens (instancia, id)
+    where status_envio in ('pendente', 'em_envio');
+
+-- Mensagem sem dona herda a dona da conversa (cobre as RPCs de envio e
+-- encerramento sem mudar a assinatura delas).
+create or replace function mensagem_herda_instancia()
+returns trigger
+language plpgsql
+as $$
+begin
+    if new.instancia is null then
+        select c.instancia into new.instancia from conversas c where c.telefone = new.telefone;
+    end if;
+    return new;
+end;
+$$;
+
+drop trigger if exists mensagens_instancia on mensagens;
+create trigger mensagens_instancia
+    before insert on mensagens
+    for each row execute function mensagem_herda_instancia();
+
+-- Reivindicação filtrada pela instância (null = fila global, como antes).
+drop function if exists reivindicar_mensagens(integer, integer);
+
+create function reivindicar_mensagens(p_limite integer default 50, p_lease_segundos integer default 60,
+                                      p_instancia text default null)
+returns table (
+    id bigint,
+    telefone text,
+    texto text,
+    arquivo_base64 text,
+    arquivo_nome text,
+    arquivo_tipo text,
+    arquivo_ref text,
+    arquivo_tamanho bigint,
+    arquivo_mime text,
+    created_at timestamptz,
+    tentativas integer
+)
+language sql
+as $$
+    update mensagens m
+       set status_envio = 'em_envio',
+           lease_ate = now() + make_interval(secs => p_lease_segundos),
+           tentativas = m.tentativas + 1
+     where m.id in (
+            select c.id
+              from mensagens c
+             where (c.status_envio = 'pendente'
+                    or (c.status_envio = 'em_envio' and c.lease_ate < now()))
+               and (p_instancia is null or c.instancia = p_instancia)
+             order by c.id
+             limit p_limite
+               for update skip locked
+           )
+    returning m.id::bigint, m.telefone::text, m.texto::text,
+              case when m.arquivo_ref is null then m.arquivo_base64::text end,
+              m.arquivo_nome::text, m.arquivo_tipo::text,
+              m.arquivo_ref, m.arquivo_tamanho, m.arquivo_mime,
+              m.created_at::timestamptz, m.tentativas;
+$$;
+
+-- Conversas (e a fila pendente delas) sem dona recebem a instância escolhida
+-- pelo anel da bridge. Só preenche o que está vazio.
+create or replace function atribuir_instancias(p_telefones text[], p_instancias text[])
+returns integer
+language sql
+as $$
+    with mapa as (
+        select * from unnest(p_telefones, p_instancias) as t(telefone, instancia)
+    ), conversas_atualizadas as (
+        update conversas c
+           set instancia = m.instancia
+          from mapa m
+         where c.telefone = m.telefone
+           and c.instancia is null
+    ), mensagens_atualizadas as (
+        update mensagens msg
+           set instancia = m.instancia
+          from mapa m
+         where msg.telefone = m.telefone
+           and msg.instancia is null
+           and msg.status_envio in ('pendente', 'em_envio', 'agendado')
+        returning 1
+    )
+    select count(*)::integer from mensagens_atualizadas;
+$$;
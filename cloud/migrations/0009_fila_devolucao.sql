@@ -0,0 +1,27 @@
+-- Devolução sem custo de tentativa: quando uma mensagem de um chat esgota as
+-- tentativas no carteiro, as seguintes do mesmo chat (que nem foram tentadas)
+-- voltam junto para a fila, para nada mais novo sair antes dela.
+drop function if exists confirmar_mensagens(bigint[], bigint[], integer);
+
+create function confirmar_mensagens(p_enviados bigint[], p_falhas bigint[], p_max_tentativas integer default 5,
+                                    p_devolvidas bigint[] default '{}')
+returns void
+language sql
+as $$
+    update mensagens
+       set status_envio = 'enviado', lease_ate = null
+     where id = any(p_enviados);
+
+    update mensagens
+       set status_envio = case when tentativas >= p_max_tentativas then 'falhou' else 'pendente' end,
+           lease_ate = null
+     where id = any(p_falhas)
+       and status_envio = 'em_envio';
+
+    update mensagens
+       set status_envio = 'pendente',
+           lease_ate = null,
+           tentativas = greatest(tentativas - 1, 0)
+     where id = any(p_devolvidas)
+       and status_envio = 'em_envio';
+$$;
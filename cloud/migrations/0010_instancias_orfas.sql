@@ -0,0 +1,62 @@
+-- Conversas de instâncias que sumiram (sem heartbeat) voltam ao anel: a
+-- fila delas não pode ficar presa numa dona que ninguém mais vai reivindicar.
+-- p_ativas = instâncias vivas; null = só as sem dona (como na 0008).
+
+create or replace function telefones_sem_dona(p_limite integer default 500, p_ativas text[] default null)
+returns setof text
+language sql
+stable
+as $$
+    select distinct m.telefone
+      from mensagens m
+     where m.status_envio in ('pendente', 'em_envio', 'agendado')
+       and (m.instancia is null or (p_ativas is not null and m.instancia <> all(p_ativas)))
+     limit p_limite;
+$$;
+
+drop function if exists atribuir_instancias(text[], text[]);
+
+create function atribuir_instancias(p_telefones text[], p_instancias text[], p_ativas text[] default null)
+returns integer
+language sql
+as $$
+    with mapa as (
+        select * from unnest(p_telefones, p_instancias) as t(telefone, instancia)
+    ), conversas_atualizadas as (
+        update conversas c
+           set instancia = m.instancia
+          from mapa m
+         where c.telefone = m.telefone
+           and (c.instancia is null or (p_ativas is not null and c.instancia <> all(p_ativas)))
+    ), mensagens_atualizadas as (
+        update mensagens msg
+           set instancia = m.instancia
+          from mapa m
+         where msg.telefone = m.telefone
+           and (msg.instancia is null or (p_ativas is not null and msg.instancia <> all(p_ativas)))
+           and msg.status_envio in ('pendente', 'em_envio', 'agendado')
+        returning 1
+    )
+    select count(*)::integer from mensagens_atualizadas;
+$$;
+
+-- A conversa mudou de número (o cliente falou por outra instância): a fila
+-- ainda não reivindicada vai junto. O que já está 'em_envio' fica com a
+-- instância antiga até confirmar ou vencer a lease.
+create or replace function mover_fila_instancia(p_telefones text[], p_instancias text[])
+returns integer
+language sql
+as $$
+    with mapa as (
+        select * from unnest(p_telefones, p_instancias) as t(telefone, instancia)
+    ), movidas as (
+        update mensagens msg
+           set instancia = m.instancia
+          from mapa m
+         where msg.telefone = m.telefone
+           and msg.status_envio in ('pendente', 'agendado')
+           and msg.instancia is distinct from m.instancia
+        returning 1
+    )
+    select count(*)::integer from movidas;
+$$;
@@ -0,0 +1,6 @@
+-- Sync do log idempotente: cada evento do bot local traz uma chave (origem
+-- do outbox + sequência). Um lote reenviado depois de uma resposta perdida
+-- não duplica mensagens. Chave nula (painel, bot antigo) nunca conflita.
+alter table mensagens add column if not exists chave_sync text;
+
+create unique index if not exists mensagens_chave_sync_idx on mensagens (chave_sync);
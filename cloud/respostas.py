@@ -0,0 +1,118 @@
+import gzip
+import json
+import os
+from typing import Any, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+
+# Opcionais: sem eles a bridge usa json da stdlib e só gzip
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# "orjson" (padrão quando instalado) ou "json"
+JSON_BACKEND = os.environ.get("JSON_BACKEND", "orjson" if orjson else "json")
+# Respostas menores que isso vão sem compressão (não compensa o custo)
+COMPRESSAO_MINIMO_BYTES = int(os.environ.get("COMPRESSAO_MINIMO_BYTES", "1024"))
+NIVEL_GZIP = 5
+NIVEL_BROTLI = 4
+
+
+def dumps(dados: Any, ordenar: bool = False) -> bytes:
+    """JSON compacto em UTF-8. ordenar=True dá a mesma saída para o mesmo conteúdo (ETag)."""
+    if JSON_BACKEND == "orjson" and orjson is not None:
+        opcoes = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if ordenar else 0)
+        return orjson.dumps(dados, default=str, option=opcoes)
+    return json.dumps(dados, sort_keys=ordenar, default=str, ensure_ascii=False,
+                      separators=(",", ":")).encode("utf-8")
+
+
+class RespostaJSON(JSONResponse):
+    """Resposta padrão da bridge: mesmo JSON do FastAPI, serializado por dumps()."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def escolher_codificacao(accept_encoding: str) -> Optional[str]:
+    """'br' se o cliente aceita e o brotli está instalado, senão 'gzip', senão None."""
+    aceitas = set()
+    for parte in accept_encoding.lower().split(","):
+        nome, _, params = parte.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        aceitas.add(nome.strip())
+    if brotli is not None and "br" in aceitas:
+        return "br"
+    if "gzip" in aceitas or "*" in aceitas:
+        return "gzip"
+    return None
+
+
+def comprimir(corpo: bytes, codificacao: str) -> bytes:
+    if codificacao == "br":
+        return brotli.compress(corpo, quality=NIVEL_BROTLI)
+    return gzip.compress(corpo, compresslevel=NIVEL_GZIP)
+
+
+class CompressaoMiddleware:
+    """
+    gzip/brotli conforme o Accept-Encoding, só para respostas inteiras (um
+    corpo só) acima de COMPRESSAO_MINIMO_BYTES.
+
+    Streams (SSE em /admin/eventos, blobs) passam direto: comprimir em pedaços
+    seguraria os eventos no buffer do compressor. O ETag vira fraco (W/) na
+    versão comprimida, e o If-None-Match do painel continua valendo.
+    """
+
+    def __init__(self, app, minimo: int = COMPRESSAO_MINIMO_BYTES):
+        self.app = app
+        self.minimo = minimo
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        codificacao = escolher_codificacao(Headers(scope=scope).get("accept-encoding", ""))
+        if codificacao is None:
+            return await self.app(scope, receive, send)
+
+        inicio = None
+
+        async def enviar(mensagem):
+            nonlocal inicio
+            if mensagem["type"] == "http.response.start":
+                headers = Headers(raw=mensagem["headers"])
+                if "content-encoding" in headers or headers.get("content-type", "").startswith("text/event-stream"):
+                    await send(mensagem)
+                else:
+                    inicio = mensagem
+                return
+            if inicio is None or mensagem["type"] != "http.response.body":
+                await send(mensagem)
+                return
+
+            cabecalho, inicio = inicio, None
+            corpo = mensagem.get("body", b"")
+            if mensagem.get("more_body") or len(corpo) < self.minimo:
+                await send(cabecalho)
+                await send(mensagem)
+                return
+
+            comprimido = comprimir(corpo, codificacao)
+            headers = MutableHeaders(raw=list(cabecalho["headers"]))
+            headers["Content-Encoding"] = codificacao
+            headers["Content-Length"] = str(len(comprimido))
+            headers.add_vary_header("Accept-Encoding")
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                headers["ETag"] = "W/" + etag
+            await send({**cabecalho, "headers": headers.raw})
+            await send({"type": "http.response.body", "body": comprimido, "more_body": False})
+
+        await self.app(scope, receive, enviar)
@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# Os módulos da bridge são importados soltos (como o main.py faz)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# A bridge lê o backend no import: SQLite num diretório descartável
+_tmp = tempfile.mkdtemp(prefix="nubia-teste-")
+os.environ["BANCO_BACKEND"] = "sqlite"
+os.environ["SQLITE_PATH"] = os.path.join(_tmp, "nubia.db")
+os.environ["BLOB_BACKEND"] = "local"
+os.environ["BLOB_DIR"] = os.path.join(_tmp, "blobs")
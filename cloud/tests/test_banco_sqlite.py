@@ -0,0 +1,51 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from banco_sqlite import BancoSQLite
+
+
+def _msg(i, **extra):
+    return {"telefone": f"55119000000{i:02d}@c.us", "remetente": "usuario", "texto": f"m{i}", **extra}
+
+
+def test_inserir_em_lote_devolve_ids_na_ordem_e_pula_reenvios(tmp_path):
+    banco = BancoSQLite(str(tmp_path / "b.db"))
+
+    async def fn():
+        await banco.conectar()
+        try:
+            primeira = await banco.inserir_mensagens([_msg(0, chave_sync="a"), _msg(1, chave_sync="b")])
+            # Lote misto: formatos diferentes, um reenvio ("a") e uma chave repetida no próprio lote
+            segunda = await banco.inserir_mensagens([
+                _msg(2), _msg(3, chave_sync="a"), _msg(4, chave_sync="c"),
+                _msg(5, status_envio="pendente"), _msg(6, chave_sync="c"), _msg(7)])
+            todas = await banco._em_thread(banco._ler, "select id, texto from mensagens order by id")
+            return primeira, segunda, todas
+        finally:
+            await banco.fechar()
+
+    primeira, segunda, todas = asyncio.run(fn())
+    assert [m["texto"] for m in primeira] == ["m0", "m1"]
+    assert [m["texto"] for m in segunda] == ["m2", "m4", "m5", "m7"]
+    ids = {l["texto"]: l["id"] for l in todas}
+    assert len(todas) == 6
+    assert all(m["id"] == ids[m["texto"]] for m in primeira + segunda)
+
+
+def test_fechar_fecha_as_conexoes_de_leitura(tmp_path):
+    banco = BancoSQLite(str(tmp_path / "b.db"))
+
+    async def fn():
+        await banco.conectar()
+        await asyncio.gather(*(banco.listar_broadcasts() for _ in range(8)))
+        conexoes = list(banco._conexoes_leitura)
+        await banco.fechar()
+        return conexoes
+
+    conexoes = asyncio.run(fn())
+    assert conexoes and banco._conexoes_leitura == []
+    for conn in conexoes:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("select 1")
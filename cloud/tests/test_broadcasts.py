@@ -0,0 +1,56 @@
+import asyncio
+
+from banco_sqlite import BancoSQLite
+from broadcasts import LiberadorBroadcasts
+
+
+class _PausaNoMeio(BancoSQLite):
+    """Simula o atendente pausando o job enquanto o liberador solta o último lote."""
+
+    async def liberar_broadcast(self, id_job: int, quantidade: int) -> int:
+        liberadas = await super().liberar_broadcast(id_job, quantidade)
+        await self.atualizar_broadcast(id_job, {"status": "pausado"})
+        return liberadas
+
+
+def _rodar(banco):
+    async def fn():
+        await banco.conectar()
+        try:
+            # Sem destinos: o primeiro passo já não acha nada agendado
+            id_job = await banco.criar_broadcast({"atendente": "teste", "texto": "oi"}, [])
+            liberador = LiberadorBroadcasts(banco, lambda *_: None)
+            await liberador.passo()
+            return await banco.broadcast(id_job), liberador
+        finally:
+            await banco.fechar()
+    return asyncio.run(fn())
+
+
+def test_job_sem_agendadas_vira_concluido(tmp_path):
+    job, liberador = _rodar(BancoSQLite(str(tmp_path / "b.db")))
+    assert job["status"] == "concluido" and job["concluido_em"]
+    assert liberador.concluidos == 1
+
+
+def test_pausa_no_meio_nao_e_atropelada_pelo_concluido(tmp_path):
+    job, liberador = _rodar(_PausaNoMeio(str(tmp_path / "b.db")))
+    assert job["status"] == "pausado" and job["concluido_em"] is None
+    assert liberador.concluidos == 0
+    assert liberador.metricas()["jobs_ativos"] == 0
+
+
+def test_concluir_so_vale_para_job_ativo(tmp_path):
+    banco = BancoSQLite(str(tmp_path / "b.db"))
+
+    async def fn():
+        await banco.conectar()
+        try:
+            id_job = await banco.criar_broadcast({"atendente": "teste", "texto": "oi"}, [])
+            await banco.cancelar_broadcast(id_job)
+            return await banco.concluir_broadcast(id_job), await banco.broadcast(id_job)
+        finally:
+            await banco.fechar()
+
+    concluiu, job = asyncio.run(fn())
+    assert not concluiu and job["status"] == "cancelado"
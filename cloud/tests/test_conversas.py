@@ -0,0 +1,55 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from banco import cursor_conversas_valido, filtro_cursor_conversas
+
+# Ids que a bridge guarda além do @c.us (criar_conversa_manual mantém qualquer "@")
+TELEFONES = ["5511900000001@c.us", "120363000000001@g.us", "24680000000001@lid",
+             "status@broadcast", "5511900000002@c.us", "9988776655@lid"]
+
+
+@pytest.fixture(scope="module")
+def cliente():
+    with TestClient(main.app) as c:
+        linhas = [{"telefone": tel, "status": "robo",
+                   "ultima_interacao": f"2024-05-01T12:00:0{i}+00:00" if i % 3 else "2024-05-01T12:00:00+00:00"}
+                  for i, tel in enumerate(TELEFONES)]
+        c.portal.call(main.banco.upsert_conversas, linhas)
+        yield c
+
+
+def test_pagina_passa_por_ids_que_nao_sao_c_us(cliente):
+    vistos, cursor = [], None
+    for _ in range(len(TELEFONES)):
+        params = {"limite": 1, **({"cursor": cursor} if cursor else {})}
+        res = cliente.get("/admin/conversas", params=params)
+        assert res.status_code == 200, res.text
+        vistos += [c["telefone"] for c in res.json()]
+        cursor = res.headers.get("X-Proximo-Cursor")
+        if not cursor:
+            break
+
+    assert sorted(vistos) == sorted(TELEFONES)
+    assert len(vistos) == len(set(vistos))
+    assert vistos == [c["telefone"] for c in cliente.get("/admin/conversas").json()]
+
+
+def test_cursor_malformado_e_400(cliente):
+    for ruim in ("nao-e-base64!!", "WyJ4Il0"):  # lixo e ["x"]
+        assert cliente.get("/admin/conversas", params={"cursor": ruim}).status_code == 400
+
+
+def test_validacao_do_cursor():
+    assert cursor_conversas_valido(["2024-05-01T12:00:00+00:00", "24680000000001@lid"])
+    assert cursor_conversas_valido([None, "status@broadcast"])
+    assert not cursor_conversas_valido(["ontem", "5511@c.us"])
+    assert not cursor_conversas_valido(["2024-05-01T12:00:00Z", ""])
+    assert not cursor_conversas_valido(["2024-05-01T12:00:00Z", 123])
+    assert not cursor_conversas_valido(["2024-05-01T12:00:00Z"])
+
+
+def test_filtro_postgrest_poe_o_id_entre_aspas():
+    filtro = filtro_cursor_conversas(["2024-05-01T12:00:00+00:00", 'x"),or(id.gt.0'])
+    assert filtro == ('ultima_interacao.lt."2024-05-01T12:00:00+00:00",'
+                      'and(ultima_interacao.eq."2024-05-01T12:00:00+00:00",telefone.lt."x\\"),or(id.gt.0")')
@@ -0,0 +1,56 @@
+import time
+
+from instancias import AnelConsistente, RegistroInstancias
+
+TELEFONES = [f"55119{i:08d}@c.us" for i in range(5000)]
+
+
+def _donos(anel: AnelConsistente):
+    return {t: anel.escolher(t) for t in TELEFONES}
+
+
+def test_anel_vazio():
+    assert AnelConsistente().escolher("5511999999999@c.us") is None
+
+
+def test_escolha_nao_depende_da_ordem_das_instancias():
+    assert _donos(AnelConsistente(["a", "b", "c"])) == _donos(AnelConsistente(["c", "a", "b"]))
+
+
+def test_divisao_razoavelmente_uniforme():
+    donos = list(_donos(AnelConsistente(["a", "b", "c", "d"])).values())
+    for inst in "abcd":
+        assert 0.1 < donos.count(inst) / len(donos) < 0.4
+
+
+def test_entrada_de_instancia_so_move_conversas_para_ela():
+    antes = _donos(AnelConsistente(["a", "b", "c", "d"]))
+    depois = _donos(AnelConsistente(["a", "b", "c", "d", "e"]))
+
+    movidas = [t for t in TELEFONES if antes[t] != depois[t]]
+    assert all(depois[t] == "e" for t in movidas)
+    # ~1/5 das conversas, não uma redistribuição geral
+    assert 0.1 < len(movidas) / len(TELEFONES) < 0.3
+
+
+def test_saida_de_instancia_so_move_as_conversas_dela():
+    antes = _donos(AnelConsistente(["a", "b", "c", "d"]))
+    depois = _donos(AnelConsistente(["a", "b", "d"]))
+
+    for t in TELEFONES:
+        if antes[t] == "c":
+            assert depois[t] in ("a", "b", "d")
+        else:
+            assert depois[t] == antes[t]
+
+
+def test_registro_esquece_instancia_sem_sinal():
+    registro = RegistroInstancias(ttl=0.05)
+    registro.visto("a")
+    registro.visto("b")
+    assert registro.ativas() == ["a", "b"]
+
+    time.sleep(0.1)
+    registro.visto("b")
+    assert registro.ativas() == ["b"]
+    assert all(registro.escolher(t) == "b" for t in TELEFONES[:50])
@@ -89,6 +89,9 @@ client.on('message', async msg => {
             mensagem: msg.body || (msg.hasMedia ? "[Arquivo]" : ""),
             is_group: isGroup,
             original_id: final_id,
+            // Id único da mensagem: o Python usa para ignorar reenvios
+            mensagem_id: msg.id ? msg.id._serialized : null,
+            timestamp: msg.timestamp || null,
             // Passa os dados da mídia se houver
             base64: mediaData.base64 || null,
             mimetype: mediaData.mimetype || null,
@@ -111,6 +114,21 @@ function formatarChatId(numero) {
     return chatId;
 }
 
+// =================================================================
+// === HELPER: Mídia por URL (armazém da nuvem) ou base64 ===
+// =================================================================
+async function carregarMidia({ url, base64, mimetype, filename }, mimetypePadrao) {
+    if (url) {
+        // Baixa em streaming do /blobs/{ref} da nuvem
+        const media = await MessageMedia.fromUrl(url, { unsafeMime: true, filename });
+        if (mimetype) media.mimetype = mimetype;
+        if (filename) media.filename = filename;
+        return media;
+    }
+    const cleanBase64 = base64.replace(/^data:.*;base64,/, "");
+    return new MessageMedia(mimetype || mimetypePadrao, cleanBase64, filename);
+}
+
 // =================================================================
 // === 2. ENDPOINTS DE ENVIO (MANTIDO E FUNCIONANDO) ===
 // =================================================================
@@ -136,11 +154,10 @@ app.post('/enviar', async (req, res) => {
 
 // Enviar IMAGEM
 app.post('/enviar_imagem', async (req, res) => {
-    const { number, base64, filename, caption } = req.body;
+    const { number, filename, caption } = req.body;
     try {
         const chatId = formatarChatId(number);
-        const cleanBase64 = base64.replace(/^data:.*;base64,/, "");
-        const media = new MessageMedia('image/jpeg', cleanBase64, filename);
+        const media = await carregarMidia(req.body, 'image/jpeg');
         
         await client.sendMessage(chatId, media, { caption: caption || '' });
         console.log(`📸 Imagem enviada para ${chatId}`);
@@ -153,11 +170,10 @@ app.post('/enviar_imagem', async (req, res) => {
 
 // Enviar ÁUDIO
 app.post('/enviar_audio', async (req, res) => {
-    const { number, base64 } = req.body;
+    const { number } = req.body;
     try {
         const chatId = formatarChatId(number);
-        const cleanBase64 = base64.replace(/^data:.*;base64,/, "");
-        const media = new MessageMedia('audio/mp3', cleanBase64, 'audio.mp3');
+        const media = await carregarMidia({ ...req.body, filename: 'audio.mp3' }, 'audio/mp3');
         
         await client.sendMessage(chatId, media, { sendAudioAsVoice: true });
         console.log(`🎤 Áudio enviado para ${chatId}`);
@@ -170,11 +186,9 @@ app.post('/enviar_audio', async (req, res) => {
 
 // Enviar ARQUIVO
 app.post('/enviar_arquivo', async (req, res) => {
-    const { number, base64, filename, caption } = req.body;
+    const { number, filename, caption } = req.body;
     try {
         const chatId = formatarChatId(number);
-        // Garante limpeza do base64
-        const cleanBase64 = base64.replace(/^data:.*;base64,/, "");
         
         // --- MELHORIA: Detectar Mimetype pela extensão ---
         let mimetype = 'application/octet-stream'; // Padrão
@@ -201,7 +215,7 @@ app.post('/enviar_arquivo', async (req, res) => {
         }
         // -------------------------------------------------
 
-        const media = new MessageMedia(mimetype, cleanBase64, filename);
+        const media = await carregarMidia({ ...req.body, mimetype: req.body.mimetype || mimetype }, mimetype);
         
         await client.sendMessage(chatId, media, { caption: caption || '' });
         console.log(`📎 Arquivo (${ext}) enviado para ${chatId}`);
@@ -1,36 +1,53 @@
 import os
+import base64
 # --- Desativar verificação SSL para download da IA ---
 os.environ['HF_HUB_DISABLE_SSL_VERIFICATION'] = '1'
 
-import requests
 import threading
-import time
+import requests
 import urllib3
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from typing import List, Optional
-import uvicorn
 from contextlib import asynccontextmanager 
 
 # Desabilitar avisos de SSL (para requests gerais)
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 # Importa a IA local
+import nubia_brain
 from nubia_brain import vetorizar_base_conhecimento, get_modelo_sentenca
-from nubia_core import processar_mensagem
+from nubia_core import processar_mensagem, aceita_texto_livre
+from nubia_concorrencia import AgrupadorRajadas, LocksPorConversa
+from nubia_fila import FilaPorConversa, POLITICA_SOBRECARGA
+from nubia_http import conexao_nao_abriu, get_cliente, metricas_http
+from nubia_idempotencia import RegistroIdempotencia, chave_mensagem
+from nubia_inferencia import InferenciaOcupada, executor_inferencia
+from nubia_carteiro import INSTANCIA, Despachante, loop_sincronizacao
+from nubia_sincronizador import BufferSincronizacao
+from nubia_status import cache_status, consultar_status, loop_mudancas_status, STATUS_HUMANO
+import nubia_workers as workers
 
 # CONFIGURAÇÃO
 from config import URL_NUVEM
 URL_BOT_LOCAL = "http://127.0.0.1:3000"
 
+nuvem = get_cliente(URL_NUVEM, verify=False)
+bot_local = get_cliente(URL_BOT_LOCAL)
+despachante = Despachante(nuvem, bot_local)
+sincronizador = BufferSincronizacao(nuvem, instancia=INSTANCIA)
+
 GLOBAL_BRAIN = {}
 user_sessions = {}
+locks_conversa = LocksPorConversa()
+agrupador = AgrupadorRajadas()
+idempotencia = RegistroIdempotencia()
 
-# --- Inicialização (Lifespan) ---
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    print("🏠 Iniciando NUBIA Local...")
-    
+MSG_SOBRECARGA = "Estou recebendo muitas mensagens agora 😅 Pode me mandar sua dúvida de novo em instantes?"
+
+def carregar_cerebro():
+    # Threads do torch antes do primeiro encode (no pai, antes do fork, com vários workers)
+    executor_inferencia.configurar(processos=workers.total())
     try:
         get_modelo_sentenca() 
         c, t = vetorizar_base_conhecimento()
@@ -40,7 +57,34 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         print(f"❌ Erro fatal ao carregar IA: {e}")
 
-    threading.Thread(target=loop_sincronizacao, daemon=True).start()
+def preparar_workers():
+    """Roda no pai antes do fork: modelo e vetores uma vez só, em memória compartilhada."""
+    print("🏠 Carregando NUBIA Local para os workers...")
+    carregar_cerebro()
+    workers.compartilhar_tensores(nubia_brain.modelo_sentenca, GLOBAL_BRAIN.get("cerebro", {}))
+    # Conexão SQLite não atravessa fork; cada worker reabre a sua
+    sincronizador.fechar()
+
+# --- Inicialização (Lifespan) ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    print("🏠 Iniciando NUBIA Local...")
+    
+    # Com NUBIA_WORKERS > 1 o pai já carregou tudo antes do fork
+    if not GLOBAL_BRAIN:
+        carregar_cerebro()
+
+    if workers.total() > 1:
+        sincronizador.abrir()
+    # Núcleos divididos entre os workers: cada um com o seu encoder limitado
+    # (as threads do torch já foram definidas em carregar_cerebro)
+    executor_inferencia.iniciar(processos=workers.total())
+    fila_entrada.iniciar()
+    agrupador.iniciar(_rajada_fechada)
+    if workers.principal():
+        sincronizador.iniciar()
+        threading.Thread(target=loop_sincronizacao, args=(despachante,), daemon=True).start()
+    threading.Thread(target=loop_mudancas_status, args=(nuvem,), daemon=True).start()
     
     yield 
     
@@ -55,6 +99,8 @@ class ZapMsg(BaseModel):
     mensagem: str
     is_group: bool = False
     original_id: Optional[str] = None
+    mensagem_id: Optional[str] = None
+    timestamp: Optional[int] = None
     base64: Optional[str] = None
     mimetype: Optional[str] = None
     filename: Optional[str] = None
@@ -67,10 +113,132 @@ class ListaZap(BaseModel):
 # --- 1. RECEBE DO ZAP LOCAL ---
 @app.post("/webhook/local")
 def receber_zap(dados: ZapMsg):
+    """Valida, enfileira e responde na hora; a IA roda nos trabalhadores da fila."""
     print(f"📩 Local recebeu de {dados.nome}: {dados.mensagem}")
     
     id_para_responder = dados.original_id if dados.original_id else dados.telefone
 
+    # Vários workers: a conversa é sempre atendida pelo mesmo (sessão em memória)
+    dono = workers.dono(id_para_responder)
+    if dono != workers.indice():
+        resultado = _encaminhar_ao_dono(dono, dados)
+        if resultado is not None:
+            return resultado
+
+    # Reenvio do Node (timeout do lado de lá) não pode gerar uma segunda resposta
+    chave, janela = chave_mensagem(id_para_responder, dados.mensagem_id, dados.mensagem, dados.timestamp, dados.base64)
+    resultado, duplicada = idempotencia.executar(chave, lambda: _aceitar_mensagem(dados, id_para_responder), janela)
+    if duplicada:
+        print(f"♻️ Mensagem duplicada de {dados.nome} ignorada.")
+        return {**(resultado or {"ok": True}), "duplicada": True}
+    return resultado
+
+def _encaminhar_ao_dono(dono: int, dados: ZapMsg):
+    """
+    Repassa ao worker dono. Só atende aqui mesmo se a conexão nem abriu (dono
+    reiniciando); timeout de leitura ou conexão caída no meio viram 503, porque
+    o dono pode já ter aceitado a mensagem e atender de novo daria duas respostas.
+    """
+    try:
+        res = get_cliente(workers.url_interna(dono)).post("/webhook/local", json=dados.model_dump())
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        if isinstance(e, requests.exceptions.ConnectionError) and conexao_nao_abriu(e):
+            print(f"⚠️ Worker {dono} fora do ar ({e}). Atendendo no worker {workers.indice()}.")
+            return None
+        # Timeout de leitura ou conexão caída depois do envio: o dono pode ter recebido
+        print(f"⚠️ Worker {dono} não respondeu ({e}).")
+        raise HTTPException(status_code=503, detail="NUBIA sobrecarregada", headers={"Retry-After": "5"})
+    if res.status_code in (429, 503):
+        # "Ocupada"/"sobrecarregada" do dono chegam ao Node como ele respondeu
+        try:
+            detalhe = res.json().get("detail") or res.reason
+        except ValueError:
+            detalhe = res.reason
+        headers = {"Retry-After": res.headers["Retry-After"]} if "Retry-After" in res.headers else None
+        raise HTTPException(status_code=res.status_code, detail=detalhe, headers=headers)
+    res.raise_for_status()
+    return res.json()
+
+def _aceitar_mensagem(dados: ZapMsg, id_para_responder: str):
+    texto_livre = not dados.is_group and aceita_texto_livre(user_sessions.get(id_para_responder), dados.mensagem)
+
+    # Pergunta livre passa pelo encoder: com ele acima do orçamento de espera,
+    # responde "ocupado" na hora (comandos de menu seguem normalmente)
+    if texto_livre and executor_inferencia.ocupado():
+        if POLITICA_SOBRECARGA == "rejeitar":
+            print(f"🚫 Encoder ocupado. Mensagem de {dados.nome} rejeitada.")
+            raise HTTPException(status_code=429, detail="NUBIA ocupada", headers={"Retry-After": "5"})
+        print(f"⚠️ Encoder ocupado. Modo degradado para {dados.nome}.")
+        _sincronizar_entrada(dados, id_para_responder)
+        _enviar_texto(id_para_responder, dados.nome, MSG_SOBRECARGA)
+        return {"ok": True, "obs": "IA ocupada"}
+
+    # Mensagens de texto livre em sequência viram uma pergunta só
+    mesclavel = texto_livre and not dados.base64
+
+    # Rejeitar só dá para fazer enquanto o Node espera a resposta: uma rajada
+    # nova com a fila já cheia é recusada aqui, antes de abrir a janela
+    if (POLITICA_SOBRECARGA == "rejeitar" and fila_entrada.cheia()
+            and not agrupador.aberta(id_para_responder)):
+        print(f"🚫 Fila cheia. Mensagem de {dados.nome} rejeitada.")
+        raise HTTPException(status_code=503, detail="NUBIA sobrecarregada", headers={"Retry-After": "5"})
+
+    rajada = agrupador.registrar(id_para_responder, dados, mesclavel)
+    if rajada is None:
+        print(f"🧩 Mensagem de {dados.nome} na janela de agrupamento.")
+        return {"ok": True, "obs": "Mensagem agrupada"}
+
+    if fila_entrada.enfileirar(id_para_responder, rajada):
+        return {"ok": True, "fila": fila_entrada.profundidade()}
+
+    # --- Fila cheia: política de sobrecarga ---
+    if POLITICA_SOBRECARGA == "rejeitar":
+        print(f"🚫 Fila cheia. Mensagem de {dados.nome} rejeitada.")
+        raise HTTPException(status_code=503, detail="NUBIA sobrecarregada", headers={"Retry-After": "5"})
+
+    print(f"⚠️ Fila cheia. Modo degradado para {dados.nome}.")
+    _degradar(id_para_responder, rajada)
+    return {"ok": True, "obs": "Modo degradado"}
+
+def _degradar(id_para_responder: str, rajada):
+    """Registra as mensagens na nuvem e avisa o usuário, sem passar pela IA."""
+    itens = agrupador.fechar(rajada)
+    for item in itens:
+        _sincronizar_entrada(item, id_para_responder)
+    if not itens[-1].is_group:
+        _enviar_texto(id_para_responder, itens[-1].nome, MSG_SOBRECARGA)
+
+def _rajada_fechada(rajada):
+    """
+    Chamado pelo agrupador quando a janela fecha: só aí a rajada entra na fila,
+    sem ocupar um trabalhador durante a espera. O Node já teve resposta, então
+    fila cheia aqui é sempre modo degradado.
+    """
+    if not fila_entrada.enfileirar(rajada.telefone, rajada):
+        print(f"⚠️ Fila cheia. Modo degradado para {rajada.itens[-1].nome}.")
+        _degradar(rajada.telefone, rajada)
+
+def _processar_rajada(id_para_responder: str, rajada):
+    """Trabalhador da fila: registra as mensagens na nuvem e roda a IA uma vez."""
+    itens = list(rajada.itens)
+    for item in itens:
+        _sincronizar_entrada(item, id_para_responder)
+
+    dados = itens[-1]
+    if dados.is_group:
+        return
+
+    mensagem = "\n".join(i.mensagem for i in itens if i.mensagem)
+    if len(itens) > 1:
+        print(f"🧩 {len(itens)} mensagens de {dados.nome} agrupadas: {mensagem}")
+
+    # Uma mensagem por vez por conversa (a sessão é compartilhada)
+    with locks_conversa.travar(id_para_responder):
+        _responder(id_para_responder, dados.nome, mensagem)
+
+fila_entrada = FilaPorConversa("entrada", _processar_rajada)
+
+def _sincronizar_entrada(dados: ZapMsg, id_para_responder: str):
     # Prepara o payload básico
     payload_nuvem = {
         "telefone": id_para_responder, 
@@ -83,8 +251,8 @@ def receber_zap(dados: ZapMsg):
     # --- LÓGICA DE ANEXO ---
     if dados.base64:
         print(f"   📎 Processando anexo: {dados.filename}")
-        payload_nuvem["arquivo_base64"] = dados.base64
         payload_nuvem["arquivo_nome"] = dados.filename
+        payload_nuvem.update(_enviar_blob(dados))
         
         # Define o tipo simplificado
         tipo = 'documento'
@@ -99,27 +267,31 @@ def receber_zap(dados: ZapMsg):
             payload_nuvem["texto"] = f"[{tipo}]"
     # -----------------------
 
-    # Envia para a Nuvem
-    try:
-        requests.post(f"{URL_NUVEM}/sync/mensagem", json=payload_nuvem, verify=False)
-    except Exception as e: 
-        print(f"Erro sync nuvem (Log): {e}")
+    # Envia para a Nuvem (em lote, ver nubia_sincronizador)
+    sincronizador.adicionar(payload_nuvem)
 
-    if dados.is_group:
-        return {"ok": True, "obs": "Grupo ignorado pela IA"}
+def _enviar_blob(dados: ZapMsg) -> dict:
+    """Sobe o anexo como multipart para o armazém da nuvem; se falhar, vai em base64 mesmo."""
+    try:
+        conteudo = base64.b64decode(dados.base64)
+        mime = dados.mimetype or "application/octet-stream"
+        res = nuvem.post("/blobs", files={"arquivo": (dados.filename or "arquivo", conteudo, mime)})
+        res.raise_for_status()
+        info = res.json()
+        return {"arquivo_ref": info["ref"], "arquivo_tamanho": info["tamanho"], "arquivo_mime": info["mimetype"]}
+    except Exception as e:
+        print(f"Erro ao enviar anexo para o armazém: {e}. Enviando em base64.")
+        return {"arquivo_base64": dados.base64, "arquivo_mime": dados.mimetype}
 
-    # 2. Verifica Status (Se já tem algum atendente)
+def _responder(id_para_responder: str, nome: str, mensagem: str):
+    # 2. Verifica Status (Se já tem algum atendente) - cache local + feed da nuvem
     try:
-        res_status = requests.get(f"{URL_NUVEM}/sync/status_conversa/{id_para_responder}", verify=False)
-        if res_status.status_code == 200:
-            status_conversa = res_status.json().get("status", "robo")
+        status_conversa = consultar_status(nuvem, id_para_responder)
             
-            # Se com status humano, fila ou atendimento, NUBIA fica quieta
-            if status_conversa in ['atendimento', 'fila', 'humano']:
-                print(f"🤖 Status: {status_conversa}. NUBIA ficará em silêncio.")
-                return {"ok": True, "obs": "Atendimento humano em progresso"}
-        else:
-            print("Aviso: Falha ao checar status. Assumindo 'robo'.")
+        # Se com status humano, fila ou atendimento, NUBIA fica quieta
+        if status_conversa in STATUS_HUMANO:
+            print(f"🤖 Status: {status_conversa}. NUBIA ficará em silêncio.")
+            return {"ok": True, "obs": "Atendimento humano em progresso"}
             
     except Exception as e:
         print(f"Erro ao checar status: {e}. Assumindo 'robo'.")
@@ -147,113 +319,72 @@ def receber_zap(dados: ZapMsg):
 
     # 4. Chama o Cérebro (Core)
     resposta_dict = {}
+    agrupador.registrar_execucao()
     try:
         resposta_dict = processar_mensagem(
-            {"telefone": id_para_responder, "nome": dados.nome}, 
-            dados.mensagem, 
+            {"telefone": id_para_responder, "nome": nome}, 
+            mensagem, 
             user_sessions[id_para_responder]
         )
+    except InferenciaOcupada as e:
+        print(f"⚠️ {e}. Pedindo para {nome} tentar de novo.")
+        resposta_dict = {"texto": MSG_SOBRECARGA, "tipo": "ocupado"}
     except Exception as e:
         print(f"Erro ao processar mensagem: {e}")
         resposta_dict = {"texto": "Desculpe, ocorreu um erro interno. Tente novamente ou digite 'menu' para voltar.", "tipo": "erro"}
 
     # 5. Envia a Resposta
     if resposta_dict and "texto" in resposta_dict:
-        texto_resposta = resposta_dict["texto"]
+        _enviar_texto(id_para_responder, nome, resposta_dict["texto"])
 
-        # Envia para o Node.js Local (Texto)
-        try:
-            payload_envio = {
-                "telefone": id_para_responder, 
-                "texto": texto_resposta, 
-                "is_group": False
-            }
-            requests.post(f"{URL_BOT_LOCAL}/enviar", json=payload_envio)
-            
-        except Exception as e:
-            print(f"Erro ao enviar resposta local: {e}")
+    return {"ok": True}
+
+def _enviar_texto(id_para_responder: str, nome: str, texto_resposta: str):
+    # Envia para o Node.js Local (Texto)
+    try:
+        payload_envio = {
+            "telefone": id_para_responder, 
+            "texto": texto_resposta, 
+            "is_group": False
+        }
+        bot_local.post("/enviar", json=payload_envio)
         
-        # Sincroniza o Log de envio na Nuvem
-        try:
-            requests.post(f"{URL_NUVEM}/sync/mensagem", json={
-                "telefone": id_para_responder, "nome": dados.nome, 
-                "texto": texto_resposta, 
-                "remetente": "nubia", "status_envio": "enviado"
-            }, verify=False)
-        except Exception as e:
-            print(f"Erro sync nuvem (Resposta): {e}")
+    except Exception as e:
+        print(f"Erro ao enviar resposta local: {e}")
+    
+    # Sincroniza o Log de envio na Nuvem
+    sincronizador.adicionar({
+        "telefone": id_para_responder, "nome": nome, 
+        "texto": texto_resposta, 
+        "remetente": "nubia", "status_envio": "enviado"
+    })
 
-    return {"ok": True}
+# --- MÉTRICAS ---
+@app.get("/metricas")
+def metricas():
+    return {
+        "agrupamento": agrupador.metricas(),
+        "conversas": locks_conversa.metricas(),
+        "fila_entrada": fila_entrada.metricas(),
+        "http": metricas_http.resumo(),
+        "cache_status": cache_status.metricas(),
+        "carteiro": despachante.metricas(),
+        "idempotencia": idempotencia.metricas(),
+        "inferencia": executor_inferencia.metricas(),
+        "sincronizador": sincronizador.metricas(),
+        "worker": {"indice": workers.indice(), "total": workers.total(), "pid": os.getpid()},
+        "memoria": workers.memoria_workers(),
+    }
 
 # --- 2. RECEBE LISTA DE GRUPOS ---
 @app.post("/sync/listas_local")
 def sync_listas(listas: List[ListaZap]):
     print(f"🔄 Sincronizando {len(listas)} grupos com a nuvem...")
     try:
-        requests.post(f"{URL_NUVEM}/sync/listas", json=[l.model_dump() for l in listas], verify=False)
+        nuvem.post("/sync/listas", json=[l.model_dump() for l in listas], idempotente=True)
     except Exception as e:
         print(f"Erro ao enviar listas pra nuvem: {e}")
     return {"ok": True}
 
-# --- 3. O CARTEIRO ---
-def loop_sincronizacao():
-    print("📬 Carteiro iniciado...")
-    while True:
-        try:
-            res = requests.get(f"{URL_NUVEM}/sync/fila_pendente", verify=False)
-            
-            if res.status_code == 200:
-                msgs = res.json()
-                for msg in msgs:
-                    print(f"📤 Processando msg {msg['id']} para: {msg['telefone']}")
-                    
-                    try:
-                        payload_bot = {}
-                        endpoint_bot = "/enviar" 
-
-                        base64_content = msg.get('arquivo_base64') or msg.get('base64')
-                        
-                        if base64_content:
-                            print("   📎 Detectado anexo de mídia!")
-                            # Verifica o tipo de arquivo/imagem/audio
-                            payload_bot = {
-                                "number": msg['telefone'],
-                                "base64": base64_content,
-                                "filename": msg.get('arquivo_nome', 'arquivo'),
-                                "caption": msg.get('texto', '').split('] ')[-1] if ']' in msg.get('texto', '') else msg.get('texto', '')
-                            }
-                            
-                            tipo = msg.get('arquivo_tipo', 'arquivo')
-                            if tipo == 'imagem':
-                                endpoint_bot = "/enviar_imagem"
-                            elif tipo == 'audio':
-                                endpoint_bot = "/enviar_audio"
-                            else:
-                                endpoint_bot = "/enviar_arquivo"
-                                
-                        else:
-                            payload_bot = {
-                                "telefone": msg['telefone'], 
-                                "texto": msg['texto'],
-                                "is_group": "@g.us" in msg['telefone']
-                            }
-                            endpoint_bot = "/enviar"
-
-                        # Envia para o Bot Local
-                        r_bot = requests.post(f"{URL_BOT_LOCAL}{endpoint_bot}", json=payload_bot)
-                        
-                        if r_bot.status_code == 200:
-                            requests.post(f"{URL_NUVEM}/sync/confirmar/{msg['id']}", verify=False)
-                            print("   ✅ Entregue ao Bot Local.")
-                        else:
-                            print(f"   ❌ Bot Local recusou: {r_bot.text}")
-                        
-                    except Exception as env_err:
-                        print(f"   ❌ Erro local: {env_err}")
-                        
-        except Exception as e:
-            pass 
-        time.sleep(3)
-
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    workers.servir(app, host="0.0.0.0", porta=8000, preparar=preparar_workers)
\ No newline at end of file
@@ -7,6 +7,7 @@ import uuid
 from typing import Optional, Tuple, Any
 from google.oauth2.service_account import Credentials
 from sentence_transformers import SentenceTransformer, util
+from nubia_inferencia import executor_inferencia
 from config import NUBIA_CREDENTIALS, API_OPENAI
 from datetime import datetime
 from gtts import gTTS
@@ -277,14 +278,20 @@ def vetorizar_base_conhecimento(force_reload: bool = False) -> Tuple[dict, list]
 # ---------------------
 def encontrar_resposta_correspondente(pergunta: str, topico_sugerido: str, cerebro: dict) -> Optional[dict]:
     modelo = get_modelo_sentenca()
+    vetor = []
+
+    def vetor_usuario():
+        # Um encode por pergunta, mesmo varrendo todos os tópicos
+        if not vetor:
+            vetor.append(executor_inferencia.codificar(modelo, [pergunta], convert_to_tensor=True))
+        return vetor[0]
 
     def buscar_em_um_topico(nome_topico: str):
         nome_limpo = nome_topico.strip()
         if nome_limpo not in cerebro: return None, 0.0
             
         dados = cerebro[nome_limpo]
-        vetor_usuario = modelo.encode([pergunta], convert_to_tensor=True)
-        similaridades = util.pytorch_cos_sim(vetor_usuario, dados["vetores"])[0]
+        similaridades = util.pytorch_cos_sim(vetor_usuario(), dados["vetores"])[0]
         
         siglas = ["SERCRE", "SESAI", "SEABE", "SERSAO", "SERAMO", "NUBES", "NUTRIÇÃO", "ODONTO", "ATESTADO", "HOMOLOGAR"]
         p_upper = pergunta.upper()
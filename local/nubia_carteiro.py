@@ -0,0 +1,393 @@
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+
+from nubia_fila import FilaPorConversa
+
+# "stream": long-poll em /sync/fila_stream (entrega assim que a nuvem grava).
+# "polling": reivindica em /sync/fila/reivindicar a cada INTERVALO_POLLING (modo antigo).
+# Nos dois modos as mensagens vêm com lease e são confirmadas em lote.
+MODO_CARTEIRO = os.environ.get("NUBIA_MODO_CARTEIRO", "stream")
+INTERVALO_POLLING = 3
+ESPERA_LONG_POLL = 25
+# A cada N long-polls vazios, força uma leitura completa da fila (cursor=0)
+# para pegar mensagens que tenham escapado do aviso (ex.: bridge com vários workers).
+CICLOS_VARREDURA = 10
+LOTE_FILA = 50
+# Identidade desta instância (um número de WhatsApp) quando várias usam a
+# mesma nuvem: cada uma só recebe a própria fila. Vazio = fila global.
+INSTANCIA = os.environ.get("NUBIA_INSTANCIA") or None
+
+# Despacho: chats diferentes em paralelo, mesmo chat em ordem estrita.
+CONCORRENCIA_ENVIO = int(os.environ.get("NUBIA_CONCORRENCIA_ENVIO", "4"))
+# Ritmo global para o WhatsApp (mensagens/segundo) e intervalo mínimo por chat.
+TAXA_ENVIO = float(os.environ.get("NUBIA_TAXA_ENVIO", "2"))
+INTERVALO_MIN_CHAT = float(os.environ.get("NUBIA_INTERVALO_MIN_CHAT", "1"))
+TENTATIVAS_ENVIO = 3
+ESPERA_BASE_ENVIO = 1.0
+INTERVALO_CONFIRMACAO = 1.0
+
+def entregar(nuvem, bot_local, msg: Dict[str, Any]) -> bool:
+    """Envia uma mensagem reivindicada ao Node. True se o Node aceitou."""
+    print(f"📤 Processando msg {msg['id']} para: {msg['telefone']}")
+
+    try:
+        payload_bot = {}
+        endpoint_bot = "/enviar"
+
+        base64_content = msg.get('arquivo_base64') or msg.get('base64')
+        ref = msg.get('arquivo_ref')
+
+        if ref or base64_content:
+            print("   📎 Detectado anexo de mídia!")
+            # Verifica o tipo de arquivo/imagem/audio
+            payload_bot = {
+                "number": msg['telefone'],
+                "filename": msg.get('arquivo_nome') or 'arquivo',
+                "mimetype": msg.get('arquivo_mime'),
+                "caption": msg.get('texto', '').split('] ')[-1] if ']' in msg.get('texto', '') else msg.get('texto', '')
+            }
+            if ref:
+                # O Node baixa direto do armazém da nuvem (streaming)
+                payload_bot["url"] = f"{nuvem.base_url}/blobs/{ref}"
+            else:
+                payload_bot["base64"] = base64_content
+
+            tipo = msg.get('arquivo_tipo', 'arquivo')
+            if tipo == 'imagem':
+                endpoint_bot = "/enviar_imagem"
+            elif tipo == 'audio':
+                endpoint_bot = "/enviar_audio"
+            else:
+                endpoint_bot = "/enviar_arquivo"
+
+        else:
+            payload_bot = {
+                "telefone": msg['telefone'],
+                "texto": msg['texto'],
+                "is_group": "@g.us" in msg['telefone']
+            }
+            endpoint_bot = "/enviar"
+
+        # Envia para o Bot Local
+        r_bot = bot_local.post(endpoint_bot, json=payload_bot)
+
+        if r_bot.status_code == 200:
+            print("   ✅ Entregue ao Bot Local.")
+            return True
+
+        print(f"   ❌ Bot Local recusou: {r_bot.text}")
+        return False
+
+    except Exception as env_err:
+        print(f"   ❌ Erro local: {env_err}")
+        return False
+
+
+def confirmar(nuvem, enviados: List[int], falhas: List[int], devolvidas: List[int] = ()):
+    """Um POST para o lote inteiro; o que falhar aqui volta sozinho quando a lease vencer."""
+    if not enviados and not falhas and not devolvidas:
+        return
+    corpo = {"enviados": enviados, "falhas": falhas}
+    if devolvidas:
+        corpo["devolvidas"] = list(devolvidas)
+    try:
+        nuvem.post("/sync/fila/confirmar", json=corpo, idempotente=True)
+    except Exception as e:
+        print(f"[WARN] Falha ao confirmar lote ({len(enviados)} ok / {len(falhas)} falhas"
+              f" / {len(devolvidas)} devolvidas): {e}")
+
+
+def _idade_seg(created_at: Optional[str]) -> Optional[float]:
+    """Segundos desde o created_at da mensagem (latência ponta a ponta)."""
+    if not created_at:
+        return None
+    try:
+        dt = datetime.fromisoformat(str(created_at).replace("Z", "+00:00"))
+        return max(0.0, time.time() - dt.timestamp())
+    except ValueError:
+        return None
+
+
+class LimitadorTaxa:
+    """Token bucket simples: no máximo `taxa` envios por segundo (rajada de 1s)."""
+
+    def __init__(self, taxa: float):
+        self.taxa = taxa
+        self._lock = threading.Lock()
+        self._fichas = max(1.0, taxa)
+        self._ultimo = time.monotonic()
+
+    def aguardar(self):
+        if self.taxa <= 0:
+            return
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self._fichas = min(max(1.0, self.taxa), self._fichas + (agora - self._ultimo) * self.taxa)
+                self._ultimo = agora
+                if self._fichas >= 1:
+                    self._fichas -= 1
+                    return
+                espera = (1 - self._fichas) / self.taxa
+            time.sleep(espera)
+
+
+class Despachante:
+    """
+    Entrega as mensagens reivindicadas em paralelo entre chats (até
+    CONCORRENCIA_ENVIO), em ordem dentro de cada chat, no ritmo de TAXA_ENVIO,
+    com retentativa por mensagem. Confirmações vão para a nuvem em lote.
+
+    Uma mensagem que esgota as tentativas (ou não cabe na fila local) bloqueia
+    o chat: ela e todas as seguintes do mesmo chat em voo voltam juntas para a
+    fila da nuvem (as não tentadas como 'devolvidas', sem gastar tentativa), e
+    o chat só volta a andar quando a nuvem confirmou a devolução. Assim nada
+    mais novo sai antes dela.
+    """
+
+    def __init__(self, nuvem, bot_local):
+        self.nuvem = nuvem
+        self.bot_local = bot_local
+        self.fila = FilaPorConversa("carteiro", self._processar,
+                                    trabalhadores=CONCORRENCIA_ENVIO, capacidade=LOTE_FILA * 20)
+        self.limitador = LimitadorTaxa(TAXA_ENVIO)
+
+        self._lock = threading.Condition()
+        self._em_voo: Dict[int, str] = {}  # id -> telefone
+        self._bloqueados: Set[str] = set()
+        self._ultimo_por_chat: Dict[str, float] = {}
+        self._enviados: List[int] = []
+        self._falhas: List[int] = []
+        self._devolvidas: List[int] = []
+        self._latencias = deque(maxlen=500)
+        self.total_enviados = 0
+        self.total_falhas = 0
+        self.total_devolvidas = 0
+        self.bloqueios = 0
+        self.retentativas = 0
+
+    def iniciar(self):
+        self.fila.iniciar()
+        threading.Thread(target=self._loop_confirmacao, name="carteiro-confirmacao", daemon=True).start()
+
+    def despachar(self, msgs: List[Dict[str, Any]]):
+        # A nuvem devolve em ordem de id; a fila preserva essa ordem por chat
+        for msg in sorted(msgs, key=lambda m: m["id"]):
+            telefone = msg["telefone"]
+            with self._lock:
+                if msg["id"] in self._em_voo:
+                    continue  # lease venceu e a nuvem devolveu de novo: já está aqui
+                self._em_voo[msg["id"]] = telefone
+                if telefone in self._bloqueados:
+                    self._devolver(msg["id"])
+                    continue
+            if not self.fila.enfileirar(telefone, msg):
+                with self._lock:
+                    self._bloquear(telefone, "fila local cheia")
+                    self._devolver(msg["id"])
+
+    def _bloquear(self, telefone: str, motivo: str):
+        """Chamar com o lock."""
+        if telefone not in self._bloqueados:
+            self._bloqueados.add(telefone)
+            self.bloqueios += 1
+            print(f"⛔ Chat {telefone} parado ({motivo}): as mensagens em voo voltam para a fila.")
+
+    def _devolver(self, id_msg: int):
+        """Chamar com o lock. Volta à fila da nuvem sem contar como tentativa."""
+        self._devolvidas.append(id_msg)
+        self.total_devolvidas += 1
+
+    def backlog(self) -> int:
+        with self._lock:
+            return len(self._em_voo)
+
+    def aguardar_espaco(self, limite: int = LOTE_FILA):
+        """Não reivindica mais do que dá para entregar antes das leases vencerem."""
+        with self._lock:
+            while len(self._em_voo) >= limite:
+                self._lock.wait(1.0)
+
+    def _espacar_chat(self, telefone: str):
+        with self._lock:
+            ultimo = self._ultimo_por_chat.get(telefone)
+        if ultimo is not None:
+            espera = ultimo + INTERVALO_MIN_CHAT - time.monotonic()
+            if espera > 0:
+                time.sleep(espera)
+
+    def _processar(self, telefone: str, msg: Dict[str, Any]):
+        with self._lock:
+            if telefone in self._bloqueados:
+                # Uma anterior deste chat falhou: esta volta junto, sem tentar
+                self._devolver(msg["id"])
+                return
+        ok = False
+        try:
+            for tentativa in range(1, TENTATIVAS_ENVIO + 1):
+                self._espacar_chat(telefone)
+                self.limitador.aguardar()
+                ok = entregar(self.nuvem, self.bot_local, msg)
+                with self._lock:
+                    self._ultimo_por_chat[telefone] = time.monotonic()
+                if ok:
+                    break
+                if tentativa < TENTATIVAS_ENVIO:
+                    with self._lock:
+                        self.retentativas += 1
+                    time.sleep(ESPERA_BASE_ENVIO * 2 ** (tentativa - 1))
+        finally:
+            idade = _idade_seg(msg.get("created_at")) if ok else None
+            with self._lock:
+                (self._enviados if ok else self._falhas).append(msg["id"])
+                if ok:
+                    self.total_enviados += 1
+                    if idade is not None:
+                        self._latencias.append(idade)
+                else:
+                    self.total_falhas += 1
+                    self._bloquear(telefone, f"msg {msg['id']} esgotou as tentativas")
+                if len(self._enviados) + len(self._falhas) >= LOTE_FILA:
+                    self._lock.notify_all()
+
+    def _loop_confirmacao(self):
+        while True:
+            with self._lock:
+                self._lock.wait(INTERVALO_CONFIRMACAO)
+                enviados, self._enviados = self._enviados, []
+                falhas, self._falhas = self._falhas, []
+                devolvidas, self._devolvidas = self._devolvidas, []
+            if enviados or falhas or devolvidas:
+                confirmar(self.nuvem, enviados, falhas, devolvidas)
+                with self._lock:
+                    for id_msg in enviados + falhas + devolvidas:
+                        self._em_voo.pop(id_msg, None)
+                    # Chat parado volta a andar quando nada dele está mais em voo:
+                    # a próxima reivindicação traz a que falhou antes das seguintes
+                    if self._bloqueados:
+                        self._bloqueados &= set(self._em_voo.values())
+                    self._lock.notify_all()
+                    # Chats sem nada em voo não precisam mais do espaçamento
+                    if len(self._ultimo_por_chat) > 1000:
+                        limite = time.monotonic() - INTERVALO_MIN_CHAT
+                        for chat, t in list(self._ultimo_por_chat.items()):
+                            if t < limite:
+                                del self._ultimo_por_chat[chat]
+
+    def metricas(self) -> Dict[str, Any]:
+        with self._lock:
+            lat = sorted(self._latencias)
+            n = len(lat)
+            return {
+                "backlog": len(self._em_voo),
+                "enviados": self.total_enviados,
+                "falhas": self.total_falhas,
+                "devolvidas": self.total_devolvidas,
+                "chats_parados": len(self._bloqueados),
+                "bloqueios": self.bloqueios,
+                "retentativas": self.retentativas,
+                "latencia_media_seg": round(sum(lat) / n, 2) if n else 0.0,
+                "latencia_p95_seg": round(lat[min(n - 1, int(n * 0.95))], 2) if n else 0.0,
+                "taxa_envio_por_seg": TAXA_ENVIO,
+                "fila": self.fila.metricas(),
+            }
+
+
+def _loop_polling_legado(nuvem, bot_local):
+    """Bridge antiga, sem lease: lê tudo que está pendente e confirma um a um."""
+    while True:
+        try:
+            res = nuvem.get("/sync/fila_pendente")
+
+            if res.status_code == 200:
+                for msg in res.json():
+                    if entregar(nuvem, bot_local, msg):
+                        nuvem.post(f"/sync/confirmar/{msg['id']}", idempotente=True)
+
+        except Exception as e:
+            pass
+        time.sleep(INTERVALO_POLLING)
+
+
+def loop_polling(despachante: Despachante):
+    print("📬 Carteiro iniciado (polling)...")
+    nuvem = despachante.nuvem
+    while True:
+        try:
+            despachante.aguardar_espaco()
+            params = {"limite": LOTE_FILA}
+            if INSTANCIA:
+                params["instancia"] = INSTANCIA
+            res = nuvem.post("/sync/fila/reivindicar", params=params, idempotente=False)
+
+            if res.status_code == 404:
+                print("[WARN] Nuvem sem /sync/fila/reivindicar. Usando fila legada.")
+                return _loop_polling_legado(nuvem, despachante.bot_local)
+            if res.status_code == 200:
+                msgs = res.json()
+                despachante.despachar(msgs)
+                if len(msgs) >= LOTE_FILA:
+                    continue  # ainda tem fila: não espera
+
+        except Exception as e:
+            pass
+        time.sleep(INTERVALO_POLLING)
+
+
+def loop_stream(despachante: Despachante):
+    """
+    Consumidor do long-poll da nuvem. Reconecta com backoff e retoma do
+    cursor; se a bridge não tiver /sync/fila_stream, cai para o polling.
+    """
+    print("📬 Carteiro iniciado (stream)...")
+    nuvem = despachante.nuvem
+    cursor, epoca, falhas, vazios = 0, None, 0, 0
+    while True:
+        try:
+            despachante.aguardar_espaco()
+            params = {"cursor": cursor, "timeout": ESPERA_LONG_POLL}
+            if epoca:
+                params["epoca"] = epoca
+            params["limite"] = LOTE_FILA
+            if INSTANCIA:
+                params["instancia"] = INSTANCIA
+            res = nuvem.get("/sync/fila_stream", params=params, timeout=(3, ESPERA_LONG_POLL + 10),
+                            idempotente=False)
+
+            if res.status_code == 404:
+                print("[WARN] Nuvem sem /sync/fila_stream. Usando polling.")
+                return loop_polling(despachante)
+            res.raise_for_status()
+
+            dados = res.json()
+            cursor, epoca, falhas = dados.get("cursor", 0), dados.get("epoca"), 0
+            msgs = dados.get("mensagens", [])
+
+            if msgs:
+                vazios = 0
+                despachante.despachar(msgs)
+                if len(msgs) >= LOTE_FILA:
+                    cursor = 0  # lote cheio: provavelmente ainda há pendentes
+            else:
+                vazios += 1
+                if vazios >= CICLOS_VARREDURA:
+                    cursor, vazios = 0, 0
+
+        except Exception as e:
+            falhas += 1
+            if falhas == 1:
+                print(f"[WARN] Stream da fila caiu: {e}. Reconectando...")
+            cursor = 0
+            time.sleep(min(30, 2 ** min(falhas, 5)))
+
+
+def loop_sincronizacao(despachante: Despachante):
+    despachante.iniciar()
+    if MODO_CARTEIRO == "polling":
+        loop_polling(despachante)
+    else:
+        loop_stream(despachante)
@@ -0,0 +1,200 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Janela (segundos) para juntar mensagens de texto livre enviadas em sequência.
+# 0 desativa o agrupamento: cada mensagem vira uma execução do pipeline.
+JANELA_AGRUPAMENTO = float(os.environ.get("NUBIA_JANELA_AGRUPAMENTO", "0"))
+# Teto absoluto de espera, para um usuário que não para de digitar.
+JANELA_AGRUPAMENTO_MAX = float(os.environ.get("NUBIA_JANELA_AGRUPAMENTO_MAX", "6"))
+
+
+class LocksPorConversa:
+    """
+    Um lock por telefone: duas mensagens do mesmo usuário nunca rodam o
+    pipeline ao mesmo tempo (a sessão dele é um dict compartilhado).
+    Locks sem ninguém esperando são descartados para não crescer sem limite.
+    """
+
+    def __init__(self):
+        self._guarda = threading.Lock()
+        self._locks: Dict[str, list] = {}  # telefone -> [lock, referencias]
+        self.esperas = 0
+        self.tempo_espera_total = 0.0
+
+    @contextmanager
+    def travar(self, telefone: str):
+        with self._guarda:
+            item = self._locks.setdefault(telefone, [threading.Lock(), 0])
+            item[1] += 1
+
+        lock = item[0]
+        if not lock.acquire(blocking=False):
+            inicio = time.monotonic()
+            lock.acquire()
+            with self._guarda:
+                self.esperas += 1
+                self.tempo_espera_total += time.monotonic() - inicio
+
+        try:
+            yield
+        finally:
+            lock.release()
+            with self._guarda:
+                item[1] -= 1
+                if item[1] == 0:
+                    self._locks.pop(telefone, None)
+
+    def metricas(self) -> Dict[str, Any]:
+        with self._guarda:
+            return {
+                "conversas_ativas": len(self._locks),
+                "esperas_lock": self.esperas,
+                "tempo_espera_lock_seg": round(self.tempo_espera_total, 3),
+            }
+
+
+class Rajada:
+    """Mensagens de um mesmo telefone que serão respondidas como uma só."""
+
+    def __init__(self, telefone: str, item: Any, mesclavel: bool):
+        self.telefone = telefone
+        self.itens: List[Any] = [item]
+        self.inicio = time.monotonic()
+        self.ultima = self.inicio
+        self.fechada = not mesclavel
+
+
+class AgrupadorRajadas:
+    """
+    Debounce por telefone. A primeira mensagem de texto livre abre uma rajada;
+    as seguintes, enquanto a janela estiver aberta, entram na mesma rajada e
+    não disparam pipeline próprio.
+
+    Ninguém dorme esperando a janela: uma thread de prazos fecha cada rajada
+    quando o usuário para de digitar (ou no teto) e só então a entrega a
+    ao_fechar, que a põe na fila de trabalho.
+    """
+
+    def __init__(self, janela: float = JANELA_AGRUPAMENTO, janela_max: float = JANELA_AGRUPAMENTO_MAX):
+        self.janela = janela
+        self.janela_max = max(janela, janela_max)
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._abertas: Dict[str, Rajada] = {}
+        self._prazos: List[Tuple[float, int, Rajada]] = []  # heap (prazo, desempate, rajada)
+        self._seq = itertools.count()
+        self._ao_fechar: Optional[Callable[[Rajada], None]] = None
+        self.contadores = {
+            "mensagens_recebidas": 0,
+            "mensagens_agrupadas": 0,
+            "execucoes_pipeline": 0,
+        }
+
+    def iniciar(self, ao_fechar: Callable[[Rajada], None]):
+        """Sobe a thread de prazos. Sem ela (janela 0), nenhuma rajada fica aberta."""
+        if self._ao_fechar is not None:
+            return
+        self._ao_fechar = ao_fechar
+        if self.janela > 0:
+            threading.Thread(target=self._loop, name="agrupador", daemon=True).start()
+
+    def _prazo(self, rajada: Rajada) -> float:
+        return min(rajada.ultima + self.janela, rajada.inicio + self.janela_max)
+
+    def _tirar(self, rajada: Rajada):
+        rajada.fechada = True
+        if self._abertas.get(rajada.telefone) is rajada:
+            del self._abertas[rajada.telefone]
+
+    def aberta(self, telefone: str) -> bool:
+        with self._lock:
+            return telefone in self._abertas
+
+    def registrar(self, telefone: str, item: Any, mesclavel: bool) -> Optional[Rajada]:
+        """
+        Retorna a Rajada que o chamador deve enfileirar agora, ou None se a
+        mensagem ficou com o agrupador (abriu uma janela ou entrou numa aberta;
+        a rajada chega à fila por ao_fechar quando a janela fechar).
+        """
+        anterior = None
+        with self._lock:
+            self.contadores["mensagens_recebidas"] += 1
+
+            if self.janela <= 0 or self._ao_fechar is None or not mesclavel:
+                # Um anexo/comando encerra a rajada aberta, que vai para a
+                # fila antes dele: nada de texto anterior "fica para trás".
+                aberta = self._abertas.get(telefone)
+                if aberta and not aberta.fechada:
+                    self._tirar(aberta)
+                    anterior = aberta
+                rajada = Rajada(telefone, item, mesclavel=False)
+            else:
+                aberta = self._abertas.get(telefone)
+                if aberta and not aberta.fechada:
+                    aberta.itens.append(item)
+                    aberta.ultima = time.monotonic()
+                    self.contadores["mensagens_agrupadas"] += 1
+                    return None
+
+                nova = Rajada(telefone, item, mesclavel=True)
+                self._abertas[telefone] = nova
+                heapq.heappush(self._prazos, (self._prazo(nova), next(self._seq), nova))
+                self._cond.notify()
+                return None
+
+        if anterior is not None:
+            self._entregar(anterior)
+        return rajada
+
+    def _entregar(self, rajada: Rajada):
+        try:
+            self._ao_fechar(rajada)
+        except Exception as e:
+            print(f"❌ [agrupador] Erro ao entregar a rajada de {rajada.telefone}: {e}")
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._prazos:
+                        self._cond.wait()
+                        continue
+                    prazo, _, rajada = self._prazos[0]
+                    agora = time.monotonic()
+                    if prazo > agora:
+                        self._cond.wait(prazo - agora)
+                        continue
+                    heapq.heappop(self._prazos)
+                    if rajada.fechada:
+                        continue
+                    # Chegou mensagem depois de agendar: o prazo andou
+                    novo = self._prazo(rajada)
+                    if novo > agora:
+                        heapq.heappush(self._prazos, (novo, next(self._seq), rajada))
+                        continue
+                    self._tirar(rajada)
+                    break
+            self._entregar(rajada)
+
+    def fechar(self, rajada: Rajada) -> List[Any]:
+        """Fecha a rajada na hora, sem esperar a janela."""
+        with self._lock:
+            self._tirar(rajada)
+            return list(rajada.itens)
+
+    def registrar_execucao(self):
+        with self._lock:
+            self.contadores["execucoes_pipeline"] += 1
+
+    def metricas(self) -> Dict[str, Any]:
+        with self._lock:
+            dados = dict(self.contadores)
+            dados["execucoes_evitadas"] = dados["mensagens_agrupadas"]
+            dados["rajadas_abertas"] = len(self._abertas)
+            dados["janela_seg"] = self.janela
+            return dados
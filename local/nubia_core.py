@@ -1,7 +1,9 @@
 from typing import Optional, Dict, Any
-import requests
 import traceback
 
+from nubia_http import get_cliente
+from nubia_status import cache_status
+
 from nubia_brain import (
     encontrar_resposta_correspondente,
     humanizar_resposta_com_ia,
@@ -20,6 +22,7 @@ from nubia_brain import (
 
 
 from sentence_transformers import util as st_util
+from nubia_inferencia import InferenciaOcupada, executor_inferencia
 
 SIM_FALLBACK_APPROVE = 0.40
 SIM_FALLBACK_RETRY = 0.25
@@ -58,14 +61,14 @@ def _transfer_to_human(session: Dict[str, Any], usuario: Dict[str, Any], setor:
         print("[NUBIA] transfer: URL_NUVEM não encontrada na sessão.")
         return False
     try:
-        resp = requests.post(
-            f"{url_nuvem}/sync/transferir",
+        resp = get_cliente(url_nuvem, verify=False).post(
+            "/sync/transferir",
             json={"telefone": telefone, "setor": setor},
-            timeout=10,
-            verify=False
+            idempotente=True
         )
         if resp.status_code == 200:
             print(f"[NUBIA] Transferência solicitada -> setor={setor}, telefone={telefone}")
+            cache_status.gravar(telefone, "fila", setor)
             return True
         else:
             print(f"[NUBIA] Transferência retornou status {resp.status_code}: {resp.text}")
@@ -93,10 +96,22 @@ def _close_after_transfer(session: Dict[str, Any], setor: str) -> Dict[str, Any]
 
     return {"texto": msg_transferencia, "tipo": "resposta"}
 
+def _formatar_espera(segundos: float) -> str:
+    minutos = max(1, round(segundos / 60))
+    if minutos < 5:
+        return "menos de 5 minutos"
+    # Arredonda para múltiplos de 5 para não prometer precisão que não existe;
+    # 58 minutos viram "1 hora", não "60 minutos"
+    arredondado = 5 * round(minutos / 5)
+    if arredondado < 60:
+        return f"cerca de {arredondado} minutos"
+    horas = minutos / 60
+    return "cerca de 1 hora" if horas < 1.5 else f"cerca de {round(horas)} horas"
+
 def _obter_estimativa_fila(session: Dict[str, Any], setor: str) -> str:
     """
-    Consulta a API da nuvem para ver quantas pessoas estão na fila desse setor
-    e retorna uma string de tempo estimado.
+    Consulta a API da nuvem para ver a fila desse setor e retorna uma string
+    de tempo estimado (da média recente do setor; sem histórico, pela quantidade).
     """
     url_nuvem = session.get("api_nuvem")
     if not url_nuvem: return "alguns minutos"
@@ -106,11 +121,16 @@ def _obter_estimativa_fila(session: Dict[str, Any], setor: str) -> str:
         if "(" in setor and ")" in setor:
             sigla = setor.split("(")[-1].replace(")", "")
             
-        resp = requests.get(f"{url_nuvem}/admin/fila_setor/{sigla}", timeout=5, verify=False)
+        resp = get_cliente(url_nuvem, verify=False).get(f"/admin/fila_setor/{sigla}")
         
         if resp.status_code == 200:
             dados = resp.json()
             qtd = dados.get("em_fila", 0)
+
+            # Estimativa da nuvem a partir dos atendimentos recentes do setor
+            espera = dados.get("espera_estimada_seg")
+            if espera is not None:
+                return _formatar_espera(espera)
             
             if qtd <= 2:
                 return "menos de 10 minutos"
@@ -143,14 +163,30 @@ def _semantic_similarity_fallback(pergunta: str, resposta: str) -> float:
     """
     try:
         model = get_modelo_sentenca()
-        vq = model.encode([pergunta], convert_to_tensor=True)
-        va = model.encode([resposta], convert_to_tensor=True)
-        sim = float(st_util.pytorch_cos_sim(vq, va)[0][0].item())
+        v = executor_inferencia.codificar(model, [pergunta, resposta], convert_to_tensor=True)
+        sim = float(st_util.pytorch_cos_sim(v[0:1], v[1:2])[0][0].item())
         return sim
+    except InferenciaOcupada:
+        raise
     except Exception as e:
         print(f"[WARN] Falha fallback similarity: {e}")
         return 0.0
 
+def aceita_texto_livre(session: Optional[Dict[str, Any]], mensagem_usuario: str) -> bool:
+    """
+    True se a sessão está esperando uma pergunta livre e a mensagem não é um
+    comando (menu, transferência). Só essas mensagens podem ser agrupadas
+    numa pergunta única sem mudar o resultado da navegação.
+    """
+    if not session:
+        return False
+    msg = (mensagem_usuario or "").strip()
+    if not msg or _is_reset_command(msg) or _is_transfer_command(msg):
+        return False
+    if session.get("awaiting_nps") or session.get("awaiting_feedback"):
+        return False
+    return bool(session.get("aguardando_pergunta") or session.get("opcoes_validas") == "LIVRE")
+
 def processar_mensagem(usuario: Dict[str, Any], mensagem_usuario: str, session: Dict[str, Any]) -> Dict[str, Any]:
     """
     Processa a mensagem com Lógica Híbrida (Duelo de Tópicos), Segurança e UX (NPS/Feedback).
@@ -272,6 +308,7 @@ def processar_mensagem(usuario: Dict[str, Any], mensagem_usuario: str, session:
             try:
                 res_usuario = encontrar_resposta_correspondente(pergunta_usuario, topico_usuario, cerebro)
                 if res_usuario: score_usuario = res_usuario.get("_score", 0.0)
+            except InferenciaOcupada: raise
             except: pass
 
         # Busca no Tópico da IA (Só se for diferente)
@@ -280,6 +317,7 @@ def processar_mensagem(usuario: Dict[str, Any], mensagem_usuario: str, session:
             try:
                 res_ia = encontrar_resposta_correspondente(pergunta_usuario, topico_ia, cerebro)
                 if res_ia: score_ia = res_ia.get("_score", 0.0)
+            except InferenciaOcupada: raise
             except: pass
 
         # Decidir o Tópico Vencedor
@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Set, Tuple
+
+TRABALHADORES = int(os.environ.get("NUBIA_TRABALHADORES", "4"))
+CAPACIDADE_FILA = int(os.environ.get("NUBIA_CAPACIDADE_FILA", "200"))
+# O que fazer com a fila cheia: "rejeitar" (503 para o Node) ou "degradar"
+# (registra a mensagem e avisa o usuário sem passar pela IA).
+POLITICA_SOBRECARGA = os.environ.get("NUBIA_POLITICA_SOBRECARGA", "degradar")
+
+
+class FilaPorConversa:
+    """
+    Fila limitada drenada por um pool fixo de threads.
+
+    A ordem é garantida por chave (telefone): uma conversa nunca tem dois itens
+    em execução ao mesmo tempo, mas conversas diferentes andam em paralelo.
+    """
+
+    def __init__(self, nome: str, processar: Callable[[str, Any], None],
+                 trabalhadores: int = TRABALHADORES, capacidade: int = CAPACIDADE_FILA):
+        self.nome = nome
+        self.processar = processar
+        self.trabalhadores = max(1, trabalhadores)
+        self.capacidade = max(1, capacidade)
+
+        self._cond = threading.Condition()
+        self._filas: Dict[str, Deque[Tuple[Any, float]]] = {}
+        self._prontas: Deque[str] = deque()  # chaves com itens e sem ninguém processando
+        self._ativas: Set[str] = set()
+        self._tamanho = 0
+        self._threads = []
+
+        self.enfileirados = 0
+        self.processados = 0
+        self.descartados = 0
+        self.erros = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+
+    def iniciar(self):
+        if self._threads:
+            return
+        for i in range(self.trabalhadores):
+            t = threading.Thread(target=self._loop, name=f"{self.nome}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def enfileirar(self, chave: str, item: Any) -> bool:
+        """Retorna False (e conta um descarte) se a fila estiver cheia."""
+        with self._cond:
+            if self._tamanho >= self.capacidade:
+                self.descartados += 1
+                return False
+
+            fila = self._filas.setdefault(chave, deque())
+            fila.append((item, time.monotonic()))
+            self._tamanho += 1
+            self.enfileirados += 1
+
+            if len(fila) == 1 and chave not in self._ativas:
+                self._prontas.append(chave)
+                self._cond.notify()
+            return True
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._prontas:
+                    self._cond.wait()
+                chave = self._prontas.popleft()
+                self._ativas.add(chave)
+                item, enfileirado_em = self._filas[chave].popleft()
+                self._tamanho -= 1
+
+                espera = time.monotonic() - enfileirado_em
+                self.espera_total += espera
+                self.espera_max = max(self.espera_max, espera)
+
+            try:
+                self.processar(chave, item)
+            except Exception as e:
+                print(f"❌ [{self.nome}] Erro ao processar item de {chave}: {e}")
+                with self._cond:
+                    self.erros += 1
+            finally:
+                with self._cond:
+                    self.processados += 1
+                    self._ativas.discard(chave)
+                    if self._filas.get(chave):
+                        self._prontas.append(chave)
+                        self._cond.notify()
+                    else:
+                        self._filas.pop(chave, None)
+
+    def cheia(self) -> bool:
+        with self._cond:
+            return self._tamanho >= self.capacidade
+
+    def profundidade(self) -> int:
+        with self._cond:
+            return self._tamanho
+
+    def metricas(self) -> Dict[str, Any]:
+        with self._cond:
+            iniciados = self.enfileirados - self._tamanho
+            return {
+                "profundidade": self._tamanho,
+                "capacidade": self.capacidade,
+                "trabalhadores": self.trabalhadores,
+                "conversas_em_execucao": len(self._ativas),
+                "enfileirados": self.enfileirados,
+                "processados": self.processados,
+                "descartados": self.descartados,
+                "erros": self.erros,
+                "espera_media_seg": round(self.espera_total / iniciados, 3) if iniciados else 0.0,
+                "espera_max_seg": round(self.espera_max, 3),
+            }
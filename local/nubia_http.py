@@ -0,0 +1,241 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+try:
+    import httpx
+except ImportError:  # cliente assíncrono é opcional
+    httpx = None
+
+# Timeouts (conexão, leitura) por rota. A rota é o prefixo do caminho, sem ids.
+TIMEOUTS: Dict[str, Tuple[float, float]] = {
+    "/sync/status_conversa": (2, 3),
+    "/sync/status_mudancas": (3, 35),  # long-poll: leitura > espera do servidor
+    "/sync/mensagem": (3, 10),
+    "/sync/mensagens_lote": (3, 20),
+    "/sync/listas": (3, 15),
+    "/sync/fila_pendente": (3, 10),
+    "/sync/fila_stream": (3, 35),
+    "/sync/confirmar": (3, 5),
+    "/sync/fila/reivindicar": (3, 10),
+    "/sync/fila/confirmar": (3, 10),
+    "/sync/transferir": (3, 10),
+    "/admin/fila_setor": (2, 5),
+    "/blobs": (3, 60),
+    "/enviar": (2, 30),  # Node: upload de mídia para o WhatsApp pode demorar
+    # Repasse ao worker dono: ele pode esperar uma duplicata (30s, ver
+    # nubia_idempotencia) ou mandar o aviso de sobrecarga pelo /enviar (até
+    # ~35s com a repetição de conexão). Leitura acima disso, senão o Node
+    # recebe 503 e reenvia uma mensagem que o dono já respondeu.
+    "/webhook/local": (2, 45),
+}
+TIMEOUT_PADRAO = (3, 10)
+
+TENTATIVAS_EXTRAS = 2       # só para chamadas idempotentes
+ESPERA_ENTRE_TENTATIVAS = 0.5
+STATUS_REPETIVEIS = {502, 503, 504}
+TAMANHO_POOL = 20
+AMOSTRAS_LATENCIA = 200
+
+
+def _rota(caminho: str) -> str:
+    caminho = caminho.split("?", 1)[0]
+    melhor = ""
+    for prefixo in TIMEOUTS:
+        if caminho.startswith(prefixo) and len(prefixo) > len(melhor):
+            melhor = prefixo
+    if melhor:
+        return melhor
+    partes = [p for p in caminho.split("/") if p]
+    return "/" + "/".join(partes[:2])
+
+
+class _Metricas:
+    """Contagem, erros e latência (média, p50, p95, máx) por endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dados: Dict[str, Dict[str, Any]] = {}
+
+    def registrar(self, chave: str, duracao: float, erro: bool):
+        with self._lock:
+            d = self._dados.get(chave)
+            if d is None:
+                d = {"chamadas": 0, "erros": 0, "total": 0.0, "max": 0.0,
+                     "amostras": deque(maxlen=AMOSTRAS_LATENCIA)}
+                self._dados[chave] = d
+            d["chamadas"] += 1
+            d["erros"] += int(erro)
+            d["total"] += duracao
+            d["max"] = max(d["max"], duracao)
+            d["amostras"].append(duracao)
+
+    def resumo(self) -> Dict[str, Any]:
+        with self._lock:
+            saida = {}
+            for chave, d in self._dados.items():
+                amostras = sorted(d["amostras"])
+                n = len(amostras)
+                saida[chave] = {
+                    "chamadas": d["chamadas"],
+                    "erros": d["erros"],
+                    "media_ms": round(d["total"] / d["chamadas"] * 1000, 1),
+                    "p50_ms": round(amostras[n // 2] * 1000, 1) if n else 0.0,
+                    "p95_ms": round(amostras[min(n - 1, int(n * 0.95))] * 1000, 1) if n else 0.0,
+                    "max_ms": round(d["max"] * 1000, 1),
+                }
+            return saida
+
+
+metricas_http = _Metricas()
+
+
+def conexao_nao_abriu(erro: requests.exceptions.ConnectionError) -> bool:
+    """Timeout de conexão, conexão recusada ou DNS: a requisição não saiu daqui."""
+    if isinstance(erro, requests.exceptions.ConnectTimeout):
+        return True
+    # O requests embrulha o erro do urllib3: ConnectionError(MaxRetryError(reason=...))
+    razao = getattr(erro.args[0], "reason", None) if erro.args else None
+    return isinstance(razao, NewConnectionError)
+
+
+def _repetir(metodo: str, idempotente: Optional[bool]) -> int:
+    if idempotente is None:
+        idempotente = metodo.upper() in ("GET", "HEAD")
+    return 1 + (TENTATIVAS_EXTRAS if idempotente else 0)
+
+
+class ClienteHTTP:
+    """
+    Cliente síncrono com keep-alive para uma URL base.
+    Chamadas idempotentes são repetidas em falhas de rede e 502/503/504;
+    as demais só quando a conexão nem chegou a abrir (timeout de conexão,
+    conexão recusada, DNS), porque aí o servidor com certeza não recebeu nada.
+    """
+
+    def __init__(self, base_url: str, verify: bool = True):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        self.session.verify = verify
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=TAMANHO_POOL, max_retries=0)
+        self.session.mount("http://", adaptador)
+        self.session.mount("https://", adaptador)
+
+    def request(self, metodo: str, caminho: str, idempotente: Optional[bool] = None,
+                timeout: Optional[Tuple[float, float]] = None, **kwargs) -> requests.Response:
+        rota = _rota(caminho)
+        chave = f"{metodo.upper()} {self.base_url}{rota}"
+        timeout = timeout or TIMEOUTS.get(rota, TIMEOUT_PADRAO)
+        tentativas = _repetir(metodo, idempotente)
+
+        # Falha de conexão (a requisição nem saiu) pode ser repetida sempre
+        limite_conexao = max(tentativas, 2)
+        for tentativa in range(1, limite_conexao + 1):
+            inicio = time.monotonic()
+            try:
+                resp = self.session.request(metodo, f"{self.base_url}{caminho}", timeout=timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                metricas_http.registrar(chave, time.monotonic() - inicio, erro=True)
+                limite = limite_conexao if (isinstance(e, requests.exceptions.ConnectionError)
+                                            and conexao_nao_abriu(e)) else tentativas
+                if tentativa < limite:
+                    time.sleep(ESPERA_ENTRE_TENTATIVAS * tentativa)
+                    continue
+                raise
+
+            metricas_http.registrar(chave, time.monotonic() - inicio, erro=resp.status_code >= 500)
+            if resp.status_code in STATUS_REPETIVEIS and tentativa < tentativas:
+                time.sleep(ESPERA_ENTRE_TENTATIVAS * tentativa)
+                continue
+            return resp
+
+    def get(self, caminho: str, **kwargs) -> requests.Response:
+        return self.request("GET", caminho, **kwargs)
+
+    def post(self, caminho: str, **kwargs) -> requests.Response:
+        return self.request("POST", caminho, **kwargs)
+
+
+class ClienteHTTPAsync:
+    """Mesmo contrato do ClienteHTTP, sobre httpx.AsyncClient."""
+
+    def __init__(self, base_url: str, verify: bool = True):
+        if httpx is None:
+            raise RuntimeError("httpx não instalado (pip install httpx).")
+        self.base_url = base_url.rstrip("/")
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            verify=verify,
+            limits=httpx.Limits(max_connections=TAMANHO_POOL, max_keepalive_connections=TAMANHO_POOL),
+        )
+
+    async def request(self, metodo: str, caminho: str, idempotente: Optional[bool] = None,
+                      timeout: Optional[Tuple[float, float]] = None, **kwargs) -> "httpx.Response":
+        rota = _rota(caminho)
+        chave = f"{metodo.upper()} {self.base_url}{rota}"
+        conexao, leitura = timeout or TIMEOUTS.get(rota, TIMEOUT_PADRAO)
+        limite = httpx.Timeout(leitura, connect=conexao)
+        tentativas = _repetir(metodo, idempotente)
+
+        # Falha de conexão (a requisição nem saiu) pode ser repetida sempre
+        limite_conexao = max(tentativas, 2)
+        for tentativa in range(1, limite_conexao + 1):
+            inicio = time.monotonic()
+            try:
+                resp = await self.client.request(metodo, caminho, timeout=limite, **kwargs)
+            except httpx.ConnectError:
+                metricas_http.registrar(chave, time.monotonic() - inicio, erro=True)
+                if tentativa < limite_conexao:
+                    await asyncio.sleep(ESPERA_ENTRE_TENTATIVAS * tentativa)
+                    continue
+                raise
+            except httpx.TransportError:
+                metricas_http.registrar(chave, time.monotonic() - inicio, erro=True)
+                if tentativa < tentativas:
+                    await asyncio.sleep(ESPERA_ENTRE_TENTATIVAS * tentativa)
+                    continue
+                raise
+
+            metricas_http.registrar(chave, time.monotonic() - inicio, erro=resp.status_code >= 500)
+            if resp.status_code in STATUS_REPETIVEIS and tentativa < tentativas:
+                await asyncio.sleep(ESPERA_ENTRE_TENTATIVAS * tentativa)
+                continue
+            return resp
+
+    async def get(self, caminho: str, **kwargs):
+        return await self.request("GET", caminho, **kwargs)
+
+    async def post(self, caminho: str, **kwargs):
+        return await self.request("POST", caminho, **kwargs)
+
+    async def fechar(self):
+        await self.client.aclose()
+
+
+_clientes: Dict[Tuple[str, bool], ClienteHTTP] = {}
+_clientes_async: Dict[Tuple[str, bool], ClienteHTTPAsync] = {}
+_lock_clientes = threading.Lock()
+
+
+def get_cliente(base_url: str, verify: bool = True) -> ClienteHTTP:
+    """Um pool por URL base (URL_NUVEM, URL_BOT_LOCAL...), compartilhado entre threads."""
+    chave = (base_url.rstrip("/"), verify)
+    with _lock_clientes:
+        if chave not in _clientes:
+            _clientes[chave] = ClienteHTTP(base_url, verify=verify)
+        return _clientes[chave]
+
+
+def get_cliente_async(base_url: str, verify: bool = True) -> ClienteHTTPAsync:
+    """Versão assíncrona; deve ser usada sempre a partir do mesmo event loop."""
+    chave = (base_url.rstrip("/"), verify)
+    with _lock_clientes:
+        if chave not in _clientes_async:
+            _clientes_async[chave] = ClienteHTTPAsync(base_url, verify=verify)
+        return _clientes_async[chave]
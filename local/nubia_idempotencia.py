@@ -0,0 +1,122 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Por quanto tempo um id de mensagem do WhatsApp é lembrado.
+JANELA_IDEMPOTENCIA = float(os.environ.get("NUBIA_JANELA_IDEMPOTENCIA", "600"))
+# Sem id, a chave é o conteúdo: janela curta para não engolir um "1" repetido de propósito.
+JANELA_CONTEUDO = float(os.environ.get("NUBIA_JANELA_CONTEUDO", "30"))
+MAX_CHAVES = int(os.environ.get("NUBIA_MAX_CHAVES_IDEMPOTENCIA", "20000"))
+# Quanto uma duplicata espera pelo resultado da primeira execução.
+ESPERA_DUPLICATA = 30.0
+
+
+def chave_mensagem(telefone: str, mensagem_id: Optional[str], texto: str = "",
+                   timestamp: Optional[int] = None, base64: Optional[str] = None) -> Tuple[str, float]:
+    """(chave, janela) para uma mensagem recebida: id do WhatsApp ou hash do conteúdo."""
+    if mensagem_id:
+        return f"id:{mensagem_id}", JANELA_IDEMPOTENCIA
+
+    h = hashlib.sha256()
+    for parte in (telefone, texto or "", str(timestamp or "")):
+        h.update(parte.encode("utf-8"))
+        h.update(b"\0")
+    if base64:
+        h.update(hashlib.sha256(base64.encode("ascii", "ignore")).digest())
+    return f"hash:{h.hexdigest()}", (JANELA_IDEMPOTENCIA if timestamp else JANELA_CONTEUDO)
+
+
+class _Registro:
+    __slots__ = ("evento", "resultado", "erro", "expira_em")
+
+    def __init__(self, expira_em: float):
+        self.evento = threading.Event()
+        self.resultado: Any = None
+        self.erro: Optional[BaseException] = None
+        self.expira_em = expira_em
+
+
+class RegistroIdempotencia:
+    """
+    Conjunto limitado e com janela de tempo das chaves já vistas.
+
+    A primeira chamada com uma chave executa; duplicatas esperam a primeira
+    terminar e recebem o mesmo resultado. Se a primeira falhar, as duplicatas
+    que estavam esperando recebem a mesma exceção (nada foi processado, não é
+    sucesso) e a chave é esquecida para que um reenvio possa tentar de novo.
+    """
+
+    def __init__(self, max_chaves: int = MAX_CHAVES):
+        self.max_chaves = max_chaves
+        self._lock = threading.Lock()
+        self._itens: "OrderedDict[str, _Registro]" = OrderedDict()
+        self.novas = 0
+        self.duplicadas = 0
+        self.duplicadas_em_andamento = 0
+        self.descartadas = 0
+
+    def _expirar(self, agora: float):
+        # Itens entram em ordem de chegada; janelas diferentes deixam alguns
+        # vencidos no meio, que saem quando chegarem à frente ou por tamanho.
+        while self._itens:
+            chave, reg = next(iter(self._itens.items()))
+            if reg.expira_em > agora and len(self._itens) <= self.max_chaves:
+                break
+            self._itens.popitem(last=False)
+            if reg.expira_em > agora:
+                self.descartadas += 1
+
+    def executar(self, chave: str, fn: Callable[[], Any], janela: float = JANELA_IDEMPOTENCIA) -> Tuple[Any, bool]:
+        """Retorna (resultado, duplicada)."""
+        agora = time.monotonic()
+        with self._lock:
+            self._expirar(agora)
+            reg = self._itens.get(chave)
+            if reg and reg.expira_em <= agora:
+                del self._itens[chave]
+                reg = None
+
+            if reg is None:
+                reg = _Registro(agora + janela)
+                self._itens[chave] = reg
+                self.novas += 1
+                self._expirar(agora)
+                duplicada = False
+            else:
+                self.duplicadas += 1
+                if not reg.evento.is_set():
+                    self.duplicadas_em_andamento += 1
+                duplicada = True
+
+        if duplicada:
+            reg.evento.wait(ESPERA_DUPLICATA)
+            if reg.erro is not None:
+                raise reg.erro
+            return reg.resultado, True
+
+        try:
+            resultado = fn()
+        except BaseException as e:
+            with self._lock:
+                if self._itens.get(chave) is reg:
+                    del self._itens[chave]
+            reg.erro = e
+            reg.evento.set()
+            raise
+
+        reg.resultado = resultado
+        reg.evento.set()
+        return resultado, False
+
+    def metricas(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "chaves": len(self._itens),
+                "novas": self.novas,
+                "duplicadas": self.duplicadas,
+                "duplicadas_em_andamento": self.duplicadas_em_andamento,
+                "descartadas_por_limite": self.descartadas,
+            }
@@ -0,0 +1,182 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+# Threads que rodam o encoder. Ficam fora do pool do FastAPI e das threads
+# que esperam a OpenAI: quem limita a CPU do torch é esse número.
+THREADS_INFERENCIA = int(os.environ.get("NUBIA_THREADS_INFERENCIA", "1"))
+# Threads do torch dentro de um encode (intra-op) e entre operações (inter-op).
+# 0 = núcleos divididos entre os workers e as threads de inferência.
+TORCH_INTRA = int(os.environ.get("NUBIA_TORCH_INTRA", "0"))
+TORCH_INTER = int(os.environ.get("NUBIA_TORCH_INTER", "1"))
+# Orçamento de espera na fila do encoder: passou disso, "ocupado" (429)
+# na hora, em vez de deixar a latência de todo mundo crescer.
+ESPERA_MAX_INFERENCIA = float(os.environ.get("NUBIA_ESPERA_MAX_INFERENCIA_MS", "2000")) / 1000
+CAPACIDADE_INFERENCIA = int(os.environ.get("NUBIA_CAPACIDADE_INFERENCIA", "64"))
+# Peso da última execução na média do tempo de serviço
+PESO_MEDIA = 0.2
+
+
+class InferenciaOcupada(Exception):
+    """A fila do encoder passou do orçamento de espera."""
+
+
+def configurar_torch(processos: int = 1, threads: int = THREADS_INFERENCIA) -> Tuple[int, int]:
+    """
+    Orçamento de threads do torch para este processo. Retorna (intra, inter).
+    Chamar antes de carregar o modelo (e antes do fork): o inter-op só pode
+    ser definido antes de qualquer trabalho paralelo do torch.
+    """
+    import torch
+
+    intra = TORCH_INTRA or max(1, (os.cpu_count() or 1) // max(1, processos * threads))
+    torch.set_num_threads(intra)
+    try:
+        torch.set_num_interop_threads(TORCH_INTER)
+    except RuntimeError as e:
+        print(f"[WARN] NUBIA_TORCH_INTER={TORCH_INTER} não aplicado (torch já rodou trabalho paralelo): {e}")
+    return intra, torch.get_num_interop_threads()
+
+
+class ExecutorInferencia:
+    """
+    Executor limitado para o encoder (SentenceTransformer).
+
+    A admissão estima a espera (fila x tempo médio de um encode) e recusa com
+    InferenciaOcupada quando passa do orçamento; um item que mesmo assim
+    esperou demais na fila também é recusado em vez de rodar atrasado.
+    Sem iniciar() (scripts, vetorização da base) a chamada roda direto.
+    """
+
+    def __init__(self, threads: int = THREADS_INFERENCIA, capacidade: int = CAPACIDADE_INFERENCIA,
+                 espera_max: float = ESPERA_MAX_INFERENCIA):
+        self.threads = max(1, threads)
+        self.capacidade = max(1, capacidade)
+        self.espera_max = espera_max
+        self._cond = threading.Condition()
+        self._fila: Deque[Tuple[Future, Callable, tuple, dict, float]] = deque()
+        self._ocupadas = 0
+        self._servico_medio: Optional[float] = None
+        self._iniciado = False
+        self._configurado = False
+        self.torch_threads: Tuple[int, int] = (0, 0)
+
+        self.executados = 0
+        self.recusados = 0
+        self.expirados = 0
+        self.erros = 0
+        self.espera_total = 0.0
+        self.espera_maxima = 0.0
+        self.servico_total = 0.0
+
+    def configurar(self, processos: int = 1):
+        """Threads do torch. Uma vez por processo, antes do modelo carregar (ver configurar_torch)."""
+        if self._configurado:
+            return
+        self._configurado = True
+        try:
+            self.torch_threads = configurar_torch(processos, self.threads)
+            print(f"🧮 Encoder: {self.threads} thread(s), torch intra={self.torch_threads[0]} "
+                  f"inter={self.torch_threads[1]}, espera máx {self.espera_max * 1000:.0f}ms")
+        except ImportError:
+            pass
+
+    def iniciar(self, processos: int = 1):
+        if self._iniciado:
+            return
+        self.configurar(processos)
+        self._iniciado = True
+        for i in range(self.threads):
+            threading.Thread(target=self._loop, name=f"inferencia-{i}", daemon=True).start()
+
+    def espera_estimada(self) -> float:
+        with self._cond:
+            return self._espera_estimada()
+
+    def _espera_estimada(self) -> float:
+        if self._servico_medio is None:
+            return 0.0
+        return (len(self._fila) + self._ocupadas) * self._servico_medio / self.threads
+
+    def ocupado(self) -> bool:
+        """Um item novo passaria do orçamento de espera?"""
+        with self._cond:
+            return self._ocupado()
+
+    def _ocupado(self) -> bool:
+        return len(self._fila) >= self.capacidade or self._espera_estimada() > self.espera_max
+
+    def submeter(self, fn: Callable, *args, **kwargs) -> Future:
+        futuro: Future = Future()
+        with self._cond:
+            if self._ocupado():
+                self.recusados += 1
+                raise InferenciaOcupada(f"encoder ocupado (espera estimada {self._espera_estimada():.1f}s)")
+            self._fila.append((futuro, fn, args, kwargs, time.monotonic()))
+            self._cond.notify()
+        return futuro
+
+    def executar(self, fn: Callable, *args, **kwargs) -> Any:
+        if not self._iniciado:
+            return fn(*args, **kwargs)
+        return self.submeter(fn, *args, **kwargs).result()
+
+    def codificar(self, modelo, textos, **kwargs) -> Any:
+        """modelo.encode(textos, ...) pelo executor."""
+        return self.executar(modelo.encode, textos, **kwargs)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._fila:
+                    self._cond.wait()
+                futuro, fn, args, kwargs, enfileirado_em = self._fila.popleft()
+                espera = time.monotonic() - enfileirado_em
+                if espera > self.espera_max:
+                    self.expirados += 1
+                    futuro.set_exception(InferenciaOcupada(f"encoder ocupado (esperou {espera:.1f}s)"))
+                    continue
+                self._ocupadas += 1
+                self.espera_total += espera
+                self.espera_maxima = max(self.espera_maxima, espera)
+
+            inicio = time.monotonic()
+            try:
+                futuro.set_result(fn(*args, **kwargs))
+                erro = False
+            except BaseException as e:
+                futuro.set_exception(e)
+                erro = True
+            duracao = time.monotonic() - inicio
+
+            with self._cond:
+                self._ocupadas -= 1
+                self.executados += 1
+                self.erros += int(erro)
+                self.servico_total += duracao
+                self._servico_medio = duracao if self._servico_medio is None else (
+                    (1 - PESO_MEDIA) * self._servico_medio + PESO_MEDIA * duracao)
+
+    def metricas(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "threads": self.threads,
+                "torch_intra": self.torch_threads[0],
+                "torch_inter": self.torch_threads[1],
+                "na_fila": len(self._fila),
+                "em_execucao": self._ocupadas,
+                "espera_estimada_ms": round(self._espera_estimada() * 1000, 1),
+                "executados": self.executados,
+                "recusados": self.recusados,
+                "expirados": self.expirados,
+                "erros": self.erros,
+                "espera_media_ms": round(self.espera_total / self.executados * 1000, 1) if self.executados else 0.0,
+                "espera_max_ms": round(self.espera_maxima * 1000, 1),
+                "servico_medio_ms": round(self.servico_total / self.executados * 1000, 1) if self.executados else 0.0,
+            }
+
+
+executor_inferencia = ExecutorInferencia()
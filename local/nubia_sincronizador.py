@@ -0,0 +1,234 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+# Um lote sai quando junta TAMANHO_LOTE eventos ou a cada INTERVALO_LOTE segundos.
+TAMANHO_LOTE = int(os.environ.get("NUBIA_TAMANHO_LOTE_SYNC", "50"))
+INTERVALO_LOTE = float(os.environ.get("NUBIA_INTERVALO_LOTE_SYNC", "2"))
+# Outbox em disco: sobrevive a queda da nuvem e a restart do serviço local.
+OUTBOX_PATH = os.environ.get("NUBIA_OUTBOX_PATH", "nubia_outbox.db")
+# Teto de eventos não enviados (nuvem fora do ar por dias): os mais antigos são descartados.
+MAX_PENDENTES = int(os.environ.get("NUBIA_OUTBOX_MAX_PENDENTES", "200000"))
+# Eventos já enviados ficam esse tempo no outbox (auditoria/reenvio manual) e depois saem.
+RETENCAO_ENVIADOS_SEG = float(os.environ.get("NUBIA_OUTBOX_RETENCAO_HORAS", "24")) * 3600
+INTERVALO_COMPACTACAO = 300.0
+
+SCHEMA = """
+create table if not exists outbox (
+    seq integer primary key autoincrement,
+    telefone text,
+    payload text not null,
+    criado_em real not null,
+    enviado_em real,
+    rejeitado integer not null default 0
+);
+create index if not exists outbox_pendentes_idx on outbox (seq) where enviado_em is null;
+create index if not exists outbox_enviados_idx on outbox (enviado_em) where enviado_em is not null;
+create table if not exists outbox_meta (
+    chave text primary key,
+    valor text not null
+);
+"""
+
+
+class BufferSincronizacao:
+    """
+    Outbox durável do log de conversas para a nuvem.
+
+    adicionar() só grava uma linha num SQLite local (WAL), então o caminho da
+    mensagem nunca espera a nuvem. Uma thread drena o outbox em ordem de
+    chegada para /sync/mensagens_lote (ordem global = ordem por telefone),
+    com backoff enquanto a nuvem está fora. Um evento que a nuvem recusa
+    (4xx) vai para o canto como 'rejeitado' em vez de travar a fila.
+
+    A entrega é pelo menos uma vez (resposta perdida, queda entre o POST e a
+    marcação): cada evento vai com a chave "<origem>:<seq>", e a nuvem ignora
+    a que já gravou. A origem é sorteada na criação do arquivo, então um
+    outbox novo nunca repete a chave de um antigo.
+    """
+
+    def __init__(self, nuvem, caminho: str = OUTBOX_PATH, tamanho_lote: int = TAMANHO_LOTE,
+                 intervalo: float = INTERVALO_LOTE, instancia: Optional[str] = None):
+        self.nuvem = nuvem
+        self.instancia = instancia
+        self.caminho = caminho
+        self.tamanho_lote = tamanho_lote
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._acordar = threading.Event()
+        self._thread = None
+        self._lote_suportado = True
+        self._ultima_compactacao = 0.0
+
+        self._conn = None
+        self.origem: Optional[str] = None
+        self.abrir()
+
+        self.recuperados = self._pendentes
+        self.adicionados = 0
+        self.enviados = 0
+        self.lotes = 0
+        self.falhas = 0
+        self.descartados = 0
+        self.rejeitados = 0
+
+    def abrir(self):
+        """
+        (Re)abre o outbox. Com vários workers (nubia_workers) o pai fecha antes
+        do fork e cada worker abre a sua conexão: todos gravam no mesmo
+        arquivo, só o worker principal envia.
+        """
+        with self._lock:
+            self._conn = sqlite3.connect(self.caminho, check_same_thread=False, isolation_level=None)
+            self._conn.execute("pragma busy_timeout=5000")
+            self._conn.execute("pragma auto_vacuum=incremental")
+            self._conn.execute("pragma journal_mode=wal")
+            self._conn.execute("pragma synchronous=normal")
+            self._conn.executescript(SCHEMA)
+            # Vários workers podem abrir ao mesmo tempo: o primeiro grava, todos leem
+            self._conn.execute("insert or ignore into outbox_meta (chave, valor) values ('origem', ?)",
+                               (f"{self.instancia or 'local'}-{uuid.uuid4().hex[:12]}",))
+            self.origem = self._conn.execute("select valor from outbox_meta where chave = 'origem'").fetchone()[0]
+            self._pendentes = self._contar_pendentes()
+
+    def fechar(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _contar_pendentes(self) -> int:
+        return self._conn.execute("select count(*) from outbox where enviado_em is null").fetchone()[0]
+
+    def iniciar(self):
+        if self._thread is None:
+            if self.recuperados:
+                print(f"📦 Outbox: {self.recuperados} eventos pendentes de antes do restart")
+            self._thread = threading.Thread(target=self._loop, name="sync-nuvem", daemon=True)
+            self._thread.start()
+
+    def adicionar(self, payload: Dict[str, Any]):
+        payload.setdefault("created_at", datetime.now().isoformat())
+        if self.instancia:
+            payload.setdefault("instancia", self.instancia)
+        linha = (payload.get("telefone"), json.dumps(payload, ensure_ascii=False), time.time())
+        with self._lock:
+            self._conn.execute("insert into outbox (telefone, payload, criado_em) values (?, ?, ?)", linha)
+            self._pendentes += 1
+            self.adicionados += 1
+            cheio = self._pendentes >= self.tamanho_lote
+        if cheio:
+            self._acordar.set()
+
+    # --- outbox ---
+    def _proximo_lote(self) -> List[Tuple[int, str]]:
+        with self._lock:
+            # Outros workers também gravam no arquivo: o contador vem do disco
+            self._pendentes = self._contar_pendentes()
+            return self._conn.execute(
+                "select seq, payload from outbox where enviado_em is null order by seq limit ?",
+                (self.tamanho_lote,)).fetchall()
+
+    def _marcar(self, seqs: List[int], rejeitado: bool = False):
+        if not seqs:
+            return
+        with self._lock:
+            self._conn.execute(
+                f"update outbox set enviado_em = ?, rejeitado = ? where seq in ({', '.join('?' * len(seqs))})",
+                [time.time(), int(rejeitado)] + seqs)
+            self._pendentes -= len(seqs)
+            if rejeitado:
+                self.rejeitados += len(seqs)
+            else:
+                self.enviados += len(seqs)
+
+    def _compactar(self):
+        """Retenção dos enviados, teto de pendentes e devolução do espaço ao disco."""
+        with self._lock:
+            apagados = self._conn.execute("delete from outbox where enviado_em < ?",
+                                          (time.time() - RETENCAO_ENVIADOS_SEG,)).rowcount
+            excesso = self._pendentes - MAX_PENDENTES
+            if excesso > 0:
+                self._conn.execute("delete from outbox where seq in (select seq from outbox "
+                                   "where enviado_em is null order by seq limit ?)", (excesso,))
+                self._pendentes -= excesso
+                self.descartados += excesso
+                print(f"[WARN] Outbox cheio: {excesso} eventos mais antigos descartados")
+            if apagados or excesso > 0:
+                self._conn.execute("pragma incremental_vacuum")
+            self._conn.execute("pragma wal_checkpoint(truncate)")
+        self._ultima_compactacao = time.monotonic()
+
+    # --- envio ---
+    def _enviar(self, linhas: List[Tuple[int, str]]):
+        lote = [{**json.loads(p), "chave": f"{self.origem}:{seq}"} for seq, p in linhas]
+        if self._lote_suportado:
+            res = self.nuvem.post("/sync/mensagens_lote", json=lote)
+            if res.status_code == 404:
+                print("[WARN] Nuvem sem /sync/mensagens_lote. Enviando uma a uma.")
+                self._lote_suportado = False
+            elif res.status_code != 422:
+                res.raise_for_status()
+                self._marcar([seq for seq, _ in linhas])
+                return
+            # 422: algum evento do lote é inválido; um a um para isolar qual
+
+        for (seq, _), payload in zip(linhas, lote):
+            res = self.nuvem.post("/sync/mensagem", json=payload)
+            if 400 <= res.status_code < 500 and res.status_code not in (404, 408, 429):
+                print(f"[WARN] Nuvem recusou evento #{seq} ({res.status_code}): {res.text[:200]}")
+                self._marcar([seq], rejeitado=True)
+                continue
+            res.raise_for_status()
+            if not res.json().get("ok", True):
+                raise RuntimeError(res.json().get("error"))
+            # Marca um a um: numa falha no meio, os anteriores não voltam
+            self._marcar([seq])
+
+    def _loop(self):
+        falhas_seguidas = 0
+        while True:
+            if self._pendentes < self.tamanho_lote:
+                self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+
+            if time.monotonic() - self._ultima_compactacao > INTERVALO_COMPACTACAO:
+                try:
+                    self._compactar()
+                except sqlite3.Error as e:
+                    print(f"[WARN] Falha ao compactar outbox: {e}")
+
+            linhas = self._proximo_lote()
+            if not linhas:
+                continue
+            try:
+                self._enviar(linhas)
+                falhas_seguidas = 0
+                with self._lock:
+                    self.lotes += 1
+            except Exception as e:
+                falhas_seguidas += 1
+                print(f"Erro sync nuvem (lote de {len(linhas)}, {self._pendentes} no outbox): {e}")
+                with self._lock:
+                    self.falhas += 1
+                # Nada a devolver: o que não foi marcado continua no outbox, na mesma ordem
+                time.sleep(min(30, 2 ** min(falhas_seguidas, 5)))
+
+    def metricas(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "pendentes": self._pendentes,
+                "recuperados": self.recuperados,
+                "adicionados": self.adicionados,
+                "enviados": self.enviados,
+                "lotes": self.lotes,
+                "falhas": self.falhas,
+                "rejeitados": self.rejeitados,
+                "descartados": self.descartados,
+                "outbox_bytes": os.path.getsize(self.caminho) if os.path.exists(self.caminho) else 0,
+            }
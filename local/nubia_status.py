@@ -0,0 +1,112 @@
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+# Rede de segurança: mesmo sem aviso da nuvem, um status nunca vive mais que isso.
+TTL_STATUS = float(os.environ.get("NUBIA_TTL_STATUS", "30"))
+ESPERA_LONG_POLL = 25
+
+STATUS_HUMANO = ("atendimento", "fila", "humano")
+
+
+class CacheStatus:
+    """
+    Cache local de /sync/status_conversa por telefone.
+
+    É atualizado pelas nossas próprias transferências e pelo feed
+    /sync/status_mudancas da nuvem (quando um atendente assume ou encerra).
+    """
+
+    def __init__(self, ttl: float = TTL_STATUS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._dados: Dict[str, tuple] = {}  # telefone -> (status, setor, expira_em)
+        self.acertos = 0
+        self.faltas = 0
+        self.atualizacoes_push = 0
+        self.resets = 0
+
+    def obter(self, telefone: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            item = self._dados.get(telefone)
+            if item and item[2] > time.monotonic():
+                self.acertos += 1
+                return {"status": item[0], "setor_responsavel": item[1]}
+            if item:
+                del self._dados[telefone]
+            self.faltas += 1
+            return None
+
+    def gravar(self, telefone: str, status: str, setor: Optional[str] = None, push: bool = False):
+        with self._lock:
+            self._dados[telefone] = (status, setor, time.monotonic() + self.ttl)
+            if push:
+                self.atualizacoes_push += 1
+
+    def invalidar(self, telefone: str):
+        with self._lock:
+            self._dados.pop(telefone, None)
+
+    def limpar(self):
+        with self._lock:
+            self._dados.clear()
+            self.resets += 1
+
+    def metricas(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.acertos + self.faltas
+            return {
+                "itens": len(self._dados),
+                "acertos": self.acertos,
+                "faltas": self.faltas,
+                "taxa_acerto": round(self.acertos / total, 3) if total else 0.0,
+                "atualizacoes_push": self.atualizacoes_push,
+                "resets": self.resets,
+                "ttl_seg": self.ttl,
+            }
+
+
+cache_status = CacheStatus()
+
+
+def consultar_status(nuvem, telefone: str) -> str:
+    """Status da conversa ('robo', 'fila', ...), do cache ou da nuvem. Erros sobem."""
+    em_cache = cache_status.obter(telefone)
+    if em_cache:
+        return em_cache["status"]
+
+    res_status = nuvem.get(f"/sync/status_conversa/{telefone}")
+    res_status.raise_for_status()
+    dados = res_status.json()
+    status = dados.get("status", "robo")
+    cache_status.gravar(telefone, status, dados.get("setor_responsavel"))
+    return status
+
+
+def loop_mudancas_status(nuvem):
+    """Consome o long-poll de mudanças de status e mantém o cache em dia."""
+    print("🔔 Ouvinte de status iniciado...")
+    cursor, epoca, falhas = 0, None, 0
+    while True:
+        try:
+            params = {"cursor": cursor, "timeout": ESPERA_LONG_POLL}
+            if epoca:
+                params["epoca"] = epoca
+            res = nuvem.get("/sync/status_mudancas", params=params, timeout=(3, ESPERA_LONG_POLL + 10))
+            res.raise_for_status()
+            dados = res.json()
+
+            if dados.get("reset"):
+                cache_status.limpar()
+            for m in dados.get("mudancas", []):
+                cache_status.gravar(m["telefone"], m["status"], m.get("setor_responsavel"), push=True)
+
+            cursor, epoca, falhas = dados.get("cursor", cursor), dados.get("epoca"), 0
+        except Exception as e:
+            # Sem feed não dá para confiar em nada além do TTL
+            falhas += 1
+            if falhas == 1:
+                print(f"[WARN] Feed de status indisponível: {e}")
+                cache_status.limpar()
+            time.sleep(min(30, 2 ** min(falhas, 5)))
@@ -0,0 +1,214 @@
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+import zlib
+from multiprocessing.sharedctypes import RawArray
+from typing import Any, Callable, Dict, Optional
+
+import uvicorn
+
+# Processos servindo a porta 8000. 1 = um processo só (modo de sempre).
+WORKERS = int(os.environ.get("NUBIA_WORKERS", "1"))
+# Cada worker também escuta em 127.0.0.1:PORTA_INTERNA_BASE + índice, por onde
+# recebe dos irmãos as mensagens das conversas que são dele (ver dono()).
+PORTA_INTERNA_BASE = int(os.environ.get("NUBIA_PORTA_INTERNA_BASE", "8100"))
+ESPERA_REINICIO = 1.0
+
+_indice = 0
+_total = 1
+_pids = None  # RawArray com o pid de cada worker (memória compartilhada com o pai)
+_pid_pai = None
+
+
+def indice() -> int:
+    return _indice
+
+
+def total() -> int:
+    return _total
+
+
+def principal() -> bool:
+    """Só o worker 0 roda as tarefas únicas (envio do outbox, carteiro)."""
+    return _indice == 0
+
+
+def dono(chave: str) -> int:
+    """
+    Worker dono de uma conversa. Sessão, agrupador, locks e idempotência são
+    por processo, então todas as mensagens de um telefone vão para o mesmo.
+    """
+    return zlib.crc32(chave.encode("utf-8")) % _total
+
+
+def url_interna(i: int) -> str:
+    return f"http://127.0.0.1:{PORTA_INTERNA_BASE + i}"
+
+
+# --- memória ---
+def memoria_processo(pid: Optional[int] = None) -> Dict[str, int]:
+    """
+    Memória de um processo em KB. No Linux (smaps_rollup) vem com PSS, que
+    divide as páginas compartilhadas (modelo, vetores) entre os processos que
+    as usam, e a parte privada (o custo de um worker a mais): somar os PSS
+    dá o uso real da máquina.
+    """
+    base = f"/proc/{pid or 'self'}"
+    try:
+        with open(f"{base}/smaps_rollup") as f:
+            campos = dict(linha.split(":", 1) for linha in f if ":" in linha and not linha.startswith(" "))
+        kb = {nome: int(valor.split()[0]) for nome, valor in campos.items() if valor.strip().endswith("kB")}
+        return {
+            "rss_kb": kb.get("Rss", 0),
+            "pss_kb": kb.get("Pss", 0),
+            "compartilhada_kb": kb.get("Shared_Clean", 0) + kb.get("Shared_Dirty", 0),
+            "privada_kb": kb.get("Private_Clean", 0) + kb.get("Private_Dirty", 0),
+        }
+    except (OSError, ValueError):
+        pass
+    try:
+        with open(f"{base}/status") as f:
+            for linha in f:
+                if linha.startswith("VmRSS:"):
+                    return {"rss_kb": int(linha.split()[1])}
+    except (OSError, ValueError):
+        pass
+    if pid is None:
+        try:
+            import resource
+            pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return {"rss_pico_kb": pico // 1024 if sys.platform == "darwin" else pico}
+        except ImportError:  # Windows
+            pass
+    return {}
+
+
+def memoria_workers() -> Dict[str, Any]:
+    """Memória do pai e de cada worker, para dimensionar a máquina pelo número de workers."""
+    if _pids is None:
+        return {"workers": [{"indice": 0, "pid": os.getpid(), **memoria_processo()}]}
+    processos = [{"indice": i, "pid": pid, **memoria_processo(pid)} for i, pid in enumerate(_pids) if pid]
+    pai = {"pid": _pid_pai, **memoria_processo(_pid_pai)}
+    return {
+        "pai": pai,
+        "workers": processos,
+        "pss_total_kb": pai.get("pss_kb", 0) + sum(p.get("pss_kb", 0) for p in processos),
+    }
+
+
+# --- compartilhamento ---
+def compartilhar_tensores(modelo, cerebro: Dict[str, Any]):
+    """
+    Pesos do modelo e vetores da base em memória compartilhada (torch) antes
+    do fork: nenhum worker ganha cópia própria, nem quando o torch escreve
+    em cima de uma página (o copy-on-write puro copiaria).
+    """
+    if modelo is not None and hasattr(modelo, "share_memory"):
+        modelo.share_memory()
+    for dados in cerebro.values():
+        vetores = dados.get("vetores") if isinstance(dados, dict) else None
+        if hasattr(vetores, "share_memory_"):
+            vetores.share_memory_()
+
+
+# --- processos ---
+def _socket(host: str, porta: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, porta))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _iniciar_worker(app, i: int, compartilhado: socket.socket) -> int:
+    pid = os.fork()
+    if pid:
+        _pids[i] = pid
+        return pid
+
+    # --- filho ---
+    global _indice
+    _indice = i
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    codigo = 0
+    try:
+        interno = _socket("127.0.0.1", PORTA_INTERNA_BASE + i)
+        print(f"👷 Worker {i} (pid {os.getpid()}) no ar. Porta interna {PORTA_INTERNA_BASE + i}.")
+        uvicorn.Server(uvicorn.Config(app, lifespan="on")).run(sockets=[compartilhado, interno])
+    except BaseException as e:
+        print(f"❌ Worker {i} caiu: {e}")
+        codigo = 1
+    finally:
+        sys.stdout.flush()
+        os._exit(codigo)
+
+
+def servir(app, host: str = "0.0.0.0", porta: int = 8000, workers: int = WORKERS,
+           preparar: Optional[Callable[[], None]] = None):
+    """
+    Sobe a API local. Com workers > 1, o pai roda preparar() (modelo e
+    cérebro), congela o heap e faz fork dos workers, que herdam tudo já
+    carregado e aceitam conexões no mesmo socket. O pai só vigia: worker que
+    morre é substituído. Sem fork (Windows), roda um processo só.
+    """
+    if workers > 1 and not hasattr(os, "fork"):
+        print("[WARN] NUBIA_WORKERS > 1 precisa de fork (Linux/macOS). Rodando um processo só.")
+        workers = 1
+    if workers <= 1:
+        uvicorn.run(app, host=host, port=porta)
+        return
+
+    global _total, _pids, _pid_pai
+    _total = workers
+    _pids = RawArray("i", workers)
+    _pid_pai = os.getpid()
+    # Tokenizer com threads próprias não sobrevive ao fork
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+    if preparar is not None:
+        preparar()
+    # Objetos carregados até aqui não são mais varridos pelo GC: sem isso o
+    # GC escreve nos cabeçalhos e cada worker acaba copiando as páginas.
+    gc.collect()
+    gc.freeze()
+
+    compartilhado = _socket(host, porta)
+    print(f"🏭 {workers} workers em {host}:{porta} (pai pid {_pid_pai}).")
+    filhos: Dict[int, int] = {}
+    for i in range(workers):
+        filhos[_iniciar_worker(app, i, compartilhado)] = i
+
+    def encerrar(signum, frame):
+        print("🛑 Encerrando workers...")
+        for pid in list(filhos):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in list(filhos):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, encerrar)
+    signal.signal(signal.SIGINT, encerrar)
+
+    while True:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            return
+        i = filhos.pop(pid, None)
+        if i is None:
+            continue
+        print(f"⚠️ Worker {i} (pid {pid}) saiu com status {status}. Subindo outro...")
+        _pids[i] = 0
+        time.sleep(ESPERA_REINICIO)
+        filhos[_iniciar_worker(app, i, compartilhado)] = i
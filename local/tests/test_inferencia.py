@@ -0,0 +1,125 @@
+import sys
+import threading
+import time
+
+import pytest
+
+import nubia_inferencia
+from nubia_inferencia import ExecutorInferencia, InferenciaOcupada, configurar_torch
+
+
+def _travar(executor: ExecutorInferencia) -> threading.Event:
+    """Ocupa a única thread do executor até o evento ser liberado."""
+    liberar = threading.Event()
+    comecou = threading.Event()
+
+    def trabalho():
+        comecou.set()
+        liberar.wait(5)
+
+    executor.submeter(trabalho)
+    assert comecou.wait(5)
+    return liberar
+
+
+def test_sem_iniciar_roda_direto():
+    executor = ExecutorInferencia(threads=1)
+    assert executor.executar(lambda x: x * 2, 21) == 42
+    assert executor.metricas()["executados"] == 0
+
+
+def test_recusa_quando_a_fila_enche():
+    executor = ExecutorInferencia(threads=1, capacidade=2, espera_max=60)
+    executor.iniciar()
+    liberar = _travar(executor)
+
+    futuros = [executor.submeter(lambda i=i: i) for i in range(2)]
+    assert executor.ocupado()
+    with pytest.raises(InferenciaOcupada):
+        executor.submeter(lambda: None)
+
+    liberar.set()
+    assert [f.result(5) for f in futuros] == [0, 1]
+    assert executor.metricas()["recusados"] == 1
+
+
+def test_recusa_pela_espera_estimada():
+    executor = ExecutorInferencia(threads=1, capacidade=100, espera_max=0.15)
+    executor.iniciar()
+    executor.executar(time.sleep, 0.1)  # tempo médio de serviço ~100 ms
+
+    liberar = _travar(executor)
+    aceito = executor.submeter(lambda: "ok")  # 1 em execução: espera ~0.1s
+    with pytest.raises(InferenciaOcupada):
+        executor.submeter(lambda: None)      # 1 + 1 na fila: ~0.2s > 0.15s
+
+    liberar.set()
+    assert aceito.result(5) == "ok"
+
+
+def test_item_que_esperou_demais_expira():
+    executor = ExecutorInferencia(threads=1, capacidade=10, espera_max=0.05)
+    executor.iniciar()
+    liberar = _travar(executor)
+
+    atrasado = executor.submeter(lambda: "tarde demais")
+    time.sleep(0.15)
+    liberar.set()
+
+    with pytest.raises(InferenciaOcupada):
+        atrasado.result(5)
+    metricas = executor.metricas()
+    assert metricas["expirados"] == 1
+    assert metricas["executados"] == 1  # só o que travava
+
+
+def test_erro_da_funcao_chega_ao_chamador():
+    executor = ExecutorInferencia(threads=1)
+    executor.iniciar()
+
+    def falhar():
+        raise ValueError("modelo quebrou")
+
+    with pytest.raises(ValueError):
+        executor.executar(falhar)
+    assert executor.metricas()["erros"] == 1
+
+
+class _TorchFalso:
+    """Só o que configurar_torch usa; o inter-op recusa como o torch depois do primeiro trabalho paralelo."""
+
+    def __init__(self):
+        self.intra = None
+
+    def set_num_threads(self, n):
+        self.intra = n
+
+    def set_num_interop_threads(self, n):
+        raise RuntimeError("Error: cannot set number of interop threads after parallel work has started")
+
+    def get_num_interop_threads(self):
+        return 8
+
+
+def test_inter_op_recusado_vira_aviso(monkeypatch, capsys):
+    torch = _TorchFalso()
+    monkeypatch.setitem(sys.modules, "torch", torch)
+
+    intra, inter = configurar_torch(processos=1, threads=1)
+
+    assert intra == torch.intra
+    assert inter == 8
+    assert "[WARN] NUBIA_TORCH_INTER" in capsys.readouterr().out
+
+
+def test_configurar_roda_uma_vez_e_iniciar_nao_refaz(monkeypatch):
+    chamadas = []
+    monkeypatch.setattr(nubia_inferencia, "configurar_torch",
+                        lambda processos, threads: chamadas.append(processos) or (2, 1))
+    executor = ExecutorInferencia(threads=1)
+
+    executor.configurar(processos=4)
+    executor.iniciar(processos=4)
+
+    assert chamadas == [4]
+    assert executor.torch_threads == (2, 1)
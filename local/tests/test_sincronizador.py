@@ -0,0 +1,124 @@
+import json
+
+import pytest
+
+from nubia_sincronizador import BufferSincronizacao
+
+
+class _Resposta:
+    def __init__(self, status_code: int = 200, corpo=None):
+        self.status_code = status_code
+        self._corpo = corpo if corpo is not None else {"ok": True}
+        self.text = json.dumps(self._corpo)
+
+    def json(self):
+        return self._corpo
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+class _Nuvem:
+    """Registra o que o outbox manda; `falhar` faz o próximo POST cair."""
+
+    def __init__(self):
+        self.lotes = []
+        self.avulsas = []
+        self.falhar = False
+        self.status_lote = 200
+
+    def post(self, caminho, json=None):
+        if self.falhar:
+            self.falhar = False
+            raise ConnectionError("nuvem fora do ar")
+        if caminho == "/sync/mensagens_lote":
+            self.lotes.append(json)
+            return _Resposta(self.status_lote)
+        self.avulsas.append(json)
+        return _Resposta(400 if json.get("texto") == "inválida" else 200)
+
+
+def _drenar(buffer: BufferSincronizacao):
+    while True:
+        linhas = buffer._proximo_lote()
+        if not linhas:
+            return
+        buffer._enviar(linhas)
+
+
+@pytest.fixture
+def caminho(tmp_path):
+    return str(tmp_path / "outbox.db")
+
+
+def test_envia_em_ordem_com_chave_por_evento(caminho):
+    nuvem = _Nuvem()
+    buffer = BufferSincronizacao(nuvem, caminho, tamanho_lote=3, instancia="num1")
+    for i in range(7):
+        buffer.adicionar({"telefone": f"55{i % 2}", "texto": f"m{i}"})
+
+    _drenar(buffer)
+
+    enviados = [e for lote in nuvem.lotes for e in lote]
+    assert [len(lote) for lote in nuvem.lotes] == [3, 3, 1]
+    assert [e["texto"] for e in enviados] == [f"m{i}" for i in range(7)]
+    assert [e["chave"] for e in enviados] == [f"{buffer.origem}:{i}" for i in range(1, 8)]
+    assert all(e["instancia"] == "num1" for e in enviados)
+    assert buffer.metricas()["pendentes"] == 0
+
+
+def test_reabrir_reenvia_pendentes_com_as_mesmas_chaves(caminho):
+    nuvem = _Nuvem()
+    buffer = BufferSincronizacao(nuvem, caminho, tamanho_lote=10)
+    for i in range(3):
+        buffer.adicionar({"telefone": "551", "texto": f"m{i}"})
+
+    # Queda no meio do envio: nada marcado, tudo continua no outbox
+    nuvem.falhar = True
+    with pytest.raises(ConnectionError):
+        buffer._enviar(buffer._proximo_lote())
+    origem = buffer.origem
+    buffer.fechar()
+
+    reaberto = BufferSincronizacao(nuvem, caminho, tamanho_lote=10)
+    assert reaberto.recuperados == 3
+    assert reaberto.origem == origem
+    reaberto.adicionar({"telefone": "551", "texto": "m3"})
+    _drenar(reaberto)
+
+    enviados = nuvem.lotes[-1]
+    assert [e["texto"] for e in enviados] == ["m0", "m1", "m2", "m3"]
+    assert [e["chave"] for e in enviados] == [f"{origem}:{i}" for i in range(1, 5)]
+
+
+def test_enviados_nao_voltam_depois_de_reabrir(caminho):
+    nuvem = _Nuvem()
+    buffer = BufferSincronizacao(nuvem, caminho)
+    buffer.adicionar({"telefone": "551", "texto": "m0"})
+    _drenar(buffer)
+    buffer.fechar()
+
+    reaberto = BufferSincronizacao(nuvem, caminho)
+    assert reaberto.recuperados == 0
+    assert reaberto._proximo_lote() == []
+
+
+def test_arquivo_novo_tem_outra_origem(tmp_path):
+    a = BufferSincronizacao(_Nuvem(), str(tmp_path / "a.db"))
+    b = BufferSincronizacao(_Nuvem(), str(tmp_path / "b.db"))
+    assert a.origem != b.origem
+
+
+def test_evento_recusado_nao_trava_a_fila(caminho):
+    nuvem = _Nuvem()
+    nuvem.status_lote = 422
+    buffer = BufferSincronizacao(nuvem, caminho)
+    for texto in ("m0", "inválida", "m2"):
+        buffer.adicionar({"telefone": "551", "texto": texto})
+
+    _drenar(buffer)
+
+    assert [e["texto"] for e in nuvem.avulsas] == ["m0", "inválida", "m2"]
+    metricas = buffer.metricas()
+    assert (metricas["enviados"], metricas["rejeitados"], metricas["pendentes"]) == (2, 1, 0)